@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import argparse
 import csv
 import os
 import random
@@ -136,12 +137,12 @@ def write_locations(org_ids: List[int], n: int = 20) -> List[int]:
     return ids
 
 
-def write_providers(n: int = 30) -> List[int]:
+def write_providers(location_ids: List[int], n: int = 30) -> List[int]:
     path = OUT_DIR / "provider.csv"
     ids = []
     with path.open("w", newline="") as f:
         w = csv.writer(f)
-        w.writerow(["provider_id","hpii","name_given","name_family","role","specialty","status"])
+        w.writerow(["provider_id","hpii","name_given","name_family","role","specialty","status","location_id"])
         for i in range(1, n+1):
             pid = i
             ids.append(pid)
@@ -154,7 +155,8 @@ def write_providers(n: int = 30) -> List[int]:
                 family,
                 random.choice(ROLES),
                 random.choice(SPECIALTIES),
-                random.choice(["active","inactive"])])
+                random.choice(["active","inactive"]),
+                random.choice(location_ids)])
     return ids
 
 
@@ -386,21 +388,33 @@ def write_consents(patient_ids: List[int], n: int = 80):
 
 
 def main():
+    global OUT_DIR
+    parser = argparse.ArgumentParser(description="Generate demo CSVs")
+    parser.add_argument("--patients", type=int, default=50, help="Patient count; per-patient tables scale with it")
+    parser.add_argument("--out", default=str(OUT_DIR), help="Output directory")
+    parser.add_argument("--providers", type=int, default=30, help="Provider directory size")
+    args = parser.parse_args()
+    OUT_DIR = Path(args.out)
+    n = args.patients
+
+    def per_patient(count: int) -> int:
+        return max(1, count * n // 50)
+
     mk_dirs()
-    patient_ids = write_patients(50)
+    patient_ids = write_patients(n)
     org_ids = write_organizations(10)
     location_ids = write_locations(org_ids, 20)
-    provider_ids = write_providers(30)
-    encounter_ids = write_encounters(patient_ids, location_ids, org_ids, 500)
-    write_observations(patient_ids, encounter_ids, provider_ids, 500)
-    write_medication_requests(patient_ids, encounter_ids, provider_ids, 200)
-    write_care_plans(patient_ids, 80)
-    write_tasks(patient_ids, 300)
-    write_consents(patient_ids, 80)
-    write_questionnaire_responses(patient_ids, 150)
-    write_sdoh_assessments(patient_ids, 120)
-    write_referrals(patient_ids, org_ids, provider_ids, 100)
-    write_document_references(patient_ids, 80)
+    provider_ids = write_providers(location_ids, args.providers)
+    encounter_ids = write_encounters(patient_ids, location_ids, org_ids, per_patient(500))
+    write_observations(patient_ids, encounter_ids, provider_ids, per_patient(500))
+    write_medication_requests(patient_ids, encounter_ids, provider_ids, per_patient(200))
+    write_care_plans(patient_ids, per_patient(80))
+    write_tasks(patient_ids, per_patient(300))
+    write_consents(patient_ids, per_patient(80))
+    write_questionnaire_responses(patient_ids, per_patient(150))
+    write_sdoh_assessments(patient_ids, per_patient(120))
+    write_referrals(patient_ids, org_ids, provider_ids, per_patient(100))
+    write_document_references(patient_ids, per_patient(80))
     print(f"CSV files generated in {OUT_DIR}")
 
 
@@ -0,0 +1,309 @@
+"""Per-patient Epic context cache kept current from the mock's change feed.
+
+HD steps read the same patient bundle and searches over and over. This cache
+keeps those results per patient and learns what changed from
+``epic.changes.since`` (polled inside the step's own JSON-RPC batch) or, when
+the Epic mock is a shared socket server, from ``epic.changes`` notifications
+pushed to a subscribed connection. A change to a patient then:
+
+- drops that patient's cached searches of the changed resource type;
+- marks the changed resource for patching into the cached bundle, fetched
+  with one ``epic.resource.get_many`` the next time the bundle is used
+  (types a bundle only samples, such as Encounter, drop the bundle instead).
+
+An unknown epoch (the mock restarted) or a cursor the mock no longer has
+history for clears everything. Applied changes also clear the transport's
+read-through ``MCPCache``, whose TTL would otherwise hide writes made by other
+processes.
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from libs.common.mcp_client import MCPCache, MCPClient, MCPError, get_cache
+from libs.common.mcp_server import LOST_METHOD, parse_socket_address
+
+Call = Tuple[str, Dict[str, Any]]
+
+# Reads served from the cache; anything else always goes to the server.
+CACHED_METHODS = frozenset({"epic.patient_bundle.get", "epic.search"})
+
+# Types a patient bundle lists in full, so a change can be patched in place.
+BUNDLE_PATCHABLE_TYPES = frozenset({
+    "CarePlan",
+    "Condition",
+    "MedicationRequest",
+    "Observation",
+    "Task",
+    "QuestionnaireResponse",
+    "Consent",
+    "DocumentReference",
+})
+
+CHANGES_LIMIT = 500
+
+
+def _call_key(method: str, params: Dict[str, Any]) -> str:
+    return method + ":" + json.dumps(params, sort_keys=True, default=str)
+
+
+class _PatientEntry:
+    __slots__ = ("results", "pending")
+
+    def __init__(self) -> None:
+        # call key -> (method, params, result)
+        self.results: Dict[str, Tuple[str, Dict[str, Any], Any]] = {}
+        # "Type/id" refs to patch into the cached bundle
+        self.pending: Set[str] = set()
+
+
+class PatientContextCache:
+    def __init__(self, max_patients: int = 1000, transport_cache: Optional[MCPCache] = None):
+        self.max_patients = max_patients
+        self.transport_cache = transport_cache
+        self._lock = threading.Lock()
+        self._patients: "OrderedDict[str, _PatientEntry]" = OrderedDict()
+        self.epoch: Optional[str] = None
+        self.cursor = 0
+        self.hits = 0
+        self.misses = 0
+        self.patched = 0
+        self.resets = 0
+        self._push: Optional[MCPClient] = None
+
+    # -- change feed -------------------------------------------------------
+
+    @property
+    def push_active(self) -> bool:
+        return self._push is not None and self._push.alive()
+
+    def start_push(self, cmd: str) -> bool:
+        """Subscribe to pushed changes on a socket-served Epic mock."""
+        if self.push_active:
+            return True
+        try:
+            client = MCPClient(cmd, multiplex=True, on_notification=self._on_notification)
+            sub = client.call("epic.changes.subscribe", {})
+        except Exception:  # noqa: BLE001 - fall back to polling
+            return False
+        if not sub.get("subscribed"):
+            client.close()
+            return False
+        with self._lock:
+            self._reset_if_new_epoch(sub.get("epoch"))
+            self.cursor = max(self.cursor, int(sub.get("cursor") or 0))
+        self._push = client
+        return True
+
+    def _on_notification(self, method: str, params: Any) -> None:
+        if method == "epic.changes" and isinstance(params, dict):
+            self.apply(params)
+        elif method == LOST_METHOD:
+            # The server dropped us for falling behind; poll from our cursor.
+            push, self._push = self._push, None
+            if push is not None:
+                threading.Thread(target=push.close, daemon=True).start()
+
+    def _reset_if_new_epoch(self, epoch: Optional[str]) -> None:
+        if epoch and epoch != self.epoch:
+            if self.epoch is not None:
+                self._clear()
+            self.epoch = epoch
+
+    def _clear(self) -> None:
+        self._patients.clear()
+        self.resets += 1
+
+    def apply(self, feed: Dict[str, Any]) -> None:
+        """Apply an ``epic.changes.since`` result or pushed ``epic.changes``."""
+        with self._lock:
+            self._reset_if_new_epoch(feed.get("epoch"))
+            resync = bool(feed.get("lost") or feed.get("more"))
+            if resync:
+                # Too far behind to patch: start over from the latest change.
+                self._clear()
+                self.cursor = int(feed.get("latest") or feed.get("cursor") or 0)
+            else:
+                for change in feed.get("changes") or []:
+                    self._apply_change(change)
+                self.cursor = max(self.cursor, int(feed.get("cursor") or 0))
+        if (resync or feed.get("changes")) and self.transport_cache is not None:
+            self.transport_cache.clear()
+
+    def _apply_change(self, change: Dict[str, Any]) -> None:
+        pid = change.get("patient_id")
+        if pid is None:
+            # Shared resources (Organization, Practitioner...) can appear in
+            # any bundle.
+            self._clear()
+            return
+        entry = self._patients.get(str(pid))
+        if entry is None:
+            return
+        rtype = change.get("resource_type")
+        for key, (method, params, _) in list(entry.results.items()):
+            if method == "epic.search" and params.get("resource_type") == rtype:
+                del entry.results[key]
+            elif method == "epic.patient_bundle.get":
+                if rtype in BUNDLE_PATCHABLE_TYPES:
+                    entry.pending.add(f"{rtype}/{change.get('id')}")
+                else:
+                    del entry.results[key]
+                    entry.pending.clear()
+
+    # -- cached reads ------------------------------------------------------
+
+    def _entry(self, pid: str) -> _PatientEntry:
+        entry = self._patients.get(pid)
+        if entry is None:
+            entry = self._patients[pid] = _PatientEntry()
+            while len(self._patients) > self.max_patients:
+                self._patients.popitem(last=False)
+        else:
+            self._patients.move_to_end(pid)
+        return entry
+
+    def _lookup(self, pid: str, method: str, params: Dict[str, Any]) -> Any:
+        entry = self._patients.get(pid)
+        hit = entry.results.get(_call_key(method, params)) if entry is not None else None
+        return hit[2] if hit is not None else None
+
+    def _store(self, pid: str, method: str, params: Dict[str, Any], result: Any) -> None:
+        if isinstance(result, MCPError) or (isinstance(result, dict) and result.get("denied")):
+            return
+        self._entry(pid).results[_call_key(method, params)] = (method, params, result)
+
+    def _patch_bundle(self, pid: str, resources: Dict[str, Any]) -> None:
+        entry = self._patients.get(pid)
+        if entry is None:
+            return
+        for key, (method, params, bundle) in list(entry.results.items()):
+            if method != "epic.patient_bundle.get" or not isinstance(bundle, dict):
+                continue
+            # Copy rather than mutate: earlier callers may still hold the bundle.
+            entries: List[Dict[str, Any]] = list(bundle.get("entry") or [])
+            for ref, res in resources.items():
+                rtype = ref.split("/", 1)[0]
+                same_type = [
+                    i for i, e in enumerate(entries) if (e.get("resource") or {}).get("resourceType") == rtype
+                ]
+                match = next((i for i in same_type if entries[i]["resource"].get("id") == res.get("id")), None)
+                if match is not None:
+                    entries[match] = {"resource": res}
+                else:
+                    entries.insert(same_type[-1] + 1 if same_type else len(entries), {"resource": res})
+                self.patched += 1
+            entry.results[key] = (method, params, dict(bundle, entry=entries))
+
+    async def fetch(self, epic: Any, pid: str, calls: Sequence[Call], timeout: Optional[float] = None) -> List[Any]:
+        """Results for ``calls`` (as ``epic.call_batch`` returns them), cached where possible.
+
+        One batch carries the change poll (unless changes are pushed), any
+        bundle patch fetch and every call not served from the cache.
+        """
+        pid = str(pid)
+        results: List[Any] = [None] * len(calls)
+        fetched: Set[int] = set()  # answered by the server during this call
+        for attempt in range(2):
+            with self._lock:
+                todo = []
+                looked = 0
+                for i, (method, params) in enumerate(calls):
+                    if results[i] is not None:
+                        continue
+                    looked += 1
+                    hit = self._lookup(pid, method, params) if method in CACHED_METHODS else None
+                    if hit is not None:
+                        results[i] = hit
+                    else:
+                        todo.append(i)
+                entry = self._patients.get(pid)
+                pending = sorted(entry.pending) if entry is not None else []
+                poll = not self.push_active
+                cursor, epoch = self.cursor, self.epoch
+                self.hits += looked - len(todo)
+                self.misses += len(todo)
+            batch: List[Call] = [(calls[i][0], calls[i][1]) for i in todo]
+            if pending:
+                batch.append(("epic.resource.get_many", {"references": pending}))
+            if poll:
+                batch.append(("epic.changes.since", {"cursor": cursor, "epoch": epoch, "limit": CHANGES_LIMIT}))
+            if not batch:
+                break
+            out = await epic.call_batch(batch, timeout=timeout)
+            feed = out.pop() if poll else None
+            got = out.pop() if pending else None
+            with self._lock:
+                if isinstance(got, dict):
+                    self._patch_bundle(pid, got.get("resources") or {})
+                    entry = self._patients.get(pid)
+                    if entry is not None:
+                        entry.pending.difference_update(pending)
+                    for i, (method, params) in enumerate(calls):
+                        if method == "epic.patient_bundle.get" and i not in todo:
+                            patched = self._lookup(pid, method, params)
+                            if patched is not None:
+                                results[i] = patched
+                for i, res in zip(todo, out):
+                    results[i] = res
+                    fetched.add(i)
+                    self._store(pid, calls[i][0], calls[i][1], res)
+            if not isinstance(feed, dict):
+                break
+            before = self.resets
+            self.apply(feed)
+            if attempt:
+                # Out of retries: what we have was current when it was read.
+                break
+            # Results served from the cache may predate the changes just
+            # polled: drop and refetch those once. Fresh results stay.
+            with self._lock:
+                entry = self._patients.get(pid)
+                patching = bool(entry is not None and entry.pending)
+                stale = [
+                    i for i, (method, params) in enumerate(calls)
+                    if i not in fetched and method in CACHED_METHODS and (
+                        self.resets != before or self._lookup(pid, method, params) is None
+                        or (method == "epic.patient_bundle.get" and patching)
+                    )
+                ]
+            if not stale:
+                break
+            for i in stale:
+                results[i] = None
+        return [r if r is not None else MCPError("context unavailable") for r in results]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "patients": len(self._patients),
+                "max_patients": self.max_patients,
+                "epoch": self.epoch,
+                "cursor": self.cursor,
+                "push": self.push_active,
+                "hits": self.hits,
+                "misses": self.misses,
+                "patched": self.patched,
+                "resets": self.resets,
+            }
+
+
+def from_env(cmd: Optional[str] = None) -> Optional[PatientContextCache]:
+    """The context cache per HD_CONTEXT_CACHE* env, or None when disabled.
+
+    With HD_CONTEXT_PUSH=true and ``MCP_EPIC_CMD`` a ``unix:``/``tcp:``
+    address, changes are pushed rather than polled.
+    """
+    if os.getenv("HD_CONTEXT_CACHE", "true").lower() not in ("1", "true", "yes"):
+        return None
+    cmd = cmd or os.getenv("MCP_EPIC_CMD", "python3 mcp/mcp-epic-mock/main.py")
+    cache = PatientContextCache(
+        max_patients=int(os.getenv("HD_CONTEXT_CACHE_PATIENTS", "1000")),
+        transport_cache=get_cache(cmd),
+    )
+    if os.getenv("HD_CONTEXT_PUSH", "false").lower() in ("1", "true", "yes") and parse_socket_address(cmd):
+        cache.start_push(cmd)
+    return cache
@@ -6,6 +6,8 @@ import urllib.error
 import ssl
 import certifi
 
+from libs.common import tracing
+
 
 class LLMClient:
     def __init__(self) -> None:
@@ -14,6 +16,15 @@ class LLMClient:
         self.api_key = os.getenv("AGENTIS_LLM_API_KEY", "")
 
     def complete(self, system: str, user: str, tools: Optional[List[Dict[str, Any]]] = None, schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        attrs = {"llm.provider": self.provider, "llm.model": self.model, "llm.prompt_chars": len(system or "") + len(user or "")}
+        with tracing.start_span("llm.complete", attrs, tracing.KIND_CLIENT) as span:
+            out = self._complete(system, user, tools=tools, schema=schema)
+            body = out.get("json")
+            if isinstance(body, dict) and body.get("error"):
+                span.set_attribute("llm.error", str(body["error"]))
+            return out
+
+    def _complete(self, system: str, user: str, tools: Optional[List[Dict[str, Any]]] = None, schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         if self.provider == "mock":
             return {"text": "", "json": {"mock": True}, "model": self.model}
 
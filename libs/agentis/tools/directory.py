@@ -0,0 +1,143 @@
+import asyncio
+import os
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from libs.common.mcp_client import MCPError
+
+# JSON-RPC "method not found": an HCA mock without the batch tool.
+_METHOD_NOT_FOUND = -32601
+_SINGLE = "hca.directory.search_providers"
+
+
+class ProviderLookupBatcher:
+    """Coalesce concurrent provider searches into ``hca.directory.search_providers_batch``.
+
+    Lookups arriving within ``window_ms`` of each other (a cohort run firing
+    many HD steps at once) go out as one batch call, and the server
+    evaluates each distinct (location, roles) once. Each caller gets the
+    same shape ``hca.directory.search_providers`` returns. Servers without
+    the batch tool are answered one call per lookup.
+
+    Lookups go through the client's MCPCache as if they were single
+    ``search_providers`` calls: a hit returns at once without waiting for
+    the window, and batch results are stored for later lookups.
+    """
+
+    def __init__(self, client: Any, window_ms: float = 2.0, max_batch: int = 500):
+        self.client = client
+        self.window_s = max(0.0, window_ms) / 1000.0
+        self.max_batch = max_batch
+        self._pending: List[_Pending] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set["asyncio.Task[None]"] = set()
+        self._batch_supported = True
+        self.batches = 0
+        self.lookups = 0
+        self.cache_hits = 0
+
+    async def search(
+        self, patient_id: str, location: str, roles: List[str], timeout: Optional[float] = None, **params: Any
+    ) -> Dict[str, Any]:
+        query = {"patient_id": patient_id, "location": location, "roles": list(roles), **params}
+        if not self._batch_supported:
+            return await self.client.call(_SINGLE, query, timeout=timeout)
+        token = None
+        cache = getattr(self.client, "cache", None)
+        if cache is not None:
+            hit, value, token = cache.lookup(_SINGLE, query)
+            if hit:
+                self.cache_hits += 1
+                return value
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((query, timeout, future, token))
+        self.lookups += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush_soon(loop, 0.0)
+        elif self._timer is None:
+            self._flush_soon(loop, self.window_s)
+        return await future
+
+    def _flush_soon(self, loop: asyncio.AbstractEventLoop, delay: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = loop.call_later(delay, self._start_flush, loop)
+
+    def _start_flush(self, loop: asyncio.AbstractEventLoop) -> None:
+        task = loop.create_task(self._flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self) -> None:
+        self._timer = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        timeouts = [t for _, t, _, _ in pending if t is not None]
+        timeout = min(timeouts) if timeouts else None
+        queries = [dict(query, id=str(i)) for i, (query, _, _, _) in enumerate(pending)]
+        self.batches += 1
+        try:
+            resp = await self.client.call("hca.directory.search_providers_batch", {"queries": queries}, timeout=timeout)
+        except MCPError as exc:
+            if exc.code != _METHOD_NOT_FOUND:
+                _fail(pending, exc)
+                return
+            self._batch_supported = False
+            await asyncio.gather(*(self._single(query, t, fut) for query, t, fut, _ in pending))
+            return
+        except Exception as exc:  # noqa: BLE001 - every waiter sees the failure
+            _fail(pending, exc)
+            return
+        results = resp.get("results") or {}
+        cache = getattr(self.client, "cache", None)
+        for i, (query, _, future, token) in enumerate(pending):
+            res = results.get(str(i))
+            if future.done():
+                continue
+            if res is None:
+                future.set_exception(MCPError({"message": f"No result for provider query {i}"}))
+                continue
+            value = {"count": res.get("count", 0), "providers": res.get("providers", []), "ts": resp.get("ts")}
+            if cache is not None:
+                cache.store(_SINGLE, query, value, token)
+            future.set_result(value)
+
+    async def _single(self, query: Dict[str, Any], timeout: Optional[float], future: "asyncio.Future[Any]") -> None:
+        try:
+            res = await self.client.call(_SINGLE, query, timeout=timeout)
+        except Exception as exc:  # noqa: BLE001
+            if not future.done():
+                future.set_exception(exc)
+            return
+        if not future.done():
+            future.set_result(res)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "lookups": self.lookups,
+            "batches": self.batches,
+            "cache_hits": self.cache_hits,
+            "batch_supported": self._batch_supported,
+        }
+
+
+_Pending = Tuple[Dict[str, Any], Optional[float], "asyncio.Future[Any]", Optional[int]]
+
+
+def _fail(pending: List[_Pending], exc: BaseException) -> None:
+    for _, _, future, _ in pending:
+        if not future.done():
+            future.set_exception(exc)
+
+
+_BATCHERS: Dict[int, ProviderLookupBatcher] = {}
+
+
+def provider_batcher(client: Any) -> ProviderLookupBatcher:
+    """The shared batcher for an async HCA client (one per client, so per loop)."""
+    batcher = _BATCHERS.get(id(client))
+    if batcher is None or batcher.client is not client:
+        batcher = ProviderLookupBatcher(client, window_ms=float(os.getenv("HCA_BATCH_WINDOW_MS", "2")))
+        _BATCHERS[id(client)] = batcher
+    return batcher
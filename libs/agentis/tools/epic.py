@@ -1,4 +1,5 @@
-from typing import Any, Dict
+import uuid
+from typing import Any, Dict, Iterator, List, Optional
 
 from libs.common.mcp_client import make_epic_client
 
@@ -11,9 +12,63 @@ def patient_bundle_get(patient_id: str) -> Dict[str, Any]:
     return make_epic_client().call("epic.patient_bundle.get", {"patient_id": patient_id})
 
 
+def resources_get_many(references: List[str]) -> Dict[str, Any]:
+    """Fetch ``Type/id`` references in one call: ``{"resources": {ref: res}, "missing": [ref]}``."""
+    return make_epic_client().call("epic.resource.get_many", {"references": list(references)})
+
+
 def fhir_create(resource_type: str, resource_json: Dict[str, Any]) -> Dict[str, Any]:
     return make_epic_client().call("epic.fhir_write_back.create", {"resource_type": resource_type, "resource_json": resource_json})
 
 
+def make_bundle(resources: List[Dict[str, Any]], bundle_type: str = "transaction") -> Dict[str, Any]:
+    """A transaction/batch Bundle POSTing each of ``resources``."""
+    return {
+        "resourceType": "Bundle",
+        "type": bundle_type,
+        "entry": [
+            {
+                "fullUrl": f"urn:uuid:{uuid.uuid4()}",
+                "resource": res,
+                "request": {"method": "POST", "url": res.get("resourceType", "")},
+            }
+            for res in resources
+        ],
+    }
+
+
+def fhir_bundle_write(resources: List[Dict[str, Any]], bundle_type: str = "transaction") -> Dict[str, Any]:
+    """Create ``resources`` in one call, all-or-nothing (transaction) or independently (batch)."""
+    return make_epic_client().call("epic.fhir_write_back.bundle", {"bundle": make_bundle(resources, bundle_type)})
+
+
+def bundle_ids(response: Dict[str, Any]) -> List[Optional[str]]:
+    """Created ids from a transaction/batch response, None for failed entries."""
+    out: List[Optional[str]] = []
+    for entry in (response or {}).get("entry") or []:
+        resp = entry.get("response") or {}
+        location = resp.get("location") or ""
+        out.append(location.split("/")[1] if str(resp.get("status", "")).startswith("2") and "/" in location else None)
+    return out
+
+
 def inbasket_alert(patient_id: str, subject: str, body: str, priority: str) -> Dict[str, Any]:
     return make_epic_client().call("epic.inbasket.alert", {"patient_id": patient_id, "subject": subject, "body": body, "priority": priority})
+
+
+def iter_search(resource_type: str, patient_id: str, page_size: int = 50, **params: Any) -> Iterator[Dict[str, Any]]:
+    """Yield every matching resource, fetching ``page_size`` at a time.
+
+    Extra ``params`` (``date``, ``_lastUpdated``, ``_sort``) are passed to
+    epic.search unchanged.
+    """
+    client = make_epic_client()
+    query: Dict[str, Any] = {**params, "resource_type": resource_type, "patient_id": patient_id, "_count": page_size}
+    while True:
+        page = client.call("epic.search", query)
+        for entry in page.get("entry") or []:
+            yield entry.get("resource") or {}
+        token = page.get("next")
+        if not token:
+            return
+        query = {**query, "_page_token": token}
@@ -0,0 +1,57 @@
+"""Unique, time-sortable IDs shared by the services and MCP mocks.
+
+IDs are 26-character ULIDs (Crockford base32) laid out as:
+
+- 48 bits of Unix time in milliseconds, so IDs sort by creation time;
+- 40 bits of node id, random per process and re-drawn after ``fork()``, so
+  worker processes never share a sequence;
+- 40 bits of a per-process counter (``itertools.count``, atomic under the
+  GIL, so no lock), so IDs from one process are unique even within the
+  same millisecond or if the clock steps back.
+"""
+
+import itertools
+import os
+import time
+from typing import Iterator
+
+_CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_COUNTER_MASK = (1 << 40) - 1
+
+_node = 0
+_counter: Iterator[int] = itertools.count()
+
+
+def _reseed() -> None:
+    global _node, _counter
+    _node = int.from_bytes(os.urandom(5), "big")
+    _counter = itertools.count(int.from_bytes(os.urandom(2), "big"))
+
+
+_reseed()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reseed)
+
+
+def _encode(value: int) -> str:
+    chars = []
+    for _ in range(26):
+        chars.append(_CROCKFORD[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def new_id(prefix: str = "") -> str:
+    """A new ULID, optionally prefixed (``new_id("res-")``)."""
+    ms = time.time_ns() // 1_000_000
+    value = (ms & ((1 << 48) - 1)) << 80 | _node << 40 | (next(_counter) & _COUNTER_MASK)
+    return prefix + _encode(value)
+
+
+def id_time_ms(value: str) -> int:
+    """The millisecond timestamp encoded in an ID from :func:`new_id`."""
+    ulid = value[-26:]
+    n = 0
+    for ch in ulid.upper():
+        n = n * 32 + _CROCKFORD.index(ch)
+    return n >> 80
@@ -1,55 +1,1556 @@
+import asyncio
+import atexit
+import importlib.util
 import json
 import os
+import socket
 import subprocess
+import sys
 import threading
+import time
 import uuid
-from typing import Any, Dict, Optional
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
 
+from libs.common import metrics, tracing
+from libs.common.mcp_server import SocketAddress, handle_message, parse_socket_address
 
-class MCPClient:
-    def __init__(self, cmd: str):
-        self.proc = subprocess.Popen(
-            cmd.split(), stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+# One entry of a call_batch(): (method, params).
+BatchCall = Tuple[str, Optional[Dict[str, Any]]]
+
+
+class MCPError(RuntimeError):
+    """JSON-RPC error object returned by an MCP server for one request."""
+
+    def __init__(self, error: Any):
+        super().__init__(error)
+        self.error = error
+
+    @property
+    def code(self) -> Optional[int]:
+        return self.error.get("code") if isinstance(self.error, dict) else None
+
+
+class MCPTimeout(RuntimeError):
+    """An MCP call did not complete before its deadline."""
+
+
+_MCP_CALLS = metrics.counter(
+    "mcp_client_calls_total", "MCP round-trips by server and method (batches count once as 'batch')", ("server", "method")
+)
+_MCP_ERRORS = metrics.counter(
+    "mcp_client_errors_total",
+    "Failed MCP calls; kind is error (JSON-RPC error), timeout or transport",
+    ("server", "method", "kind"),
+)
+_MCP_LATENCY = metrics.histogram("mcp_client_call_seconds", "MCP round-trip latency", ("server", "method"))
+_MCP_REQUEST_BYTES = metrics.counter("mcp_client_request_bytes_total", "Bytes of JSON-RPC sent", ("server", "method"))
+_MCP_RESPONSE_BYTES = metrics.counter(
+    "mcp_client_response_bytes_total", "Bytes of JSON-RPC received", ("server", "method")
+)
+_MCP_BATCH_ENTRIES = metrics.counter(
+    "mcp_client_batch_entries_total", "Calls sent inside JSON-RPC batches", ("server", "method")
+)
+
+
+def server_label(cmd: str) -> str:
+    """Short metrics label for an MCP command, e.g. ``mcp-epic-mock``."""
+    if cmd.startswith(INPROC_PREFIX):
+        return os.path.basename(os.path.dirname(cmd)) if cmd.endswith(".py") else cmd[len(INPROC_PREFIX):]
+    if parse_socket_address(cmd) is not None:
+        return cmd
+    parts = cmd.split()
+    script = next((p for p in reversed(parts) if p.endswith(".py")), parts[-1] if parts else cmd)
+    return os.path.basename(os.path.dirname(script)) or script
+
+
+class _CallTimer:
+    """Records count, latency, bytes and failure kind for one MCP round-trip.
+
+    Also opens a client span for the call; requests built with ``encode()``
+    or ``inject()`` carry its ``traceparent`` so the server's handler span
+    becomes its child.
+    """
+
+    def __init__(self, server: str, method: str):
+        self.server = server
+        self.method = method
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+    def __enter__(self) -> "_CallTimer":
+        self._span_cm = tracing.start_span(
+            f"mcp {self.method}",
+            {"rpc.system": "jsonrpc", "rpc.service": self.server, "rpc.method": self.method},
+            kind=tracing.KIND_CLIENT,
         )
+        self.span = self._span_cm.__enter__()
+        self.started = time.perf_counter()
+        return self
+
+    def inject(self, msg: Any) -> Any:
+        """Stamp the request (or each batch entry) with this call's traceparent."""
+        traceparent = self.span.traceparent
+        if traceparent:
+            for req in msg if isinstance(msg, list) else (msg,):
+                req["traceparent"] = traceparent
+        return msg
+
+    def encode(self, msg: Any) -> str:
+        line = json.dumps(self.inject(msg))
+        self.request_bytes = len(line)
+        return line
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.span.set_attribute("mcp.response_bytes", self.response_bytes or None)
+        self._span_cm.__exit__(exc_type, exc, tb)
+        labels = (self.server, self.method)
+        _MCP_LATENCY.labels(*labels).observe(time.perf_counter() - self.started)
+        _MCP_CALLS.labels(*labels).inc()
+        if self.request_bytes:
+            _MCP_REQUEST_BYTES.labels(*labels).inc(self.request_bytes)
+        if self.response_bytes:
+            _MCP_RESPONSE_BYTES.labels(*labels).inc(self.response_bytes)
+        if exc_type is not None:
+            if issubclass(exc_type, MCPTimeout):
+                kind = "timeout"
+            elif issubclass(exc_type, MCPError):
+                kind = "error"
+            else:
+                kind = "transport"
+            _MCP_ERRORS.labels(self.server, self.method, kind).inc()
+
+
+def _count_batch(server: str, calls: Sequence[BatchCall], results: List[Any]) -> None:
+    for (method, _), res in zip(calls, results):
+        _MCP_BATCH_ENTRIES.labels(server, method).inc()
+        if isinstance(res, MCPError):
+            _MCP_ERRORS.labels(server, method, "error").inc()
+
+
+def default_timeout() -> float:
+    """Client-wide default from MCP_CALL_TIMEOUT_S; 0 or less waits forever."""
+    try:
+        return float(os.getenv("MCP_CALL_TIMEOUT_S", "30"))
+    except ValueError:
+        return 30.0
+
+
+def _remaining(deadline: Optional[float], default: Any) -> Any:
+    if deadline is None:
+        return default
+    return max(0.0, deadline - time.monotonic())
+
+
+def _budget(deadline: Optional[float]) -> float:
+    """Time left before ``deadline`` as a per-call timeout; 0 means no limit."""
+    if deadline is None:
+        return 0.0
+    return max(0.001, deadline - time.monotonic())
+
+
+def _batch_entries(calls: Sequence[BatchCall]) -> Tuple[List[str], List[Dict[str, Any]]]:
+    ids: List[str] = []
+    reqs: List[Dict[str, Any]] = []
+    for method, params in calls:
+        req_id = str(uuid.uuid4())
+        ids.append(req_id)
+        reqs.append({"jsonrpc": "2.0", "id": req_id, "method": method, "params": params or {}})
+    return ids, reqs
+
+
+def _batch_results(ids: List[str], resp: Any) -> List[Any]:
+    """Order batch responses like the requests; failed entries become MCPError."""
+    if isinstance(resp, dict):
+        # The server rejected the batch as a whole.
+        raise MCPError(resp.get("error"))
+    by_id = {r.get("id"): r for r in resp if isinstance(r, dict)}
+    out: List[Any] = []
+    for req_id in ids:
+        r = by_id.get(req_id)
+        if r is None:
+            out.append(MCPError({"code": -32603, "message": "No response for batch entry"}))
+        elif "error" in r:
+            out.append(MCPError(r["error"]))
+        else:
+            out.append(r.get("result"))
+    return out
+
+
+def _response_key(resp: Any, pending: Dict[str, Any]) -> Optional[str]:
+    # Batch responses are registered under the id of one of their entries.
+    if isinstance(resp, list):
+        return next((r.get("id") for r in resp if isinstance(r, dict) and r.get("id") in pending), None)
+    return resp.get("id") if isinstance(resp, dict) else None
+
+
+# Idempotent reads whose results may be served from MCPCache.
+CACHEABLE_METHODS = frozenset({
+    "mcp.list_tools",
+    "epic.patient_bundle.get",
+    "epic.resource.get",
+    "epic.resource.get_many",
+    "epic.search",
+    "hca.directory.search_providers",
+    "hca.directory.search_text",
+})
+
+# Writes that invalidate cached reads for the patient they touch (or the whole
+# cache when no patient can be determined).
+INVALIDATING_METHODS = frozenset({
+    "epic.fhir_write_back.create",
+    "epic.fhir_write_back.bundle",
+})
+
+
+def _patient_of(method: str, params: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Best-effort patient id a request reads, if any."""
+    if not isinstance(params, dict):
+        return None
+    if params.get("patient_id"):
+        return str(params["patient_id"])
+    if params.get("resource_type") == "Patient" and params.get("id"):
+        return str(params["id"])
+    return None
+
+
+def _resource_patient(res: Any) -> Optional[str]:
+    if isinstance(res, dict):
+        if res.get("resourceType") == "Patient" and res.get("id"):
+            return str(res["id"])
+        for field in ("subject", "for", "patient"):
+            ref = res.get(field)
+            ref = ref.get("reference") if isinstance(ref, dict) else None
+            if isinstance(ref, str) and ref.startswith("Patient/"):
+                return ref.split("/", 1)[1]
+    return None
+
+
+def _included_types(params: Dict[str, Any]) -> Set[str]:
+    """Resource types ``_include``/``_revinclude`` can pull in; "*" when not named."""
+    out: Set[str] = set()
+    for name in ("_include", "_revinclude"):
+        value = params.get(name)
+        if not value:
+            continue
+        for spec in value if isinstance(value, list) else [value]:
+            parts = str(spec).split(":")
+            if name == "_revinclude":
+                out.add(parts[0])  # the referring (source) type
+            else:
+                out.add(parts[2] if len(parts) > 2 and parts[2] else "*")
+    return out
+
+
+def _read_tags(method: str, params: Optional[Dict[str, Any]]) -> Set[str]:
+    """What a cached read depends on: ``patient:<id>``, ``Type/id`` and ``type:<Type>`` tags.
+
+    Reads with no tags (directory lookups, tool lists) are never invalidated
+    by Epic writes, only expired.
+    """
+    if not isinstance(params, dict):
+        return set()
+    tags: Set[str] = set()
+    pid = _patient_of(method, params)
+    if pid is not None:
+        tags.add(f"patient:{pid}")
+    if method == "epic.resource.get" and params.get("resource_type") and params.get("id"):
+        tags.add(f"{params['resource_type']}/{params['id']}")
+    elif method == "epic.resource.get_many":
+        refs = params.get("references")
+        if isinstance(refs, list):
+            tags.update(str(ref) for ref in refs if ref)
+        else:
+            tags.add("type:*")
+    elif method == "epic.search":
+        if pid is None:
+            tags.add(f"type:{params.get('resource_type') or '*'}")
+        tags.update(f"type:{t}" for t in _included_types(params))
+    return tags
+
+
+def _references(value: Any, out: Set[str]) -> None:
+    if isinstance(value, dict):
+        ref = value.get("reference")
+        if isinstance(ref, str) and "/" in ref and not ref.startswith("urn:"):
+            out.add(ref)
+        for item in value.values():
+            _references(item, out)
+    elif isinstance(value, list):
+        for item in value:
+            _references(item, out)
+
+
+def _result_tags(method: str, value: Any) -> Set[str]:
+    """Extra tags for a read whose result pulls in resources of other patients.
+
+    A patient bundle embeds shared resources (Organization, Location,
+    Practitioner...), so it is tagged with every ``Type/id`` it contains or
+    references and a write to any of them drops it.
+    """
+    tags: Set[str] = set()
+    if method != "epic.patient_bundle.get" or not isinstance(value, dict):
+        return tags
+    for entry in value.get("entry") or []:
+        res = entry.get("resource") if isinstance(entry, dict) else None
+        if isinstance(res, dict):
+            if res.get("resourceType") and res.get("id"):
+                tags.add(f"{res['resourceType']}/{res['id']}")
+            _references(res, tags)
+    return tags
+
+
+def _write_tags(method: str, params: Optional[Dict[str, Any]]) -> Optional[Set[str]]:
+    """Tags a write invalidates, or None when its targets can't be worked out."""
+    if not isinstance(params, dict):
+        return None
+    resources: List[Any] = []
+    bundle = params.get("bundle")
+    if isinstance(bundle, dict):
+        for entry in bundle.get("entry") or []:
+            if not isinstance(entry, dict) or not isinstance(entry.get("resource"), dict):
+                return None
+            res = dict(entry["resource"])
+            # PUT Type/id names the id the server will use.
+            url = str((entry.get("request") or {}).get("url") or "")
+            if "/" in url:
+                res.setdefault("resourceType", url.split("/", 1)[0])
+                res["id"] = url.split("/", 1)[1]
+            resources.append(res)
+    elif params.get("resource_type"):
+        resources.append(dict(params.get("resource_json") or {}, resourceType=params["resource_type"]))
+    else:
+        return None
+    tags: Set[str] = {"type:*"}
+    for res in resources:
+        rtype = res.get("resourceType")
+        if not rtype:
+            return None
+        tags.add(f"type:{rtype}")
+        if res.get("id"):
+            tags.add(f"{rtype}/{res['id']}")
+        pid = _resource_patient(res)
+        if pid is not None:
+            tags.add(f"patient:{pid}")
+    return tags
+
+
+class MCPCache:
+    """Read-through TTL + LRU cache for idempotent MCP responses.
+
+    Entries are keyed by method plus canonicalised params (sorted-key JSON)
+    and stored as JSON text, so every hit hands the caller a fresh copy that
+    it may mutate freely. Only ``methods`` are cached. Each entry is tagged
+    with what it read (its patient, the ``Type/id`` references it fetched
+    or, for a patient bundle, contains, or for a search without a patient
+    its resource type); a successful or
+    failed call to one of ``invalidating`` drops the entries sharing a tag
+    with the resources it wrote, or everything when those can't be worked
+    out. A generation counter stops a read that raced with a write from
+    re-populating the cache with stale data.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 30.0,
+        max_entries: int = 1024,
+        methods: frozenset = CACHEABLE_METHODS,
+        invalidating: frozenset = INVALIDATING_METHODS,
+    ):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.methods = methods
+        self.invalidating = invalidating
+        self._entries: "OrderedDict[str, Tuple[float, str, Set[str]]]" = OrderedDict()
+        self._by_tag: Dict[str, set] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(method: str, params: Optional[Dict[str, Any]]) -> str:
+        return method + " " + json.dumps(params or {}, sort_keys=True, separators=(",", ":"), default=str)
+
+    def _drop(self, key: str) -> None:
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+
+    def lookup(self, method: str, params: Optional[Dict[str, Any]]) -> Tuple[bool, Any, Optional[int]]:
+        """Return ``(hit, value, token)``; pass ``token`` to store() on a miss."""
+        if method not in self.methods:
+            return False, None, None
+        key = self.key(method, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, json.loads(entry[1]), None
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return False, None, self._generation
+
+    def store(self, method: str, params: Optional[Dict[str, Any]], value: Any, token: Optional[int]) -> None:
+        if token is None or method not in self.methods:
+            return
+        key = self.key(method, params)
+        raw = json.dumps(value)
+        tags = _read_tags(method, params) | _result_tags(method, value)
+        with self._lock:
+            if token != self._generation:
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, raw, tags)
+            for tag in tags:
+                self._by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def note_call(self, method: str, params: Optional[Dict[str, Any]]) -> None:
+        """Invalidate after ``method`` ran, if it is a write."""
+        if method not in self.invalidating:
+            return
+        tags = _write_tags(method, params)
+        if tags is None:
+            self.clear()
+            return
+        self.invalidate(tags)
+
+    def invalidate_patient(self, patient_id: str) -> None:
+        self.invalidate([f"patient:{patient_id}"])
+
+    def invalidate(self, tags: Iterable[str]) -> None:
+        """Drop every entry carrying any of ``tags``."""
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in list(self._by_tag.get(tag, ())):
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_tag.clear()
+
+    def split_batch(self, calls: Sequence[BatchCall]) -> Tuple[List[Any], List[Tuple[int, str, Any, Optional[int]]]]:
+        """Serve what we can from cache; return ``(results, misses)``."""
+        out: List[Any] = [None] * len(calls)
+        misses: List[Tuple[int, str, Any, Optional[int]]] = []
+        for i, (method, params) in enumerate(calls):
+            hit, value, token = self.lookup(method, params)
+            if hit:
+                out[i] = value
+            else:
+                misses.append((i, method, params, token))
+        return out, misses
+
+    def merge_batch(self, out: List[Any], misses: List[Tuple[int, str, Any, Optional[int]]], results: List[Any]) -> List[Any]:
+        for _, method, params, _ in misses:
+            self.note_call(method, params)
+        for (i, method, params, token), res in zip(misses, results):
+            out[i] = res
+            if not isinstance(res, MCPError):
+                self.store(method, params, res, token)
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class _SocketProcess:
+    """A connection to a listening MCP server behind the Popen surface MCPClient uses.
+
+    ``stdin``/``stdout`` are text files over the socket, ``kill()`` drops the
+    connection (the shared server keeps running) and ``poll()`` reports
+    whether it has been closed.
+    """
+
+    def __init__(self, address: SocketAddress, connect_timeout: Optional[float] = None):
+        family, target = address
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            self.sock.settimeout(connect_timeout or None)
+            self.sock.connect(target)
+            self.sock.settimeout(None)
+        except OSError:
+            self.sock.close()
+            raise
+        self.pid = None
+        self.returncode: Optional[int] = None
+        self.stdin = self.sock.makefile("w", encoding="utf-8")
+        self.stdout = self.sock.makefile("r", encoding="utf-8")
+
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def kill(self) -> None:
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.returncode = -9
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        self.kill()
+        self.sock.close()
+        return self.returncode or 0
+
+
+class MCPClient:
+    """JSON-RPC client for one MCP server process speaking over stdio.
+
+    When ``cmd`` is a ``unix:<path>`` or ``tcp:<host>:<port>`` address (see
+    ``mcp_server --listen``) the client connects to that shared server
+    instead of spawning its own process.
+
+    A background reader thread resolves pending futures by response ``id``.
+    In the default mode ``self.lock`` is held across the write and the wait
+    for the matching response, so one request is in flight at a time. With
+    ``multiplex=True`` callers only hold the lock while writing, so many
+    requests can share one pipe and the server may answer out of order.
+
+    Every call waits at most ``timeout`` seconds (per call, else the client
+    default, else MCP_CALL_TIMEOUT_S). On expiry the request is abandoned, the
+    wedged child is killed so a pool replaces it, and MCPTimeout is raised.
+
+    Server notifications (see ``mcp_server.publish``) are passed to
+    ``on_notification(method, params)`` on the reader thread.
+    """
+
+    def __init__(
+        self,
+        cmd: str,
+        multiplex: bool = False,
+        timeout: Optional[float] = None,
+        on_notification: Optional[Callable[[str, Any], None]] = None,
+    ):
+        self.cmd = cmd
+        self.on_notification = on_notification
+        self.server = server_label(cmd)
+        self.multiplex = multiplex
+        self.timeout = default_timeout() if timeout is None else timeout
+        address = parse_socket_address(cmd)
+        self.proc: Any
+        if address is not None:
+            self.proc = _SocketProcess(address, connect_timeout=self.timeout)
+        else:
+            self.proc = subprocess.Popen(
+                cmd.split(), stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+            )
         self.lock = threading.Lock()
+        # Set once the stdio stream is out of sync (EOF, broken pipe, garbled
+        # line, timeout); the pool then discards the process instead of
+        # reusing it.
+        self.broken = False
+        self._pending: Dict[str, Future] = {}
+        self._pending_lock = threading.Lock()
+        self._reader = threading.Thread(
+            target=self._read_loop, name=f"mcp-reader-{self.proc.pid or hex(id(self))}", daemon=True
+        )
+        self._reader.start()
+
+    def alive(self) -> bool:
+        return not self.broken and self.proc.poll() is None
+
+    def in_flight(self) -> int:
+        with self._pending_lock:
+            return len(self._pending)
+
+    def _read_loop(self) -> None:
+        assert self.proc.stdout is not None
+        reason = f"MCP server exited: {self.cmd}"
+        try:
+            for resp_line in self.proc.stdout:
+                try:
+                    resp = json.loads(resp_line)
+                except ValueError:
+                    reason = f"MCP server sent an invalid line: {self.cmd}"
+                    break
+                if isinstance(resp, dict) and "id" not in resp and "method" in resp:
+                    if self.on_notification is not None:
+                        try:
+                            self.on_notification(resp["method"], resp.get("params"))
+                        except Exception:  # noqa: BLE001 - never kill the reader
+                            pass
+                    continue
+                with self._pending_lock:
+                    fut = self._pending.pop(_response_key(resp, self._pending), None)
+                if fut is not None:
+                    fut.set_result((resp, len(resp_line)))
+        except (OSError, ValueError):
+            pass
+        self.broken = True
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for fut in pending.values():
+            fut.set_exception(RuntimeError(reason))
 
-    def call(self, method: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    def _send(self, line: str) -> None:
+        assert self.proc.stdin is not None
+        self.proc.stdin.write(line + "\n")
+        self.proc.stdin.flush()
+
+    def _recycle(self) -> None:
+        """Kill a wedged child; its reader then fails any other pending calls."""
+        self.broken = True
+        try:
+            self.proc.kill()
+        except OSError:
+            pass
+
+    def _roundtrip(self, req_id: str, line: str, timeout: Optional[float]) -> Tuple[Any, int]:
+        """Send ``line`` and wait for its response; returns (response, response bytes)."""
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.monotonic() + timeout if timeout and timeout > 0 else None
+        fut: Future = Future()
+        with self._pending_lock:
+            if self.broken:
+                raise RuntimeError(f"MCP server exited: {self.cmd}")
+            self._pending[req_id] = fut
+        # In serial mode the lock spans the whole round-trip; a caller queued
+        # behind a slow request spends its own deadline waiting for it.
+        if not self.lock.acquire(timeout=_remaining(deadline, -1)):
+            self._abandon(req_id)
+            raise MCPTimeout(f"MCP call timed out waiting for {self.cmd}")
+        locked = True
+        try:
+            try:
+                self._send(line)
+            except (OSError, ValueError):
+                self.broken = True
+                self._abandon(req_id)
+                raise
+            if self.multiplex:
+                self.lock.release()
+                locked = False
+            try:
+                return fut.result(timeout=_remaining(deadline, None))
+            except FutureTimeout:
+                self._abandon(req_id)
+                self._recycle()
+                raise MCPTimeout(f"MCP call timed out after {timeout}s: {self.cmd}") from None
+        finally:
+            if locked:
+                self.lock.release()
+
+    def _abandon(self, req_id: str) -> None:
+        with self._pending_lock:
+            self._pending.pop(req_id, None)
+
+    def call(
+        self, method: str, params: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
         if params is None:
             params = {}
         req_id = str(uuid.uuid4())
         req = {"jsonrpc": "2.0", "id": req_id, "method": method, "params": params}
-        line = json.dumps(req)
-        with self.lock:
-            assert self.proc.stdin is not None
-            self.proc.stdin.write(line + "\n")
-            self.proc.stdin.flush()
-            assert self.proc.stdout is not None
-            resp_line = self.proc.stdout.readline()
-        resp = json.loads(resp_line)
-        if "error" in resp:
-            raise RuntimeError(resp["error"])
+        with _CallTimer(self.server, method) as timer:
+            resp, timer.response_bytes = self._roundtrip(req_id, timer.encode(req), timeout)
+            if "error" in resp:
+                raise MCPError(resp["error"])
+        return resp["result"]
+
+    def call_batch(self, calls: Sequence[BatchCall], timeout: Optional[float] = None) -> List[Any]:
+        """Send ``calls`` as one JSON-RPC batch in a single round-trip.
+
+        Results come back in request order; an entry that failed on the
+        server is returned as an MCPError instance instead of raising, so
+        one bad call does not discard the others.
+        """
+        if not calls:
+            return []
+        ids, reqs = _batch_entries(calls)
+        with _CallTimer(self.server, "batch") as timer:
+            resp, timer.response_bytes = self._roundtrip(ids[0], timer.encode(reqs), timeout)
+            results = _batch_results(ids, resp)
+        _count_batch(self.server, calls, results)
+        return results
+
+    def list_tools(self) -> Dict[str, Any]:
+        return self.call("mcp.list_tools")
+
+    def close(self, timeout: float = 2.0) -> None:
+        """Close stdin so the server loop exits, killing it if it lingers."""
+        try:
+            if self.proc.stdin is not None:
+                self.proc.stdin.close()
+        except Exception:
+            pass
+        try:
+            self.proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+
+class MCPPool:
+    """Bounded pool of warm MCP server processes for a single command.
+
+    Exposes the same ``call``/``list_tools`` surface as MCPClient, so callers
+    that used to spawn a fresh server per request can hold on to the pool
+    instead. Each call checks out one idle process; when all ``size``
+    processes are busy the caller waits. Children that have died are
+    replaced on checkout, and a process whose pipe breaks mid-call is
+    discarded rather than returned to the pool.
+
+    With ``multiplex=True`` processes are shared rather than checked out
+    exclusively: each call goes to the least-loaded live child, and a new
+    child is only spawned while every existing one already has requests in
+    flight and the pool is below ``size``.
+
+    ``timeout`` on ``call``/``call_batch`` is a deadline for the whole call,
+    including time spent waiting for a free process.
+    """
+
+    def __init__(
+        self,
+        cmd: str,
+        size: int = 4,
+        multiplex: bool = False,
+        cache: Optional[MCPCache] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.cmd = cmd
+        self.size = max(1, size)
+        self.multiplex = multiplex
+        self.cache = cache
+        self.timeout = default_timeout() if timeout is None else timeout
+        self._idle: List[MCPClient] = []
+        self._shared: List[MCPClient] = []
+        self._in_use = 0
+        self._waiters = 0
+        self._starting = 0
+        self._spawned = 0
+        self._restarted = 0
+        self._timeouts = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _spawn(self) -> MCPClient:
+        client = MCPClient(self.cmd, multiplex=self.multiplex, timeout=self.timeout)
+        with self._cond:
+            self._spawned += 1
+        return client
+
+    @contextmanager
+    def checkout(self, deadline: Optional[float] = None) -> Iterator[MCPClient]:
+        if self.multiplex:
+            with self._checkout_shared(deadline) as client:
+                yield client
+        else:
+            with self._checkout_exclusive(deadline) as client:
+                yield client
+
+    @contextmanager
+    def _checkout_shared(self, deadline: Optional[float] = None) -> Iterator[MCPClient]:
+        # Children are started outside the lock (a socket connect can take
+        # the whole timeout), each holding a slot in ``_starting`` so the
+        # pool never grows past ``size``; callers finding no child yet wait
+        # for one, within their deadline.
+        if not self._cond.acquire(timeout=_remaining(deadline, -1)):
+            raise MCPTimeout(f"MCP call timed out waiting for the pool: {self.cmd}")
+        dead: List[MCPClient] = []
+        try:
+            self._waiters += 1
+            try:
+                while True:
+                    if self._closed:
+                        raise RuntimeError(f"MCP pool is closed: {self.cmd}")
+                    gone = [c for c in self._shared if not c.alive()]
+                    if gone:
+                        self._shared = [c for c in self._shared if c.alive()]
+                        self._restarted += len(gone)
+                        dead.extend(gone)
+                    client = min(self._shared, key=lambda c: c.in_flight(), default=None)
+                    room = len(self._shared) + self._starting < self.size
+                    if client is not None and (client.in_flight() == 0 or not room):
+                        break
+                    if room:
+                        client = None
+                        self._starting += 1
+                        break
+                    remaining = _remaining(deadline, None)
+                    if remaining == 0:
+                        raise MCPTimeout(f"MCP call timed out waiting for a process to start: {self.cmd}")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiters -= 1
+            self._in_use += 1
+        finally:
+            self._cond.release()
+            for c in dead:
+                c.close(timeout=0)
+        try:
+            if client is None:
+                try:
+                    client = MCPClient(self.cmd, multiplex=True, timeout=self.timeout)
+                finally:
+                    with self._cond:
+                        self._starting -= 1
+                        if client is not None:
+                            self._spawned += 1
+                            if not self._closed:
+                                self._shared.append(client)
+                        self._cond.notify_all()
+                if self._closed:
+                    client.close(timeout=0)
+                    raise RuntimeError(f"MCP pool is closed: {self.cmd}")
+            yield client
+        finally:
+            with self._cond:
+                self._in_use -= 1
+
+    @contextmanager
+    def _checkout_exclusive(self, deadline: Optional[float] = None) -> Iterator[MCPClient]:
+        client: Optional[MCPClient] = None
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"MCP pool is closed: {self.cmd}")
+            self._waiters += 1
+            try:
+                while not self._idle and self._in_use >= self.size:
+                    remaining = _remaining(deadline, None)
+                    if remaining == 0:
+                        raise MCPTimeout(f"MCP call timed out waiting for a free process: {self.cmd}")
+                    self._cond.wait(remaining)
+                    if self._closed:
+                        raise RuntimeError(f"MCP pool is closed: {self.cmd}")
+            finally:
+                self._waiters -= 1
+            if self._idle:
+                client = self._idle.pop()
+            self._in_use += 1
+
+        try:
+            if client is not None and not client.alive():
+                client.close(timeout=0)
+                client = None
+                with self._cond:
+                    self._restarted += 1
+            if client is None:
+                client = self._spawn()
+            yield client
+        finally:
+            with self._cond:
+                self._in_use -= 1
+                if client is not None and client.alive() and not self._closed:
+                    self._idle.append(client)
+                    client = None
+                self._cond.notify()
+            if client is not None:
+                client.close(timeout=0)
+
+    def _deadline(self, timeout: Optional[float]) -> Optional[float]:
+        if timeout is None:
+            timeout = self.timeout
+        return time.monotonic() + timeout if timeout and timeout > 0 else None
+
+    def _call(self, method: str, params: Optional[Dict[str, Any]], timeout: Optional[float]) -> Dict[str, Any]:
+        deadline = self._deadline(timeout)
+        try:
+            with self.checkout(deadline) as client:
+                return client.call(method, params, timeout=_budget(deadline))
+        except MCPTimeout:
+            with self._cond:
+                self._timeouts += 1
+            raise
+
+    def _call_batch(self, calls: Sequence[BatchCall], timeout: Optional[float]) -> List[Any]:
+        deadline = self._deadline(timeout)
+        try:
+            with self.checkout(deadline) as client:
+                return client.call_batch(calls, timeout=_budget(deadline))
+        except MCPTimeout:
+            with self._cond:
+                self._timeouts += 1
+            raise
+
+    def call(
+        self, method: str, params: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        cache = self.cache
+        if cache is None:
+            return self._call(method, params, timeout)
+        hit, value, token = cache.lookup(method, params)
+        if hit:
+            return value
+        try:
+            result = self._call(method, params, timeout)
+        finally:
+            cache.note_call(method, params)
+        cache.store(method, params, result, token)
+        return result
+
+    def call_batch(self, calls: Sequence[BatchCall], timeout: Optional[float] = None) -> List[Any]:
+        cache = self.cache
+        if cache is None:
+            return self._call_batch(calls, timeout)
+        out, misses = cache.split_batch(calls)
+        if not misses:
+            return out
+        results = self._call_batch([(m, p) for _, m, p, _ in misses], timeout)
+        return cache.merge_batch(out, misses, results)
+
+    def list_tools(self) -> Dict[str, Any]:
+        return self.call("mcp.list_tools")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            idle = len(self._idle)
+            if self.multiplex:
+                idle = sum(1 for c in self._shared if c.in_flight() == 0)
+            return {
+                "cmd": self.cmd,
+                "size": self.size,
+                "multiplex": self.multiplex,
+                "processes": len(self._shared) if self.multiplex else idle + self._in_use,
+                "idle": idle,
+                "in_use": self._in_use,
+                "waiters": self._waiters,
+                "spawned": self._spawned,
+                "restarted": self._restarted,
+                "timeouts": self._timeouts,
+            }
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle + self._shared, []
+            self._shared = []
+            self._cond.notify_all()
+        for client in idle:
+            client.close()
+
+
+class _AsyncSocketProcess:
+    """asyncio counterpart of _SocketProcess for AsyncMCPClient."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stdout = reader
+        self.stdin = writer
+        self.returncode: Optional[int] = None
+
+    @classmethod
+    async def connect(cls, address: SocketAddress, limit: int) -> "_AsyncSocketProcess":
+        family, target = address
+        if family == socket.AF_UNIX:
+            reader, writer = await asyncio.open_unix_connection(target, limit=limit)
+        else:
+            reader, writer = await asyncio.open_connection(*target, limit=limit)
+        return cls(reader, writer)
+
+    def kill(self) -> None:
+        self.stdin.transport.abort()
+        self.returncode = -9
+
+    async def wait(self) -> int:
+        self.stdin.close()
+        try:
+            await self.stdin.wait_closed()
+        except OSError:
+            pass
+        if self.returncode is None:
+            self.returncode = 0
+        return self.returncode
+
+
+class AsyncMCPClient:
+    """asyncio JSON-RPC client for one MCP server process.
+
+    Same ``call``/``list_tools`` surface as MCPClient but awaitable. The
+    process is started lazily on the first call via
+    ``asyncio.create_subprocess_exec`` and a reader task resolves responses
+    by ``id``, so any number of coroutines can await calls on one pipe
+    without tying up threadpool workers. Run the server with ``--workers``
+    to have it process those requests concurrently too. A client belongs to
+    the event loop it was first used on. ``unix:``/``tcp:`` commands connect
+    to a listening server instead of starting one.
+
+    Calls that outlive their timeout raise MCPTimeout and kill the process;
+    the next call starts a fresh one.
+    """
+
+    # Patient bundles are a single JSON line; allow well beyond asyncio's 64 KiB.
+    LINE_LIMIT = 16 * 1024 * 1024
+
+    def __init__(self, cmd: str, cache: Optional[MCPCache] = None, timeout: Optional[float] = None):
+        self.cmd = cmd
+        self.server = server_label(cmd)
+        self.cache = cache
+        self.timeout = default_timeout() if timeout is None else timeout
+        self.timeouts = 0
+        self.proc: Any = None
+        self.broken = False
+        self.spawned = 0
+        self._pending: Dict[str, "asyncio.Future[Any]"] = {}
+        self._reader: Optional["asyncio.Task[None]"] = None
+        self._start_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+
+    def alive(self) -> bool:
+        return self.proc is not None and not self.broken and self.proc.returncode is None
+
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    async def _ensure_started(self) -> Any:
+        if self.alive():
+            assert self.proc is not None
+            return self.proc
+        async with self._start_lock:
+            if not self.alive():
+                if self.proc is not None:
+                    await self._terminate()
+                address = parse_socket_address(self.cmd)
+                if address is not None:
+                    self.proc = await _AsyncSocketProcess.connect(address, self.LINE_LIMIT)
+                else:
+                    self.proc = await asyncio.create_subprocess_exec(
+                        *self.cmd.split(),
+                        stdin=asyncio.subprocess.PIPE,
+                        stdout=asyncio.subprocess.PIPE,
+                        limit=self.LINE_LIMIT,
+                    )
+                self.broken = False
+                self.spawned += 1
+                # Each process gets its own pending map so a reader winding
+                # down for a replaced process cannot fail the new one's calls.
+                self._pending = {}
+                self._reader = asyncio.create_task(self._read_loop(self.proc, self._pending))
+            assert self.proc is not None
+            return self.proc
+
+    async def _read_loop(
+        self, proc: Any, pending: Dict[str, "asyncio.Future[Any]"]
+    ) -> None:
+        assert proc.stdout is not None
+        reason = f"MCP server exited: {self.cmd}"
+        try:
+            while True:
+                resp_line = await proc.stdout.readline()
+                if not resp_line:
+                    break
+                try:
+                    resp = json.loads(resp_line)
+                except ValueError:
+                    reason = f"MCP server sent an invalid line: {self.cmd}"
+                    break
+                fut = pending.pop(_response_key(resp, pending), None)
+                if fut is not None and not fut.done():
+                    fut.set_result((resp, len(resp_line)))
+        except (OSError, ValueError, asyncio.LimitOverrunError) as e:
+            reason = f"MCP stream error ({e}): {self.cmd}"
+        except asyncio.CancelledError:
+            reason = f"MCP client closed: {self.cmd}"
+        if proc is self.proc:
+            self.broken = True
+        for fut in list(pending.values()):
+            if not fut.done():
+                fut.set_exception(RuntimeError(reason))
+        pending.clear()
+
+    async def _roundtrip(self, req_id: str, line: str, timeout: Optional[float]) -> Tuple[Any, int]:
+        if timeout is None:
+            timeout = self.timeout
+        if timeout and timeout > 0:
+            try:
+                return await asyncio.wait_for(self._exchange(req_id, line), timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                self._pending.pop(req_id, None)
+                self._recycle()
+                raise MCPTimeout(f"MCP call timed out after {timeout}s: {self.cmd}") from None
+        return await self._exchange(req_id, line)
+
+    def _recycle(self) -> None:
+        self.broken = True
+        if self.proc is not None and self.proc.returncode is None:
+            try:
+                self.proc.kill()
+            except ProcessLookupError:
+                pass
+
+    async def _exchange(self, req_id: str, line: str) -> Any:
+        proc = await self._ensure_started()
+        fut: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = fut
+        try:
+            assert proc.stdin is not None
+            async with self._write_lock:
+                proc.stdin.write((line + "\n").encode("utf-8"))
+                await proc.stdin.drain()
+        except (OSError, RuntimeError):
+            self.broken = True
+            self._pending.pop(req_id, None)
+            raise
+        return await fut
+
+    async def _call(
+        self, method: str, params: Optional[Dict[str, Any]], timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        req_id = str(uuid.uuid4())
+        req = {"jsonrpc": "2.0", "id": req_id, "method": method, "params": params or {}}
+        with _CallTimer(self.server, method) as timer:
+            resp, timer.response_bytes = await self._roundtrip(req_id, timer.encode(req), timeout)
+            if "error" in resp:
+                raise MCPError(resp["error"])
+        return resp["result"]
+
+    async def _call_batch(self, calls: Sequence[BatchCall], timeout: Optional[float] = None) -> List[Any]:
+        if not calls:
+            return []
+        ids, reqs = _batch_entries(calls)
+        with _CallTimer(self.server, "batch") as timer:
+            resp, timer.response_bytes = await self._roundtrip(ids[0], timer.encode(reqs), timeout)
+            results = _batch_results(ids, resp)
+        _count_batch(self.server, calls, results)
+        return results
+
+    async def call(
+        self, method: str, params: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        cache = self.cache
+        if cache is None:
+            return await self._call(method, params, timeout)
+        hit, value, token = cache.lookup(method, params)
+        if hit:
+            return value
+        try:
+            result = await self._call(method, params, timeout)
+        finally:
+            cache.note_call(method, params)
+        cache.store(method, params, result, token)
+        return result
+
+    async def call_batch(self, calls: Sequence[BatchCall], timeout: Optional[float] = None) -> List[Any]:
+        """Awaitable counterpart of MCPClient.call_batch()."""
+        cache = self.cache
+        if cache is None:
+            return await self._call_batch(calls, timeout)
+        out, misses = cache.split_batch(calls)
+        if not misses:
+            return out
+        results = await self._call_batch([(m, p) for _, m, p, _ in misses], timeout)
+        return cache.merge_batch(out, misses, results)
+
+    async def list_tools(self) -> Dict[str, Any]:
+        return await self.call("mcp.list_tools")
+
+    async def _terminate(self, timeout: float = 2.0) -> None:
+        proc = self.proc
+        if proc is None:
+            return
+        if proc.stdin is not None:
+            proc.stdin.close()
+        try:
+            await asyncio.wait_for(proc.wait(), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+
+    async def close(self, timeout: float = 2.0) -> None:
+        self.broken = True
+        await self._terminate(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cmd": self.cmd,
+            "async": True,
+            "alive": self.alive(),
+            "in_flight": self.in_flight(),
+            "spawned": self.spawned,
+            "timeouts": self.timeouts,
+        }
+
+
+# ``inproc:<server>`` commands (e.g. ``inproc:mcp-epic-mock``) skip the
+# subprocess entirely and dispatch to mcp/<server>/main.py's METHODS table.
+INPROC_PREFIX = "inproc:"
+_MCP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "mcp"))
+_INPROC_MODULES: Dict[str, ModuleType] = {}
+_INPROC_LOCK = threading.Lock()
+
+
+def is_inproc(cmd: str) -> bool:
+    return cmd.startswith(INPROC_PREFIX)
+
+
+def load_inproc_methods(cmd: str) -> Dict[str, Any]:
+    """Import the server named by an ``inproc:`` command once and return METHODS.
+
+    The name is a directory under ``mcp/`` or a path to a server's main.py.
+    Its directory goes on sys.path so sibling imports (e.g. the Epic
+    fixtures) resolve the same way they do when the server runs as a script.
+    """
+    name = cmd[len(INPROC_PREFIX):].strip()
+    with _INPROC_LOCK:
+        module = _INPROC_MODULES.get(name)
+        if module is None:
+            path = name if name.endswith(".py") else os.path.join(_MCP_DIR, name, "main.py")
+            if not os.path.exists(path):
+                raise RuntimeError(f"MCP server not found for {cmd!r}: {path}")
+            server_dir = os.path.dirname(os.path.abspath(path))
+            if server_dir not in sys.path:
+                sys.path.insert(0, server_dir)
+            mod_name = "_mcp_inproc_" + os.path.basename(server_dir).replace("-", "_")
+            spec = importlib.util.spec_from_file_location(mod_name, path)
+            if spec is None or spec.loader is None:
+                raise RuntimeError(f"Cannot load MCP server for {cmd!r}: {path}")
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            _INPROC_MODULES[name] = module
+    methods = getattr(module, "METHODS", None)
+    if not isinstance(methods, dict):
+        raise RuntimeError(f"MCP server for {cmd!r} has no METHODS table")
+    return methods
+
+
+def _inproc_json_enabled() -> bool:
+    return os.getenv("MCP_INPROC_JSON", "true").lower() in ("1", "true", "yes")
+
+
+class InprocMCPClient:
+    """MCP transport that calls a server's handlers in this process.
+
+    Same ``call``/``call_batch``/``list_tools`` surface as MCPPool, but
+    requests go straight through ``mcp_server.handle_message`` so errors,
+    batches and notifications behave exactly as over stdio, without
+    fork/exec or pipe I/O. By default (``json_roundtrip=True``,
+    MCP_INPROC_JSON) each request and response is encoded and decoded as it
+    would be on the wire, so callers never share objects with the server's
+    in-memory store: mutating a result can't change server state or what
+    the WAL later snapshots. ``json_roundtrip=False`` (MCP_INPROC_JSON=false)
+    skips the copies for callers that treat results as read-only.
+
+    ``timeout`` is accepted for interface parity but cannot interrupt a
+    handler that is already running in the caller's thread.
+    """
+
+    def __init__(self, cmd: str, cache: Optional[MCPCache] = None, json_roundtrip: bool = True):
+        self.cmd = cmd
+        self.server = server_label(cmd)
+        self.cache = cache
+        self.json_roundtrip = json_roundtrip
+        self.methods = load_inproc_methods(cmd)
+        self.calls = 0
+
+    def _dispatch(self, msg: Any, timer: _CallTimer) -> Any:
+        self.calls += 1
+        if not self.json_roundtrip:
+            return handle_message(self.methods, timer.inject(msg))
+        line = timer.encode(msg)
+        resp_line = json.dumps(handle_message(self.methods, json.loads(line)))
+        timer.response_bytes = len(resp_line)
+        return json.loads(resp_line)
+
+    def _call(self, method: str, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        req = {"jsonrpc": "2.0", "id": str(uuid.uuid4()), "method": method, "params": params or {}}
+        with _CallTimer(self.server, method) as timer:
+            resp = self._dispatch(req, timer)
+            if "error" in resp:
+                raise MCPError(resp["error"])
         return resp["result"]
 
+    def _call_batch(self, calls: Sequence[BatchCall]) -> List[Any]:
+        if not calls:
+            return []
+        ids, reqs = _batch_entries(calls)
+        with _CallTimer(self.server, "batch") as timer:
+            results = _batch_results(ids, self._dispatch(reqs, timer))
+        _count_batch(self.server, calls, results)
+        return results
+
+    def call(
+        self, method: str, params: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        cache = self.cache
+        if cache is None:
+            return self._call(method, params)
+        hit, value, token = cache.lookup(method, params)
+        if hit:
+            return value
+        return self._call_through(method, params, token)
+
+    def _call_through(self, method: str, params: Optional[Dict[str, Any]], token: Optional[int]) -> Dict[str, Any]:
+        """Run a call that missed the cache and update the cache from it."""
+        cache = self.cache
+        if cache is None:
+            return self._call(method, params)
+        try:
+            result = self._call(method, params)
+        finally:
+            cache.note_call(method, params)
+        cache.store(method, params, result, token)
+        return result
+
+    def call_batch(self, calls: Sequence[BatchCall], timeout: Optional[float] = None) -> List[Any]:
+        cache = self.cache
+        if cache is None:
+            return self._call_batch(calls)
+        out, misses = cache.split_batch(calls)
+        if not misses:
+            return out
+        results = self._call_batch([(m, p) for _, m, p, _ in misses])
+        return cache.merge_batch(out, misses, results)
+
     def list_tools(self) -> Dict[str, Any]:
         return self.call("mcp.list_tools")
 
+    def stats(self) -> Dict[str, Any]:
+        return {"cmd": self.cmd, "inproc": True, "json_roundtrip": self.json_roundtrip, "calls": self.calls}
+
+    def close(self) -> None:
+        pass
+
+
+# In-process handlers that may block on disk: write-backs wait for the WAL
+# group commit and fsync, and Epic reads seek into the CSV source for
+# patients not loaded yet.
+INPROC_BLOCKING_METHODS = INVALIDATING_METHODS | frozenset({
+    "epic.patient_bundle.get",
+    "epic.resource.get",
+    "epic.resource.get_many",
+    "epic.search",
+})
+
+
+class AsyncInprocMCPClient:
+    """Awaitable face of InprocMCPClient.
+
+    Calls in ``blocking`` (and batches containing one) run in the loop's
+    default executor so disk waits don't stall other requests; cache hits
+    and the remaining, purely in-memory handlers run inline on the event
+    loop thread, where a thread hop would cost more than the call itself.
+    """
+
+    def __init__(self, client: InprocMCPClient, blocking: frozenset = INPROC_BLOCKING_METHODS):
+        self.cmd = client.cmd
+        self.client = client
+        self.blocking = blocking
 
-def make_epic_client() -> MCPClient:
-    cmd = os.getenv("MCP_EPIC_CMD", "python3 mcp/mcp-epic-mock/main.py")
-    return MCPClient(cmd)
+    @property
+    def cache(self) -> Optional[MCPCache]:
+        return self.client.cache
 
+    async def call(
+        self, method: str, params: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        if method not in self.blocking:
+            return self.client.call(method, params)
+        token = None
+        cache = self.client.cache
+        if cache is not None:
+            hit, value, token = cache.lookup(method, params)
+            if hit:
+                return value
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.client._call_through, method, params, token)
 
-def make_hca_client() -> MCPClient:
-    cmd = os.getenv("MCP_HCA_CMD", "python3 mcp/mcp-hca-mock/main.py")
-    return MCPClient(cmd)
+    async def call_batch(self, calls: Sequence[BatchCall], timeout: Optional[float] = None) -> List[Any]:
+        if not any(method in self.blocking for method, _ in calls):
+            return self.client.call_batch(calls)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.client.call_batch, calls)
 
+    async def list_tools(self) -> Dict[str, Any]:
+        return self.client.list_tools()
 
-def make_coo_client() -> MCPClient:
-    cmd = os.getenv("MCP_COO_CMD", "python3 mcp/mcp-coo-mock/main.py")
-    return MCPClient(cmd)
+    async def close(self) -> None:
+        pass
 
+    def stats(self) -> Dict[str, Any]:
+        return {**self.client.stats(), "async": True}
 
-def make_maps_client() -> MCPClient:
+
+# Sync and async transports returned by the make_*_client() factories.
+SyncTransport = Union[MCPPool, InprocMCPClient]
+AsyncTransport = Union[AsyncMCPClient, AsyncInprocMCPClient]
+
+_POOLS: Dict[str, SyncTransport] = {}
+_POOLS_LOCK = threading.Lock()
+_CACHES: Dict[str, MCPCache] = {}
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def get_cache(cmd: str) -> Optional[MCPCache]:
+    """Response cache shared by the sync pool and async clients for ``cmd``.
+
+    Configured by MCP_CACHE_TTL_S (0 disables caching), MCP_CACHE_MAX_ENTRIES
+    and MCP_CACHE_METHODS (comma-separated allowlist override).
+    """
+    ttl = _env_number("MCP_CACHE_TTL_S", 30.0)
+    if ttl <= 0:
+        return None
+    with _POOLS_LOCK:
+        cache = _CACHES.get(cmd)
+        if cache is None:
+            methods = CACHEABLE_METHODS
+            override = os.getenv("MCP_CACHE_METHODS")
+            if override is not None:
+                methods = frozenset(m.strip() for m in override.split(",") if m.strip())
+            cache = MCPCache(
+                ttl=ttl,
+                max_entries=int(_env_number("MCP_CACHE_MAX_ENTRIES", 1024)),
+                methods=methods,
+            )
+            _CACHES[cmd] = cache
+        return cache
+
+
+def cache_stats() -> List[Dict[str, Any]]:
+    with _POOLS_LOCK:
+        caches = list(_CACHES.items())
+    return [{"cmd": cmd, **cache.stats()} for cmd, cache in caches]
+
+
+def _pool_size() -> int:
+    try:
+        return int(os.getenv("MCP_POOL_SIZE", "4"))
+    except ValueError:
+        return 4
+
+
+def _multiplex_enabled() -> bool:
+    return os.getenv("MCP_MULTIPLEX", "").lower() in ("1", "true", "yes")
+
+
+def get_pool(cmd: str) -> SyncTransport:
+    """Return the process-wide pool for ``cmd``, creating it on first use.
+
+    ``inproc:`` commands get an InprocMCPClient instead of a process pool.
+    """
+    cache = get_cache(cmd)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(cmd)
+        if pool is None:
+            if is_inproc(cmd):
+                pool = InprocMCPClient(cmd, cache=cache, json_roundtrip=_inproc_json_enabled())
+            else:
+                pool = MCPPool(cmd, size=_pool_size(), multiplex=_multiplex_enabled(), cache=cache)
+            _POOLS[cmd] = pool
+        return pool
+
+
+def pool_stats() -> List[Dict[str, Any]]:
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    return [p.stats() for p in pools]
+
+
+def shutdown_pools() -> None:
+    """Terminate every pooled MCP server; safe to call more than once."""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for p in pools:
+        p.close()
+
+
+atexit.register(shutdown_pools)
+
+
+# Async clients are bound to the loop that created their subprocess, so the
+# registry is keyed by (loop, cmd) rather than by cmd alone.
+_ASYNC_CLIENTS: Dict[Tuple[int, str], AsyncTransport] = {}
+
+
+def get_async_client(cmd: str) -> AsyncTransport:
+    """Return the shared async client for ``cmd`` on the running loop."""
+    key = (id(asyncio.get_running_loop()), cmd)
+    client = _ASYNC_CLIENTS.get(key)
+    if client is None:
+        if is_inproc(cmd):
+            inproc = get_pool(cmd)
+            assert isinstance(inproc, InprocMCPClient)
+            client = AsyncInprocMCPClient(inproc)
+        else:
+            client = AsyncMCPClient(cmd, cache=get_cache(cmd))
+        _ASYNC_CLIENTS[key] = client
+    return client
+
+
+def async_client_stats() -> List[Dict[str, Any]]:
+    return [c.stats() for c in list(_ASYNC_CLIENTS.values())]
+
+
+async def shutdown_async_clients() -> None:
+    """Close the async clients created on the running loop."""
+    loop_id = id(asyncio.get_running_loop())
+    for key in [k for k in _ASYNC_CLIENTS if k[0] == loop_id]:
+        await _ASYNC_CLIENTS.pop(key).close()
+
+
+def _epic_cmd() -> str:
+    return os.getenv("MCP_EPIC_CMD", "python3 mcp/mcp-epic-mock/main.py")
+
+
+def _hca_cmd() -> str:
+    return os.getenv("MCP_HCA_CMD", "python3 mcp/mcp-hca-mock/main.py")
+
+
+def _coo_cmd() -> str:
+    return os.getenv("MCP_COO_CMD", "python3 mcp/mcp-coo-mock/main.py")
+
+
+def _maps_cmd() -> str:
+    cmd = os.getenv("MCP_MAPS_CMD")
+    if not cmd:
+        raise RuntimeError("MCP_MAPS_CMD is not configured for Maps MCP")
+    return cmd
+
+
+def make_epic_client() -> SyncTransport:
+    return get_pool(_epic_cmd())
+
+
+def make_hca_client() -> SyncTransport:
+    return get_pool(_hca_cmd())
+
+
+def make_coo_client() -> SyncTransport:
+    return get_pool(_coo_cmd())
+
+
+def make_maps_client() -> SyncTransport:
     """Create an MCP client for Google Maps / routing tools.
 
     The underlying command is configurable via MCP_MAPS_CMD so that
@@ -57,7 +1558,21 @@ def make_maps_client() -> MCPClient:
     If MCP_MAPS_CMD is not set, this function raises RuntimeError so
     callers can fall back gracefully.
     """
-    cmd = os.getenv("MCP_MAPS_CMD")
-    if not cmd:
-        raise RuntimeError("MCP_MAPS_CMD is not configured for Maps MCP")
-    return MCPClient(cmd)
+    return get_pool(_maps_cmd())
+
+
+def make_async_epic_client() -> AsyncTransport:
+    return get_async_client(_epic_cmd())
+
+
+def make_async_hca_client() -> AsyncTransport:
+    return get_async_client(_hca_cmd())
+
+
+def make_async_coo_client() -> AsyncTransport:
+    return get_async_client(_coo_cmd())
+
+
+def make_async_maps_client() -> AsyncTransport:
+    """Async counterpart of make_maps_client(); raises RuntimeError likewise."""
+    return get_async_client(_maps_cmd())
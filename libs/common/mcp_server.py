@@ -0,0 +1,372 @@
+"""Shared JSON-RPC 2.0 stdio loop for the local MCP mock servers.
+
+Each mock under ``mcp/`` exposes a ``METHODS`` table mapping method names to
+``handler(params) -> result`` functions and hands it to :func:`serve`.
+
+By default requests are handled one at a time and answered in order. With
+``--workers N`` (or ``MCP_SERVER_WORKERS=N``) requests are dispatched to a
+thread pool and each response is written as soon as it is ready, so replies
+may arrive out of order; clients correlate them by ``id`` (see
+``MCPClient(multiplex=True)`` in ``libs.common.mcp_client``).
+
+Batches follow JSON-RPC 2.0: a line holding an array of request objects is
+answered with one array of responses, each entry succeeding or failing on its
+own. Requests without an ``id`` member are notifications and get no response.
+
+With ``--listen unix:/path/to.sock`` or ``--listen tcp:127.0.0.1:7001`` (or
+``MCP_SERVER_LISTEN``) the server accepts any number of connections instead
+of reading stdin, each speaking the same newline-delimited JSON-RPC. Point an
+``MCP_*_CMD`` at the same address and clients connect rather than spawning,
+so every service worker shares one backend and its in-memory state.
+
+Handlers may call :func:`subscribe` to register the connection they are
+answering for a topic; :func:`publish` then queues JSON-RPC notifications
+(``method`` + ``params``, no ``id``) for every subscribed connection until it
+closes. Each subscribed connection has a bounded queue (MCP_SUBSCRIBER_QUEUE)
+written out by its own thread; one that overflows is dropped with a final
+``mcp.subscription.lost`` notification. This is how a server pushes events
+over a socket (or stdio) without being polled.
+
+A request carrying a W3C ``"traceparent"`` member (added by ``mcp_client``
+when a span is active) is handled inside a child span exported per
+``TRACING_EXPORTER`` (see ``libs.common.tracing``).
+"""
+
+import argparse
+import contextvars
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from libs.common import tracing
+
+Handler = Callable[[Dict[str, Any]], Any]
+
+
+def _response(id_, result=None, error=None) -> Dict[str, Any]:
+    if error is not None:
+        return {"jsonrpc": "2.0", "id": id_, "error": error}
+    return {"jsonrpc": "2.0", "id": id_, "result": result}
+
+
+def _error(code: int, message: str, data=None) -> Dict[str, Any]:
+    return {"code": code, "message": message, "data": data}
+
+
+def handle_request(methods: Dict[str, Handler], req: Any) -> Optional[Dict[str, Any]]:
+    """Dispatch one decoded request object and build its response.
+
+    Returns None for notifications (no ``id`` member).
+    """
+    if not isinstance(req, dict):
+        return _response(None, error=_error(-32600, "Invalid Request"))
+    id_ = req.get("id")
+    method = req.get("method")
+    params = req.get("params", {})
+    traceparent = req.get("traceparent")
+    if traceparent and tracing.enabled():
+        with tracing.start_span(
+            str(method), {"rpc.system": "jsonrpc", "rpc.method": method}, tracing.KIND_SERVER, traceparent
+        ) as span:
+            resp = _dispatch(methods, id_, method, params)
+            if "error" in resp:
+                span.set_attribute("rpc.jsonrpc.error_code", resp["error"]["code"])
+    else:
+        resp = _dispatch(methods, id_, method, params)
+    if "id" not in req:
+        return None
+    return resp
+
+
+def _dispatch(methods: Dict[str, Handler], id_, method, params) -> Dict[str, Any]:
+    if method not in methods:
+        return _response(id_, error=_error(-32601, f"Method not found: {method}"))
+    try:
+        return _response(id_, result=methods[method](params))
+    except Exception as e:  # noqa: BLE001
+        return _response(id_, error=_error(-32000, "Server error", {"message": str(e)}))
+
+
+def handle_message(methods: Dict[str, Handler], msg: Any):
+    """Handle a single request or a batch array; None means nothing to send."""
+    if not isinstance(msg, list):
+        return handle_request(methods, msg)
+    if not msg:
+        return _response(None, error=_error(-32600, "Invalid Request"))
+    out = [r for r in (handle_request(methods, req) for req in msg) if r is not None]
+    return out or None
+
+
+class _LineWriter:
+    """Serialises whole-line writes so concurrent responses never interleave."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write(self, obj: Any) -> None:
+        if obj is None:
+            return
+        line = json.dumps(obj) + "\n"
+        with self.lock:
+            self.stream.write(line)
+            self.stream.flush()
+
+
+# Writer of the connection the current handler is answering.
+_current_writer: "contextvars.ContextVar[Optional[_LineWriter]]" = contextvars.ContextVar("mcp_writer", default=None)
+_subscribers: Dict[str, Set[_LineWriter]] = {}
+_outboxes: Dict[_LineWriter, "_Outbox"] = {}
+_subscribers_lock = threading.Lock()
+
+# Sent (in place of whatever was queued) to a subscriber that fell too far
+# behind; it has been unsubscribed and must catch up by polling.
+LOST_METHOD = "mcp.subscription.lost"
+
+
+def _outbox_size() -> int:
+    try:
+        return max(1, int(os.getenv("MCP_SUBSCRIBER_QUEUE", "1000")))
+    except ValueError:
+        return 1000
+
+
+class _Outbox:
+    """Bounded notification queue for one connection, drained by its own thread.
+
+    :func:`publish` only ever enqueues, so a subscriber that stops reading
+    never blocks the handler (e.g. a write-back) that published.
+    """
+
+    def __init__(self, writer: _LineWriter, size: int):
+        self.writer = writer
+        self.closed = False
+        self.queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=size)
+        self.thread = threading.Thread(target=self._drain, name="mcp-notify", daemon=True)
+        self.thread.start()
+
+    def offer(self, msg: Optional[Dict[str, Any]]) -> bool:
+        try:
+            self.queue.put_nowait(msg)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self, last: Optional[Dict[str, Any]] = None) -> None:
+        """Drop anything queued, then send ``last`` (if any) and stop."""
+        self.closed = True
+        with self.queue.mutex:
+            self.queue.queue.clear()
+        for msg in ([last] if last is not None else []) + [None]:
+            if not self.offer(msg):
+                break  # size-1 queue: the drain thread stops after ``last``
+
+    def _drain(self) -> None:
+        while True:
+            msg = self.queue.get()
+            if msg is None:
+                return
+            try:
+                self.writer.write(msg)
+            except (OSError, ValueError):
+                _unsubscribe_all(self.writer)
+                return
+            if self.closed and self.queue.empty():
+                return
+
+
+def subscribe(topic: str) -> bool:
+    """Send ``topic`` notifications to the calling connection; False outside a connection."""
+    writer = _current_writer.get()
+    if writer is None:
+        return False
+    with _subscribers_lock:
+        _subscribers.setdefault(topic, set()).add(writer)
+        if writer not in _outboxes:
+            _outboxes[writer] = _Outbox(writer, _outbox_size())
+    return True
+
+
+def _unsubscribe_all(writer: _LineWriter, last: Optional[Dict[str, Any]] = None) -> None:
+    with _subscribers_lock:
+        for writers in _subscribers.values():
+            writers.discard(writer)
+        outbox = _outboxes.pop(writer, None)
+    if outbox is not None:
+        outbox.close(last)
+
+
+def publish(topic: str, method: str, params: Any) -> int:
+    """Queue a notification for every subscriber of ``topic``; returns how many took it.
+
+    A subscriber whose queue is full is unsubscribed and sent one
+    ``LOST_METHOD`` notification naming ``topic`` instead.
+    """
+    with _subscribers_lock:
+        outboxes = [_outboxes[w] for w in _subscribers.get(topic, ()) if w in _outboxes]
+    msg = {"jsonrpc": "2.0", "method": method, "params": params}
+    sent = 0
+    for outbox in outboxes:
+        if outbox.offer(msg):
+            sent += 1
+        else:
+            _unsubscribe_all(outbox.writer, {"jsonrpc": "2.0", "method": LOST_METHOD, "params": {"topic": topic}})
+    return sent
+
+
+def _parse(line: str):
+    try:
+        return json.loads(line), None
+    except Exception as e:  # noqa: BLE001
+        return None, _response(None, error=_error(-32700, "Parse error", str(e)))
+
+
+# (address family, bind/connect target) for a ``unix:`` or ``tcp:`` address.
+SocketAddress = Tuple[int, Any]
+
+
+def parse_socket_address(spec: str) -> Optional[SocketAddress]:
+    """Parse ``unix:<path>`` or ``tcp:<host>:<port>``; None for anything else."""
+    if spec.startswith("unix:"):
+        return socket.AF_UNIX, spec[len("unix:"):]
+    if spec.startswith("tcp:"):
+        host, _, port = spec[len("tcp:"):].rpartition(":")
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    return None
+
+
+def _default_workers() -> int:
+    try:
+        return int(os.getenv("MCP_SERVER_WORKERS", "0"))
+    except ValueError:
+        return 0
+
+
+def _parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--workers", type=int, default=_default_workers())
+    parser.add_argument("--listen", default=os.getenv("MCP_SERVER_LISTEN") or None)
+    args, _ = parser.parse_known_args(argv)
+    return args
+
+
+def _serve_lines(methods: Dict[str, Handler], lines, out: _LineWriter, pool: Optional[ThreadPoolExecutor]) -> None:
+    """Answer each request line; with ``pool`` requests run concurrently."""
+
+    def _run(req):
+        token = _current_writer.set(out)
+        try:
+            out.write(handle_message(methods, req))
+        finally:
+            _current_writer.reset(token)
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        req, err = _parse(line)
+        if err is not None:
+            out.write(err)
+        elif pool is None:
+            _run(req)
+        else:
+            pool.submit(_run, req)
+
+
+class _ConnectionHandler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        rfile = self.request.makefile("r", encoding="utf-8")
+        wfile = self.request.makefile("w", encoding="utf-8")
+        writer = _LineWriter(wfile)
+        try:
+            _serve_lines(self.server.methods, rfile, writer, self.server.executor)
+        except OSError:
+            pass  # client went away
+        finally:
+            _unsubscribe_all(writer)
+            for f in (rfile, wfile):
+                try:
+                    f.close()
+                except OSError:
+                    pass
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def make_socket_server(methods: Dict[str, Handler], spec: str, workers: int = 0) -> socketserver.BaseServer:
+    """Bind a threaded server for ``methods`` on a ``unix:`` or ``tcp:`` address.
+
+    Each connection gets its own thread. With ``workers > 1`` requests from
+    all connections also share one worker pool, so a connection may have
+    several requests in flight and replies can come back out of order.
+    """
+    address = parse_socket_address(spec)
+    if address is None:
+        raise ValueError(f"Unsupported listen address: {spec!r}")
+    family, target = address
+    if family == socket.AF_UNIX and os.path.exists(target):
+        os.unlink(target)  # stale socket from a previous run
+    server = (_UnixServer if family == socket.AF_UNIX else _TCPServer)(target, _ConnectionHandler)
+    server.methods = methods
+    server.executor = None
+    if workers > 1:
+        server.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mcp-worker")
+    return server
+
+
+def close_socket_server(server: socketserver.BaseServer) -> None:
+    server.server_close()
+    if server.executor is not None:
+        server.executor.shutdown(wait=False)
+    if isinstance(server, _UnixServer) and os.path.exists(server.server_address):
+        os.unlink(server.server_address)
+
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def serve_socket(methods: Dict[str, Handler], spec: str, workers: int = 0) -> None:
+    """Serve ``methods`` on ``spec`` until interrupted."""
+    server = make_socket_server(methods, spec, workers)
+    if threading.current_thread() is threading.main_thread():
+        # `docker stop` / kill send SIGTERM; unwind so the socket file is removed.
+        signal.signal(signal.SIGTERM, _raise_interrupt)
+    print(f"MCP server listening on {spec}", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_socket_server(server)
+
+
+def serve(methods: Dict[str, Handler], argv: Optional[List[str]] = None, stdin=None, stdout=None) -> None:
+    args = _parse_args(sys.argv[1:] if argv is None else argv)
+    # Name spans after the server directory, e.g. mcp-epic-mock.
+    tracing.configure(service_name=os.path.basename(os.path.dirname(os.path.abspath(sys.argv[0]))))
+    if args.listen:
+        serve_socket(methods, args.listen, workers=args.workers)
+        return
+    stdin = stdin or sys.stdin
+    out = _LineWriter(stdout or sys.stdout)
+
+    if args.workers <= 1:
+        _serve_lines(methods, stdin, out, None)
+        return
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="mcp-worker") as pool:
+        _serve_lines(methods, stdin, out, pool)
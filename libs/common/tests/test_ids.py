@@ -0,0 +1,32 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from libs.common.ids import id_time_ms, new_id
+
+
+def test_ids_are_unique_sortable_and_carry_their_time():
+    started = time.time_ns() // 1_000_000
+    with ThreadPoolExecutor(8) as pool:
+        ids = list(pool.map(lambda _: new_id("res-"), range(20000)))
+    assert len(set(ids)) == len(ids)
+    assert all(i.startswith("res-") and len(i) == 30 for i in ids)
+    assert started <= id_time_ms(ids[0]) <= time.time_ns() // 1_000_000
+
+    first = new_id()
+    time.sleep(0.002)
+    assert new_id() > first
+
+
+def test_forked_workers_do_not_share_a_sequence():
+    if not hasattr(os, "fork"):
+        return
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(write_fd, new_id().encode())
+        os._exit(0)
+    os.waitpid(pid, 0)
+    child = os.read(read_fd, 64).decode()
+    parent = new_id()
+    assert child[10:18] != parent[10:18]
@@ -0,0 +1,432 @@
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from libs.common.mcp_client import (
+    AsyncInprocMCPClient,
+    AsyncMCPClient,
+    InprocMCPClient,
+    MCPCache,
+    MCPClient,
+    MCPError,
+    MCPPool,
+    MCPTimeout,
+)
+from libs.common.mcp_server import serve
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+EPIC_CMD = f"{sys.executable} {os.path.join(ROOT, 'mcp', 'mcp-epic-mock', 'main.py')}"
+
+
+def test_pool_reuses_warm_processes():
+    pool = MCPPool(EPIC_CMD, size=2)
+    try:
+        for _ in range(5):
+            assert pool.call("epic.search", {"resource_type": "CarePlan", "patient_id": "123"})["total"] == 1
+        stats = pool.stats()
+        assert stats["spawned"] == 1
+        assert stats["idle"] == 1 and stats["in_use"] == 0
+    finally:
+        pool.close()
+
+
+def test_pool_is_bounded_under_concurrency():
+    pool = MCPPool(EPIC_CMD, size=2)
+    errors = []
+
+    def worker():
+        try:
+            for _ in range(10):
+                pool.call("auth.smart.token", {"scope": "user/*.read"})
+        except Exception as e:  # pragma: no cover - surfaced via assertion below
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(6)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not errors
+        assert pool.stats()["spawned"] <= 2
+    finally:
+        pool.close()
+
+
+def test_pool_restarts_dead_child():
+    pool = MCPPool(EPIC_CMD, size=1)
+    try:
+        with pool.checkout() as client:
+            client.proc.kill()
+            client.proc.wait()
+        assert pool.call("auth.smart.token", {})["access_token"] == "mock-token"
+        stats = pool.stats()
+        assert stats["spawned"] == 2
+    finally:
+        pool.close()
+
+
+def test_multiplexed_client_correlates_concurrent_calls():
+    client = MCPClient(EPIC_CMD + " --workers 4", multiplex=True)
+    results = {}
+
+    def worker(i):
+        pid = str(101 + i)
+        results[pid] = client.call("epic.discharge_event.get", {"patient_id": pid})
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(16)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(results) == 16
+        assert all(evt["data"]["patientId"] == pid for pid, evt in results.items())
+        assert client.in_flight() == 0
+    finally:
+        client.close()
+
+
+def test_multiplexed_send_failure_releases_lock():
+    client = MCPClient(EPIC_CMD, multiplex=True)
+    try:
+        def broken_send(line):
+            raise OSError("stdin closed")
+
+        client._send = broken_send
+        try:
+            client.call("auth.smart.token", {}, timeout=1)
+        except OSError:
+            pass
+        else:  # pragma: no cover
+            raise AssertionError("send failure was not raised")
+        assert client.lock.acquire(timeout=0.5)
+        client.lock.release()
+    finally:
+        client.close()
+
+
+def test_concurrent_server_replies_out_of_order():
+    def slow(params):
+        time.sleep(0.2)
+        return "slow"
+
+    lines = [
+        json.dumps({"jsonrpc": "2.0", "id": "a", "method": "slow", "params": {}}),
+        json.dumps({"jsonrpc": "2.0", "id": "b", "method": "fast", "params": {}}),
+    ]
+    out = io.StringIO()
+    serve({"slow": slow, "fast": lambda p: "fast"}, argv=["--workers", "2"], stdin=lines, stdout=out)
+    ids = [json.loads(line)["id"] for line in out.getvalue().splitlines()]
+    assert ids == ["b", "a"]
+
+
+def test_async_client_handles_concurrent_calls():
+    async def run():
+        client = AsyncMCPClient(EPIC_CMD)
+        try:
+            pids = [str(101 + i) for i in range(20)]
+            events = await asyncio.gather(
+                *[client.call("epic.discharge_event.get", {"patient_id": pid}) for pid in pids]
+            )
+            assert [evt["data"]["patientId"] for evt in events] == pids
+            assert client.spawned == 1 and client.in_flight() == 0
+        finally:
+            await client.close()
+
+    asyncio.run(run())
+
+
+def test_call_batch_returns_results_in_order_with_per_entry_errors():
+    for multiplex in (False, True):
+        client = MCPClient(EPIC_CMD, multiplex=multiplex)
+        try:
+            out = client.call_batch([
+                ("epic.discharge_event.get", {"patient_id": "101"}),
+                ("epic.no_such_method", {}),
+                ("epic.search", {"resource_type": "CarePlan", "patient_id": "123"}),
+            ])
+            assert out[0]["data"]["patientId"] == "101"
+            assert isinstance(out[1], MCPError) and out[1].code == -32601
+            assert out[2]["total"] == 1
+            assert client.call_batch([]) == []
+        finally:
+            client.close()
+
+
+def test_cache_serves_reads_until_a_write_touches_the_patient():
+    cache = MCPCache(ttl=60, max_entries=2)
+    pool = MCPPool(EPIC_CMD, size=1, cache=cache)
+    search = {"resource_type": "CarePlan", "patient_id": "123"}
+    try:
+        first = pool.call("epic.search", search)
+        first["entry"].clear()  # callers get their own copy
+        assert pool.call("epic.search", dict(reversed(list(search.items()))))["total"] == 1
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        pool.call("epic.fhir_write_back.create", {
+            "resource_type": "Task",
+            "resource_json": {"resourceType": "Task", "for": {"reference": "Patient/123"}},
+        })
+        assert cache.stats()["entries"] == 0
+        pool.call("epic.search", search)
+        assert cache.misses == 2
+
+        # Non-allowlisted methods always go to the server; LRU stays bounded.
+        pool.call("epic.audit.search", {})
+        for pid in ("101", "103", "105"):
+            pool.call("epic.patient_bundle.get", {"patient_id": pid})
+        assert cache.stats()["entries"] == 2 and cache.evictions >= 1
+    finally:
+        pool.close()
+
+
+def test_cache_invalidates_non_patient_reads_by_written_reference():
+    cache = MCPCache(ttl=60)
+    pool = MCPPool(EPIC_CMD, size=1, cache=cache)
+    get = {"resource_type": "Practitioner", "id": "prov-001"}
+    many = {"references": ["Practitioner/prov-001", "Organization/org-001"]}
+    other = {"resource_type": "CarePlan", "patient_id": "123"}
+    bundle = {"patient_id": "123"}
+    try:
+        pool.call("epic.resource.get", get)
+        pool.call("epic.resource.get_many", many)
+        pool.call("epic.search", other)
+        assert "Practitioner/prov-001" in {
+            f"{e['resource']['resourceType']}/{e['resource']['id']}" for e in pool.call("epic.patient_bundle.get", bundle)["entry"]
+        }
+        practitioner = dict(pool.call("epic.resource.get", get)["resource"], active=False)
+        pool.call("epic.fhir_write_back.bundle", {"bundle": {
+            "resourceType": "Bundle",
+            "type": "transaction",
+            "entry": [{"resource": practitioner, "request": {"method": "PUT", "url": "Practitioner/prov-001"}}],
+        }})
+        assert pool.call("epic.resource.get", get)["resource"]["active"] is False
+        assert pool.call("epic.resource.get_many", many)["resources"]["Practitioner/prov-001"]["active"] is False
+        # A patient bundle embedding the practitioner is dropped too.
+        embedded = [e["resource"] for e in pool.call("epic.patient_bundle.get", bundle)["entry"]]
+        assert [r["active"] for r in embedded if r["resourceType"] == "Practitioner" and r["id"] == "prov-001"] == [False]
+        # Reads of an unrelated patient stay cached.
+        hits = cache.hits
+        pool.call("epic.search", other)
+        assert cache.hits == hits + 1
+    finally:
+        pool.close()
+
+
+def test_multiplexed_checkout_honours_the_deadline():
+    pool = MCPPool(EPIC_CMD, size=1, multiplex=True)
+    try:
+        assert pool.call("epic.resource.get", {"resource_type": "Patient", "id": "123"})["resource"]["id"] == "123"
+        # Another caller holding the pool (e.g. while a child starts) must
+        # not stall this one past its deadline.
+        held, release = threading.Event(), threading.Event()
+
+        def hold():
+            with pool._cond:
+                held.set()
+                release.wait(5)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        held.wait()
+        started = time.monotonic()
+        try:
+            with pool.checkout(started + 0.3):
+                raise AssertionError("checked out past the deadline")
+        except MCPTimeout:
+            elapsed = time.monotonic() - started
+        finally:
+            release.set()
+            holder.join()
+        assert elapsed < 2
+    finally:
+        pool.close()
+
+
+def test_timeout_recycles_wedged_child(tmp_path):
+    script = tmp_path / "slow_server.py"
+    script.write_text(
+        "import sys, time\n"
+        f"sys.path.insert(0, {ROOT!r})\n"
+        "from libs.common.mcp_server import serve\n"
+        "serve({'slow': lambda p: time.sleep(30), 'ping': lambda p: 'pong'})\n"
+    )
+    pool = MCPPool(f"{sys.executable} {script}", size=1, timeout=5)
+    try:
+        started = time.monotonic()
+        try:
+            pool.call("slow", timeout=0.3)
+        except MCPTimeout:
+            pass
+        else:  # pragma: no cover
+            raise AssertionError("expected MCPTimeout")
+        assert time.monotonic() - started < 2
+        assert pool.call("ping") == "pong"
+        stats = pool.stats()
+        assert stats["timeouts"] == 1 and stats["spawned"] == 2
+    finally:
+        pool.close()
+
+    async def scenario():
+        client = AsyncMCPClient(f"{sys.executable} {script}")
+        try:
+            try:
+                await client.call("slow", timeout=0.3)
+            except MCPTimeout:
+                pass
+            else:  # pragma: no cover
+                raise AssertionError("expected MCPTimeout")
+            assert await client.call("ping") == "pong"
+            assert client.spawned == 2
+        finally:
+            await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_inproc_transport_matches_stdio_semantics():
+    calls = [
+        ("epic.search", {"resource_type": "CarePlan", "patient_id": "123"}),
+        ("no.such.method", {}),
+    ]
+    for json_roundtrip in (False, True):
+        client = InprocMCPClient("inproc:mcp-epic-mock", json_roundtrip=json_roundtrip)
+        assert client.call("epic.search", {"resource_type": "CarePlan", "patient_id": "123"})["total"] == 1
+        found, missing = client.call_batch(calls)
+        assert found["total"] == 1
+        assert isinstance(missing, MCPError) and missing.code == -32601
+    # The server module is imported once and shared by every client.
+    assert InprocMCPClient("inproc:mcp-epic-mock").methods is client.methods
+
+    # By default callers get copies: mutating a result leaves the store alone.
+    client = InprocMCPClient("inproc:mcp-epic-mock")
+    bundle = client.call("epic.patient_bundle.get", {"patient_id": "123"})
+    bundle["entry"][0]["resource"]["mutated"] = True
+    again = client.call("epic.patient_bundle.get", {"patient_id": "123"})
+    assert "mutated" not in again["entry"][0]["resource"]
+
+
+def test_socket_server_shares_state_across_connections(tmp_path):
+    address = f"unix:{tmp_path / 'epic.sock'}"
+    server = subprocess.Popen(EPIC_CMD.split() + ["--listen", address], stderr=subprocess.DEVNULL)
+    pool = MCPPool(address, size=2)
+    try:
+        for _ in range(50):
+            if (tmp_path / "epic.sock").exists():
+                break
+            time.sleep(0.1)
+        with pool.checkout() as first, pool.checkout() as second:
+            first.call("epic.inbasket.alert", {"patient_id": "sock-1"})
+            found = second.call("epic.audit.search", {"entity_ref": "Patient/sock-1"})
+            assert found["count"] == 1
+        assert pool.stats()["spawned"] == 2
+
+        async def via_async():
+            client = AsyncMCPClient(address)
+            try:
+                return await client.call("epic.audit.search", {"entity_ref": "Patient/sock-1"})
+            finally:
+                await client.close()
+
+        assert asyncio.run(via_async())["count"] == 1
+    finally:
+        pool.close()
+        server.terminate()
+        server.wait()
+
+
+def test_socket_subscriber_receives_pushed_changes(tmp_path):
+    address = f"unix:{tmp_path / 'epic.sock'}"
+    server = subprocess.Popen(EPIC_CMD.split() + ["--listen", address], stderr=subprocess.DEVNULL)
+    pushed = []
+    got = threading.Event()
+
+    def on_notification(method, params):
+        pushed.append((method, params))
+        got.set()
+
+    try:
+        for _ in range(50):
+            if (tmp_path / "epic.sock").exists():
+                break
+            time.sleep(0.1)
+        listener = MCPClient(address, multiplex=True, on_notification=on_notification)
+        writer = MCPClient(address)
+        try:
+            sub = listener.call("epic.changes.subscribe", {})
+            assert sub["subscribed"] is True
+            task = {"status": "requested", "intent": "order", "for": {"reference": "Patient/push-1"}}
+            created = writer.call("epic.fhir_write_back.create", {"resource_type": "Task", "resource_json": task})
+            assert got.wait(5)
+            method, params = pushed[0]
+            assert method == "epic.changes" and params["epoch"] == sub["epoch"]
+            assert [(c["id"], c["patient_id"]) for c in params["changes"]] == [(created["id"], "push-1")]
+            # Polling from the subscribe cursor sees the same change.
+            polled = writer.call("epic.changes.since", {"cursor": sub["cursor"], "epoch": sub["epoch"]})
+            assert polled["changes"] == params["changes"] and polled["more"] is False
+        finally:
+            listener.close()
+            writer.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def test_stalled_subscriber_never_blocks_publish_and_is_dropped(monkeypatch):
+    from libs.common import mcp_server
+
+    class Stalled:
+        def __init__(self):
+            self.release = threading.Event()
+            self.lines = []
+
+        def write(self, line):
+            self.release.wait()
+            self.lines.append(json.loads(line))
+
+        def flush(self):
+            pass
+
+    monkeypatch.setenv("MCP_SUBSCRIBER_QUEUE", "2")
+    stream = Stalled()
+    writer = mcp_server._LineWriter(stream)
+    token = mcp_server._current_writer.set(writer)
+    try:
+        assert mcp_server.subscribe("t")
+    finally:
+        mcp_server._current_writer.reset(token)
+    started = time.monotonic()
+    sent = [mcp_server.publish("t", "evt", {"n": n}) for n in range(10)]
+    assert time.monotonic() - started < 1
+    # Two queue slots (plus one being written), then the subscriber is dropped.
+    assert sent[:2] == [1, 1] and sent[-1] == 0 and "t" in mcp_server._subscribers and not mcp_server._subscribers["t"]
+    stream.release.set()
+    for _ in range(50):
+        if stream.lines and stream.lines[-1]["method"] == mcp_server.LOST_METHOD:
+            break
+        time.sleep(0.02)
+    assert stream.lines[-1] == {"jsonrpc": "2.0", "method": mcp_server.LOST_METHOD, "params": {"topic": "t"}}
+
+
+def test_async_inproc_runs_blocking_handlers_off_the_loop():
+    client = InprocMCPClient("inproc:mcp-epic-mock")
+    client.methods = {
+        "epic.fhir_write_back.create": lambda p: threading.get_ident(),
+        "auth.smart.token": lambda p: threading.get_ident(),
+    }
+
+    async def run():
+        aclient = AsyncInprocMCPClient(client)
+        loop_thread = threading.get_ident()
+        assert await aclient.call("auth.smart.token", {}) == loop_thread
+        assert await aclient.call("epic.fhir_write_back.create", {"resource_type": "Task"}) != loop_thread
+        out = await aclient.call_batch([("auth.smart.token", {}), ("epic.fhir_write_back.create", {})])
+        assert all(ident != loop_thread for ident in out)
+
+    asyncio.run(run())
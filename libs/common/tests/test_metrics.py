@@ -0,0 +1,15 @@
+from libs.common import metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    h = metrics.histogram("test_latency_seconds", "Test latency", ("route",), buckets=(0.1, 1.0))
+    for v in (0.05, 0.5, 5.0):
+        h.labels("/a").observe(v)
+    text = metrics.render()
+    assert '# TYPE test_latency_seconds histogram' in text
+    assert 'test_latency_seconds_bucket{route="/a",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{route="/a",le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{route="/a",le="+Inf"} 3' in text
+    assert 'test_latency_seconds_count{route="/a"} 3' in text
+    # Registration is idempotent so modules can declare metrics at import.
+    assert metrics.histogram("test_latency_seconds", "Test latency", ("route",)) is h
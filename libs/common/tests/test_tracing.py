@@ -0,0 +1,21 @@
+import json
+
+from libs.common import tracing
+from libs.common.mcp_client import InprocMCPClient
+
+
+def test_mcp_calls_propagate_trace_context(tmp_path, monkeypatch):
+    path = tmp_path / "spans.jsonl"
+    monkeypatch.setenv("TRACING_FILE", str(path))
+    tracing.configure(exporter="file")
+    try:
+        client = InprocMCPClient("inproc:mcp-epic-mock")
+        with tracing.start_span("request") as root:
+            client.call("epic.search", {"resource_type": "CarePlan", "patient_id": "123"})
+    finally:
+        tracing.configure(exporter="none")
+    spans = {s["name"]: s for s in map(json.loads, path.read_text().splitlines())}
+    client_span, server_span = spans["mcp epic.search"], spans["epic.search"]
+    assert client_span["parent_id"] == root.span_id
+    assert server_span["parent_id"] == client_span["span_id"]
+    assert len({s["trace_id"] for s in spans.values()}) == 1
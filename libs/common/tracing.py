@@ -0,0 +1,331 @@
+"""Lightweight distributed tracing with OTLP/HTTP export.
+
+Spans are opened with :func:`start_span` and nest through a context
+variable, so they follow asyncio tasks and ``run_in_threadpool`` calls.
+Across processes the current span travels as a W3C ``traceparent`` string:
+in the HTTP header for incoming requests and as a top-level
+``"traceparent"`` member of JSON-RPC requests to the MCP servers (see
+``mcp_client`` / ``mcp_server``), which open child spans for each handler.
+
+Export is chosen by ``TRACING_EXPORTER``:
+
+- ``none`` (default): spans are not recorded at all.
+- ``otlp``: batched OTLP/HTTP JSON POSTs to ``OTEL_EXPORTER_OTLP_ENDPOINT``
+  (``/v1/traces`` is appended), e.g. Jaeger on ``http://localhost:4318``.
+- ``file``: one JSON span per line appended to ``TRACING_FILE``.
+- ``stdout``: one JSON span per line on stderr. Stdio MCP servers use
+  stdout for JSON-RPC, so spans never go there.
+
+The service name comes from ``OTEL_SERVICE_NAME`` unless the process sets
+one with :func:`configure`.
+"""
+
+import atexit
+import contextvars
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], kind: int, attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self, service: str) -> Dict[str, Any]:
+        return {
+            "service": service,
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """Returned when tracing is off so call sites need no guards."""
+
+    traceparent = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+_current: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("agentis_span", default=None)
+_service_name = os.getenv("OTEL_SERVICE_NAME", "agentis")
+_exporter: Optional["_Exporter"] = None
+_exporter_lock = threading.Lock()
+_configured = False
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Return (trace_id, parent span_id) from a W3C traceparent, else None."""
+    if not value or not isinstance(value, str):
+        return None
+    parts = value.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2]
+
+
+def configure(service_name: Optional[str] = None, exporter: Optional[str] = None) -> None:
+    """Set this process's service name and/or exporter (overriding the env)."""
+    global _service_name, _exporter, _configured
+    with _exporter_lock:
+        if service_name:
+            _service_name = service_name
+        if exporter is not None or not _configured:
+            if _exporter is not None:
+                _exporter.close()
+            _exporter = _make_exporter(exporter if exporter is not None else os.getenv("TRACING_EXPORTER", "none"))
+            _configured = True
+
+
+def enabled() -> bool:
+    if not _configured:
+        configure()
+    return _exporter is not None
+
+
+def current_traceparent() -> Optional[str]:
+    span = _current.get()
+    return span.traceparent if span is not None else None
+
+
+@contextmanager
+def start_span(
+    name: str,
+    attributes: Optional[Dict[str, Any]] = None,
+    kind: int = KIND_INTERNAL,
+    traceparent: Optional[str] = None,
+) -> Iterator[Any]:
+    """Open a span as a child of the current one (or of ``traceparent``)."""
+    if not enabled():
+        yield _NOOP
+        return
+    parent = _current.get()
+    remote = parse_traceparent(traceparent) if traceparent else None
+    if remote is not None:
+        trace_id, parent_id = remote
+    elif parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    else:
+        trace_id, parent_id = os.urandom(16).hex(), None
+    span = Span(name, trace_id, parent_id, kind, dict(attributes or {}))
+    token = _current.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        span.end_ns = time.time_ns()
+        exporter = _exporter
+        if exporter is not None:
+            exporter.export(span)
+
+
+def flush() -> None:
+    exporter = _exporter
+    if exporter is not None:
+        exporter.flush()
+
+
+class _Exporter:
+    def export(self, span: Span) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.flush()
+
+
+class _LineExporter(_Exporter):
+    """Writes each finished span as one JSON line (file or stderr)."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stream = open(path, "a", encoding="utf-8") if path else sys.stderr
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(_service_name), default=str) + "\n"
+        with self.lock:
+            self.stream.write(line)
+            self.stream.flush()
+
+    def close(self) -> None:
+        if self.path:
+            with self.lock:
+                self.stream.close()
+
+
+def _otlp_value(v: Any) -> Dict[str, Any]:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    return {"stringValue": str(v)}
+
+
+def _otlp_span(span: Span) -> Dict[str, Any]:
+    out: Dict[str, Any] = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items() if v is not None],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+    if span.parent_id:
+        out["parentSpanId"] = span.parent_id
+    return out
+
+
+class _OTLPExporter(_Exporter):
+    """Batches spans on a background thread and POSTs them as OTLP/HTTP JSON.
+
+    Export is best-effort: a collector that is down costs dropped spans,
+    never a failed request.
+    """
+
+    MAX_BATCH = 256
+    MAX_QUEUE = 8192
+
+    def __init__(self, endpoint: str, interval: float = 1.0):
+        self.url = endpoint.rstrip("/")
+        if not self.url.endswith("/v1/traces"):
+            self.url += "/v1/traces"
+        self.interval = interval
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(self.MAX_QUEUE)
+        self._idle = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="otlp-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            batch: List[Span] = []
+            try:
+                item = self._queue.get(timeout=self.interval)
+            except queue.Empty:
+                self._idle.set()
+                continue
+            if item is None:
+                return
+            batch.append(item)
+            while len(batch) < self.MAX_BATCH:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._post(batch)
+                    return
+                batch.append(item)
+            self._post(batch)
+            if self._queue.empty():
+                self._idle.set()
+
+    def _post(self, batch: List[Span]) -> None:
+        body = {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": _service_name}}]},
+                    "scopeSpans": [{"scope": {"name": "libs.common.tracing"}, "spans": [_otlp_span(s) for s in batch]}],
+                }
+            ]
+        }
+        req = urllib.request.Request(
+            self.url,
+            data=json.dumps(body, default=str).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=5) as resp:
+                resp.read()
+        except Exception:  # noqa: BLE001 - tracing must never break the caller
+            self.dropped += len(batch)
+
+    def flush(self, timeout: float = 5.0) -> None:
+        if not self._thread.is_alive():
+            return
+        self._idle.clear()
+        if self._queue.empty():
+            return
+        self._idle.wait(timeout)
+
+    def close(self) -> None:
+        self.flush()
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+def _make_exporter(kind: str) -> Optional[_Exporter]:
+    kind = (kind or "none").strip().lower()
+    if kind == "otlp":
+        return _OTLPExporter(os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318"))
+    if kind == "file":
+        return _LineExporter(os.getenv("TRACING_FILE", "traces.jsonl"))
+    if kind in ("stdout", "stderr", "console"):
+        return _LineExporter()
+    return None
+
+
+def _shutdown() -> None:
+    exporter = _exporter
+    if exporter is not None:
+        exporter.close()
+
+
+atexit.register(_shutdown)
@@ -1,5 +1,4 @@
 #!/usr/bin/env python3
-import json
 import sys
 import os
 import csv
@@ -16,6 +15,11 @@ from typing import Any, Dict, List
 # - mcp.list_tools
 
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+# Allow `python3 mcp/mcp-coo-mock/main.py` to import the shared libs package.
+sys.path.insert(0, PROJECT_ROOT)
+
+from libs.common.mcp_server import serve  # noqa: E402
+
 DEFAULT_DATA_DIR = os.path.abspath(os.path.join(PROJECT_ROOT, "..", "agent-orchestration-service", "app"))
 COO_DATA_DIR = os.environ.get("COO_DATA_DIR", DEFAULT_DATA_DIR)
 
@@ -70,18 +74,6 @@ TOOLS = [
 ]
 
 
-def _write(obj: Dict[str, Any]):
-    sys.stdout.write(json.dumps(obj) + "\n")
-    sys.stdout.flush()
-
-
-def _ok(id_, result):
-    _write({"jsonrpc": "2.0", "id": id_, "result": result})
-
-
-def _err(id_, code, message, data=None):
-    _write({"jsonrpc": "2.0", "id": id_, "error": {"code": code, "message": message, "data": data}})
-
 
 def list_tools():
     return {"tools": TOOLS}
@@ -189,26 +181,7 @@ METHODS = {
 
 
 def main():
-    for line in sys.stdin:
-        line = line.strip()
-        if not line:
-            continue
-        try:
-            req = json.loads(line)
-        except Exception as e:
-            _write({"jsonrpc": "2.0", "id": None, "error": {"code": -32700, "message": "Parse error", "data": str(e)}})
-            continue
-        id_ = req.get("id")
-        method = req.get("method")
-        params = req.get("params", {})
-        if method not in METHODS:
-            _err(id_, -32601, f"Method not found: {method}")
-            continue
-        try:
-            result = METHODS[method](params)
-            _ok(id_, result)
-        except Exception as e:
-            _err(id_, -32000, "Server error", {"message": str(e)})
+    serve(METHODS)
 
 
 if __name__ == "__main__":
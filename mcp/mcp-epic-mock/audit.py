@@ -0,0 +1,191 @@
+"""Bounded, indexed audit log for the Epic mock.
+
+Entries live in a ring buffer of ``max_entries`` (oldest evicted first) with
+per-value indexes on ``actor_ref``, ``entity_ref`` and ``action``. Every
+entry gets a ``seq`` number in append order and every index holds those in
+order, so eviction pops from the left of each index and a query walks one
+index from the newest end. ``after`` (a ``seq`` cursor) bounds that walk;
+``since``/``until`` compare the caller-supplied timestamps, which need not
+be in append order, so they only filter.
+
+With ``directory`` set, entries are also appended as JSON lines to segment
+files (``audit-000001.jsonl``, ...) that roll over at ``segment_bytes``;
+only the newest ``max_segments`` are kept. On startup the newest
+``max_entries`` lines are replayed into memory, keeping their ``seq``.
+"""
+
+import json
+import os
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+AuditEntry = Dict[str, Any]
+
+INDEXED_FIELDS = ("actor_ref", "entity_ref", "action")
+SEGMENT_PREFIX = "audit-"
+SEGMENT_SUFFIX = ".jsonl"
+
+
+class AuditLog:
+    def __init__(
+        self,
+        max_entries: int = 100_000,
+        directory: Optional[str] = None,
+        segment_bytes: int = 64 * 1024 * 1024,
+        max_segments: int = 16,
+    ):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self._lock = threading.Lock()
+        self._entries: Dict[int, AuditEntry] = {}
+        self._order: Deque[int] = deque()
+        self._index: Dict[str, Dict[str, Deque[int]]] = {f: {} for f in INDEXED_FIELDS}
+        self._next_seq = 0
+        self._segment = None
+        self._segment_no = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._replay()
+
+    @classmethod
+    def from_env(cls) -> "AuditLog":
+        return cls(
+            max_entries=int(os.getenv("EPIC_AUDIT_MAX_ENTRIES", "100000")),
+            directory=os.getenv("EPIC_AUDIT_DIR") or None,
+            segment_bytes=int(os.getenv("EPIC_AUDIT_SEGMENT_BYTES", str(64 * 1024 * 1024))),
+            max_segments=int(os.getenv("EPIC_AUDIT_MAX_SEGMENTS", "16")),
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def append(self, entry: AuditEntry) -> None:
+        with self._lock:
+            entry = self._add(entry)
+            if self.directory:
+                self._write(entry)
+
+    def _add(self, entry: AuditEntry) -> AuditEntry:
+        seq = entry.get("seq")
+        if not isinstance(seq, int) or seq < self._next_seq:
+            seq = self._next_seq
+        self._next_seq = seq + 1
+        entry = {**entry, "seq": seq}
+        self._entries[seq] = entry
+        self._order.append(seq)
+        for field in INDEXED_FIELDS:
+            value = entry.get(field)
+            if value is not None:
+                self._index[field].setdefault(str(value), deque()).append(seq)
+        while len(self._order) > self.max_entries:
+            self._evict(self._order.popleft())
+        return entry
+
+    def _evict(self, seq: int) -> None:
+        entry = self._entries.pop(seq)
+        for field in INDEXED_FIELDS:
+            value = entry.get(field)
+            if value is None:
+                continue
+            seqs = self._index[field].get(str(value))
+            if seqs and seqs[0] == seq:
+                seqs.popleft()
+                if not seqs:
+                    del self._index[field][str(value)]
+
+    def search(
+        self,
+        actor_ref: Optional[str] = None,
+        entity_ref: Optional[str] = None,
+        action: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        limit: Optional[int] = None,
+        after: Optional[int] = None,
+    ) -> List[AuditEntry]:
+        """Matching entries, oldest first; ``limit`` keeps the newest ones.
+
+        ``since`` is inclusive and ``until`` exclusive, compared against the
+        ISO ``timestamp`` of each entry. With ``after`` only entries whose
+        ``seq`` is greater are returned and ``limit`` keeps the oldest of
+        them, so the last ``seq`` is the cursor for the next page.
+        """
+        filters = {f: v for f, v in zip(INDEXED_FIELDS, (actor_ref, entity_ref, action)) if v}
+        with self._lock:
+            candidates: Deque[int] = self._order
+            for field, value in filters.items():
+                seqs = self._index[field].get(str(value))
+                if not seqs:
+                    return []
+                if candidates is self._order or len(seqs) < len(candidates):
+                    candidates = seqs
+            out: List[AuditEntry] = []
+            for seq in reversed(candidates):
+                if after is not None and seq <= after:
+                    break
+                entry = self._entries[seq]
+                stamp = entry.get("timestamp") or ""
+                if (since and stamp < since) or (until and stamp >= until):
+                    continue
+                if any(entry.get(f) != v for f, v in filters.items()):
+                    continue
+                out.append(entry)
+                if after is None and limit is not None and len(out) >= limit:
+                    break
+        out.reverse()
+        if after is not None and limit is not None:
+            del out[limit:]
+        return out
+
+    def _segments(self) -> List[str]:
+        names = [
+            n for n in os.listdir(self.directory or ".") if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX)
+        ]
+        return sorted(names)
+
+    def _replay(self) -> None:
+        segments = self._segments()
+        # Newest segments first until the ring buffer would be full.
+        needed: List[str] = []
+        lines = 0
+        for name in reversed(segments):
+            needed.append(name)
+            with open(os.path.join(self.directory or ".", name), "rb") as fh:
+                lines += sum(1 for _ in fh)
+            if lines >= self.max_entries:
+                break
+        for name in reversed(needed):
+            with open(os.path.join(self.directory or ".", name), "r", encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        self._add(json.loads(line))
+                    except ValueError:
+                        # A torn final line from a crash mid-write.
+                        continue
+        if segments:
+            self._segment_no = int(segments[-1][len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+    def _write(self, entry: AuditEntry) -> None:
+        if self._segment is None or self._segment.tell() >= self.segment_bytes:
+            if self._segment is not None:
+                self._segment.close()
+                self._segment_no += 1
+            self._segment_no = max(self._segment_no, 1)
+            path = os.path.join(self.directory or ".", f"{SEGMENT_PREFIX}{self._segment_no:06d}{SEGMENT_SUFFIX}")
+            self._segment = open(path, "a", encoding="utf-8")
+            if self.max_segments > 0:
+                for name in self._segments()[:-self.max_segments]:
+                    os.remove(os.path.join(self.directory or ".", name))
+        self._segment.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self._segment.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
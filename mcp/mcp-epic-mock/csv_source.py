@@ -0,0 +1,401 @@
+"""Lazily materialised FHIR resources from the generated CSVs (data/csv).
+
+At startup each per-patient CSV is scanned once for its ``patient_id``
+column and reduced to a compact row-offset index:
+
+- one dict mapping patient id -> ordinal, shared by every table;
+- per table, ``start``/``count`` arrays by ordinal and one flat array of
+  byte offsets grouped by patient.
+
+The index is cached in ``.epic-index.bin`` next to the CSVs (a JSON header
+with each file's size and mtime, then raw int64 arrays, checked on load), so
+later boots skip the scan. A patient's rows
+are only read (``seek`` + one line each) and turned into FHIR resources the
+first time the patient is asked for; materialised patients are kept in the
+store under an LRU bound and dropped from it again when evicted.
+
+Rows must be one per line (no embedded newlines), as ``generate_csv.py``
+writes them.
+"""
+
+import csv
+import json
+import os
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from store import FHIRStore, Resource
+
+INDEX_FILE = ".epic-index.bin"
+INDEX_VERSION = 2
+
+Row = Dict[str, str]
+
+
+def _ts(value: str) -> Optional[str]:
+    """``2025-09-25 20:28:50.140696`` -> ``2025-09-25T20:28:50Z``."""
+    if not value:
+        return None
+    if len(value) <= 10:
+        return value
+    return value.replace(" ", "T")[:19] + "Z"
+
+
+def _ref(rtype: str, rid: str) -> Optional[Dict[str, str]]:
+    return {"reference": f"{rtype}/{rid}"} if rid else None
+
+
+def _clean(resource: Resource) -> Resource:
+    return {k: v for k, v in resource.items() if v not in (None, "", [], {})}
+
+
+def _patient(row: Row) -> Resource:
+    identifiers = [{"system": "urn:mrn", "value": row.get("mrn")}]
+    if row.get("ihi"):
+        identifiers.append({"system": "http://ns.electronichealth.net.au/id/hi/ihi/1.0", "value": row["ihi"]})
+    gender = row.get("gender_identity") or row.get("sex_at_birth") or "unknown"
+    address = _clean({
+        "line": [row["address_line1"]] if row.get("address_line1") else None,
+        "city": row.get("suburb"),
+        "state": row.get("state"),
+        "postalCode": row.get("postcode"),
+    })
+    telecom = [
+        {"system": system, "value": row[field]} for system, field in (("phone", "phone"), ("email", "email")) if row.get(field)
+    ]
+    return _clean({
+        "resourceType": "Patient",
+        "id": row["patient_id"],
+        "identifier": identifiers,
+        "name": [{"given": [row.get("given_name", "")], "family": row.get("family_name", "")}],
+        "gender": gender if gender in ("male", "female", "other", "unknown") else "other",
+        "birthDate": row.get("dob"),
+        "address": [address] if address else None,
+        "telecom": telecom,
+        "deceasedBoolean": row["deceased_bool"] == "true" if row.get("deceased_bool") else None,
+    })
+
+
+def _encounter(row: Row) -> Resource:
+    return _clean({
+        "resourceType": "Encounter",
+        "id": row["encounter_id"],
+        "status": row.get("status"),
+        "class": {"code": row.get("class_code")},
+        "type": [{"text": row.get("type_code")}],
+        "subject": _ref("Patient", row["patient_id"]),
+        "period": _clean({"start": _ts(row.get("start_ts", "")), "end": _ts(row.get("end_ts", ""))}),
+        "location": [{"location": _ref("Location", row.get("location_id", ""))}] if row.get("location_id") else None,
+        "serviceProvider": _ref("Organization", row.get("service_provider_org_id", "")),
+    })
+
+
+def _observation(row: Row) -> Resource:
+    res = {
+        "resourceType": "Observation",
+        "id": row["observation_id"],
+        "status": "final",
+        "code": {"coding": [{"system": row.get("code_system"), "code": row.get("code")}], "text": row.get("code")},
+        "subject": _ref("Patient", row["patient_id"]),
+        "encounter": _ref("Encounter", row.get("encounter_id", "")),
+        "effectiveDateTime": _ts(row.get("effective_ts", "")),
+        "performer": [_ref("Practitioner", row["performer_id"])] if row.get("performer_id") else None,
+    }
+    if row.get("value_numeric"):
+        res["valueQuantity"] = {"value": float(row["value_numeric"]), "unit": row.get("unit")}
+    elif row.get("value_string"):
+        res["valueString"] = row["value_string"]
+    return _clean(res)
+
+
+def _medication_request(row: Row) -> Resource:
+    return _clean({
+        "resourceType": "MedicationRequest",
+        "id": row["med_request_id"],
+        "status": row.get("status"),
+        "intent": row.get("intent"),
+        "medicationCodeableConcept": {
+            "coding": [{"system": row.get("med_system"), "code": row.get("med_code")}],
+            "text": row.get("dosage_text"),
+        },
+        "subject": _ref("Patient", row["patient_id"]),
+        "encounter": _ref("Encounter", row.get("encounter_id", "")),
+        "requester": _ref("Practitioner", row.get("prescriber_id", "")),
+        "authoredOn": _ts(row.get("authored_on", "")),
+        "dosageInstruction": [{"text": row["dosage_text"]}] if row.get("dosage_text") else None,
+    })
+
+
+def _care_plan(row: Row) -> Resource:
+    return _clean({
+        "resourceType": "CarePlan",
+        "id": row["care_plan_id"],
+        "status": row.get("status"),
+        "intent": row.get("intent"),
+        "title": row.get("title"),
+        "description": row.get("goal_text"),
+        "subject": _ref("Patient", row["patient_id"]),
+        "period": _clean({"start": row.get("period_start"), "end": row.get("period_end")}),
+    })
+
+
+def _consent(row: Row) -> Resource:
+    try:
+        actors = json.loads(row.get("actors") or "[]")
+    except ValueError:
+        actors = []
+    return _clean({
+        "resourceType": "Consent",
+        "id": row["consent_id"],
+        "status": "active",
+        "scope": {"text": row.get("scope")},
+        "category": [{"text": row.get("category")}],
+        "patient": _ref("Patient", row["patient_id"]),
+        "provision": _clean({
+            "type": row.get("provision_type"),
+            "period": _clean({"start": _ts(row.get("period_start", "")), "end": _ts(row.get("period_end", ""))}),
+            "actor": [{"reference": a} for a in actors],
+        }),
+    })
+
+
+# file name -> (resource type, row mapper)
+TABLES: Dict[str, Tuple[str, Callable[[Row], Resource]]] = {
+    "patient.csv": ("Patient", _patient),
+    "encounter.csv": ("Encounter", _encounter),
+    "observation.csv": ("Observation", _observation),
+    "medication_request.csv": ("MedicationRequest", _medication_request),
+    "care_plan.csv": ("CarePlan", _care_plan),
+    "consent.csv": ("Consent", _consent),
+}
+
+
+class _Table:
+    __slots__ = ("path", "header", "starts", "counts", "offsets")
+
+    def __init__(self, path: str, header: List[str], starts: array, counts: array, offsets: array):
+        self.path = path
+        self.header = header
+        self.starts = starts
+        self.counts = counts
+        self.offsets = offsets
+
+
+class CSVSource:
+    def __init__(self, directory: str, store: FHIRStore, max_patients: int = 10_000):
+        self.directory = directory
+        self.store = store
+        self.max_patients = max_patients
+        self._lock = threading.Lock()
+        self._ordinals: Dict[str, int] = {}
+        self._tables: Dict[str, _Table] = {}
+        # patient id -> (type, id, resource) materialised for it, LRU order
+        self._cache: "OrderedDict[str, List[Tuple[str, str, Resource]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._load_index()
+        # Hand-written fixture patients already in the store win over
+        # generated rows; recorded once so later write-backs don't count.
+        self._fixtures = {pid for pid in self._ordinals if store.get("Patient", pid) is not None}
+
+    @classmethod
+    def from_env(cls, store: FHIRStore) -> Optional["CSVSource"]:
+        directory = os.getenv("EPIC_CSV_DIR")
+        if not directory:
+            return None
+        return cls(directory, store, max_patients=int(os.getenv("EPIC_CSV_CACHE_PATIENTS", "10000")))
+
+    def __len__(self) -> int:
+        return len(self._ordinals)
+
+    def _files(self) -> Dict[str, Tuple[int, int]]:
+        out = {}
+        for name in TABLES:
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path):
+                st = os.stat(path)
+                out[name] = (st.st_size, st.st_mtime_ns)
+        return out
+
+    def _load_index(self) -> None:
+        files = self._files()
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        if self._read_index(index_path, files):
+            return
+        self._ordinals, self._tables = {}, {}
+        for name in files:
+            self._tables[name] = self._scan(name)
+        patients = [""] * len(self._ordinals)
+        for pid, i in self._ordinals.items():
+            patients[i] = pid
+        # Pad every table's arrays to the final patient count.
+        for table in self._tables.values():
+            missing = len(patients) - len(table.starts)
+            table.starts.extend([0] * missing)
+            table.counts.extend([0] * missing)
+        try:
+            self._write_index(index_path, files, patients)
+        except OSError:
+            # Read-only data directory: scan again next boot.
+            pass
+
+    def _read_index(self, index_path: str, files: Dict[str, Tuple[int, int]]) -> bool:
+        """Load a cached index if it matches ``files``; False means rescan.
+
+        The file is a JSON header line then raw little-endian int64 arrays,
+        so a tampered index can at worst fail validation, never run code.
+        """
+        try:
+            with open(index_path, "rb") as fh:
+                head = json.loads(fh.readline().decode("utf-8"))
+                if head.get("version") != INDEX_VERSION or head.get("files") != {n: list(v) for n, v in files.items()}:
+                    return False
+                patients = head["patients"]
+                n = len(patients)
+                tables = {}
+                for name, meta in head["tables"].items():
+                    if name not in files:
+                        return False
+                    arrays = []
+                    for length in (n, n, int(meta["rows"])):
+                        values = array("q")
+                        values.fromfile(fh, length)
+                        if sys.byteorder != "little":
+                            values.byteswap()
+                        arrays.append(values)
+                    starts, counts, offsets = arrays
+                    size = files[name][0]
+                    if any(c < 0 or s < 0 or s + c > len(offsets) for s, c in zip(starts, counts)):
+                        return False
+                    if offsets and (min(offsets) < 0 or max(offsets) >= size):
+                        return False
+                    tables[name] = _Table(os.path.join(self.directory, name), list(meta["header"]), starts, counts, offsets)
+                if fh.read(1):
+                    return False
+        except (OSError, ValueError, KeyError, TypeError, EOFError):
+            return False
+        self._ordinals = {str(pid): i for i, pid in enumerate(patients)}
+        self._tables = tables
+        return True
+
+    def _write_index(self, index_path: str, files: Dict[str, Tuple[int, int]], patients: List[str]) -> None:
+        head = {
+            "version": INDEX_VERSION,
+            "files": {n: list(v) for n, v in files.items()},
+            "patients": patients,
+            "tables": {n: {"header": t.header, "rows": len(t.offsets)} for n, t in self._tables.items()},
+        }
+        tmp = index_path + ".tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(json.dumps(head, separators=(",", ":")).encode("utf-8") + b"\n")
+            for table in self._tables.values():
+                for values in (table.starts, table.counts, table.offsets):
+                    values = array("q", values)
+                    if sys.byteorder != "little":
+                        values.byteswap()
+                    values.tofile(fh)
+        os.replace(tmp, index_path)
+
+    def _scan(self, name: str) -> _Table:
+        path = os.path.join(self.directory, name)
+        ordinals = self._ordinals
+        row_ordinals = array("l")
+        row_offsets = array("q")
+        with open(path, "rb") as fh:
+            header_line = fh.readline()
+            header = next(csv.reader([header_line.decode("utf-8")]))
+            col = header.index("patient_id")
+            offset = len(header_line)
+            add_ordinal = row_ordinals.append
+            add_offset = row_offsets.append
+            for line in fh:
+                if b'"' in line:
+                    pid = next(csv.reader([line.decode("utf-8")]))[col]
+                else:
+                    pid = line.split(b",", col + 1)[col].strip().decode("utf-8")
+                if pid:
+                    ordinal = ordinals.get(pid)
+                    if ordinal is None:
+                        ordinal = ordinals[pid] = len(ordinals)
+                    add_ordinal(ordinal)
+                    add_offset(offset)
+                offset += len(line)
+        # Counting sort of row offsets by patient ordinal.
+        counts = array("l", [0]) * len(ordinals)
+        for ordinal in row_ordinals:
+            counts[ordinal] += 1
+        starts = array("q", [0]) * len(ordinals)
+        total = 0
+        for i, c in enumerate(counts):
+            starts[i] = total
+            total += c
+        offsets = array("q", [0]) * total
+        fill = array("q", starts)
+        for ordinal, off in zip(row_ordinals, row_offsets):
+            offsets[fill[ordinal]] = off
+            fill[ordinal] += 1
+        return _Table(path, header, starts, counts, offsets)
+
+    def _rows(self, table: _Table, ordinal: int) -> List[Row]:
+        if ordinal >= len(table.counts) or not table.counts[ordinal]:
+            return []
+        start = table.starts[ordinal]
+        lines = []
+        with open(table.path, "rb") as fh:
+            for off in table.offsets[start:start + table.counts[ordinal]]:
+                fh.seek(off)
+                lines.append(fh.readline().decode("utf-8"))
+        return [dict(zip(table.header, values)) for values in csv.reader(lines)]
+
+    def ensure(self, patient_id: str) -> bool:
+        """Materialise ``patient_id`` into the store; False if not in the CSVs."""
+        pid = str(patient_id)
+        with self._lock:
+            if pid in self._cache:
+                self._cache.move_to_end(pid)
+                self.hits += 1
+                return True
+            ordinal = self._ordinals.get(pid)
+            if ordinal is None or pid in self._fixtures:
+                return False
+            self.misses += 1
+            loaded: List[Tuple[str, str, Resource]] = []
+            for name, table in self._tables.items():
+                rtype, mapper = TABLES[name]
+                for row in self._rows(table, ordinal):
+                    res = mapper(row)
+                    # Written-back versions (kept through eviction or
+                    # replayed from the WAL) win over the generated row.
+                    if self.store.get(rtype, res["id"]) is None:
+                        loaded.append((rtype, res["id"], res))
+            self.store.put_many(res for _, _, res in loaded)
+            self._cache[pid] = loaded
+            while len(self._cache) > self.max_patients:
+                _, evicted = self._cache.popitem(last=False)
+                for rtype, rid, res in evicted:
+                    # Keep anything replaced since (e.g. by a write-back).
+                    if self.store.get(rtype, rid) is res:
+                        self.store.remove(rtype, rid)
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "patients": len(self._ordinals),
+            "tables": {name: len(t.offsets) for name, t in self._tables.items()},
+            "cached_patients": len(self._cache),
+            "max_patients": self.max_patients,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+if __name__ == "__main__":
+    # Build (or refresh) the index ahead of time: python csv_source.py <dir>
+    import time
+
+    started = time.perf_counter()
+    source = CSVSource(sys.argv[1] if len(sys.argv) > 1 else "data/csv", FHIRStore())
+    print(json.dumps({**source.stats(), "seconds": round(time.perf_counter() - started, 2)}))
@@ -1,6 +1,9 @@
 from typing import Dict, Any, List
 import time
 
+from audit import AuditLog
+from store import FHIRStore
+
 # Minimal fixture dataset for Patient 123 covering the demo scenario.
 
 TS = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
@@ -266,7 +269,7 @@ document_references: Dict[str, Dict[str, Any]] = {
     }
 }
 
-audit_events: List[Dict[str, Any]] = []
+audit_events = AuditLog.from_env()
 
 # SDOH assessments as profiled Observations
 sdoh_observations: Dict[str, Dict[str, Any]] = {
@@ -308,9 +311,33 @@ service_requests: Dict[str, Dict[str, Any]] = {
 }
 
 
+# Every fixture resource, indexed for lookups by id, patient and lastUpdated.
+# Write-backs land here too, so searches and bundles see them.
+store = FHIRStore()
+for _fixtures in (
+    patients,
+    organizations,
+    locations,
+    providers,
+    encounters,
+    care_teams,
+    care_plans,
+    medication_requests,
+    observations,
+    conditions,
+    questionnaire_responses,
+    tasks,
+    consents,
+    document_references,
+    sdoh_observations,
+    service_requests,
+):
+    store.put_many(_fixtures.values())
+
+
 def fhir_bundle_for_patient(patient_id: str) -> Dict[str, Any]:
     entries: List[Dict[str, Any]] = []
-    p = patients.get(patient_id)
+    p = store.get("Patient", patient_id)
     if p:
         entries.append({"resource": p})
     else:
@@ -329,65 +356,38 @@ def fhir_bundle_for_patient(patient_id: str) -> Dict[str, Any]:
         }
         entries.append({"resource": p})
     # include orgs and location referenced
-    enc = next((e for e in encounters.values() if e.get("subject", {}).get("reference") == f"Patient/{patient_id}"), None)
+    enc = store.first_for_patient("Encounter", patient_id)
     if enc:
         entries.append({"resource": enc})
-        loc_ref = enc.get("location", [{}])[0].get("location", {}).get("reference")
-        if loc_ref:
-            loc = locations.get(loc_ref.split("/")[-1])
-            if loc:
-                entries.append({"resource": loc})
-        sp_ref = enc.get("serviceProvider", {}).get("reference")
-        if sp_ref:
-            org = organizations.get(sp_ref.split("/")[-1])
-            if org:
-                entries.append({"resource": org})
+        loc = store.resolve(enc.get("location", [{}])[0].get("location"))
+        if loc:
+            entries.append({"resource": loc})
+        org = store.resolve(enc.get("serviceProvider"))
+        if org:
+            entries.append({"resource": org})
     # care team
-    for ct in care_teams.values():
-        if ct.get("subject", {}).get("reference") == f"Patient/{patient_id}":
-            entries.append({"resource": ct})
-            for part in ct.get("participant", []):
-                mref = part.get("member", {}).get("reference")
-                if mref and mref.startswith("Practitioner/"):
-                    prov = providers.get(mref.split("/")[-1])
-                    if prov:
-                        entries.append({"resource": prov})
-    # care plan
-    for cp in care_plans.values():
-        if cp.get("subject", {}).get("reference") == f"Patient/{patient_id}":
-            entries.append({"resource": cp})
-    # conditions
-    for cond in conditions.values():
-        if cond.get("subject", {}).get("reference") == f"Patient/{patient_id}":
-            entries.append({"resource": cond})
-    # meds
-    for mr in medication_requests.values():
-        if mr.get("subject", {}).get("reference") == f"Patient/{patient_id}":
-            entries.append({"resource": mr})
-    # observations
-    for obs in observations.values():
-        if obs.get("subject", {}).get("reference") == f"Patient/{patient_id}":
-            entries.append({"resource": obs})
-    # sdoh observations
-    for obs in sdoh_observations.values():
-        if obs.get("subject", {}).get("reference") == f"Patient/{patient_id}":
-            entries.append({"resource": obs})
-    # tasks
-    for t in tasks.values():
-        if t.get("for", {}).get("reference") == f"Patient/{patient_id}":
-            entries.append({"resource": t})
-    # questionnaire responses
-    for qr in questionnaire_responses.values():
-        if qr.get("subject", {}).get("reference") == f"Patient/{patient_id}":
-            entries.append({"resource": qr})
-    # consent
-    for c in consents.values():
-        if c.get("patient", {}).get("reference") == f"Patient/{patient_id}":
-            entries.append({"resource": c})
-    # document refs
-    for d in document_references.values():
-        if d.get("subject", {}).get("reference") == f"Patient/{patient_id}":
-            entries.append({"resource": d})
+    for ct in store.for_patient("CareTeam", patient_id):
+        entries.append({"resource": ct})
+        for part in ct.get("participant", []):
+            member = part.get("member") or {}
+            if (member.get("reference") or "").startswith("Practitioner/"):
+                prov = store.resolve(member)
+                if prov:
+                    entries.append({"resource": prov})
+    # care plans, conditions, meds, observations (incl. SDOH), tasks,
+    # questionnaire responses, consent and document refs
+    for rtype in (
+        "CarePlan",
+        "Condition",
+        "MedicationRequest",
+        "Observation",
+        "Task",
+        "QuestionnaireResponse",
+        "Consent",
+        "DocumentReference",
+    ):
+        for res in store.for_patient(rtype, patient_id):
+            entries.append({"resource": res})
     # Synthesize a discharge DocumentReference and risk Observations.
     # Special case: any patient id containing '5' is flagged with suicide risk and
     # explicitly notes no safety plan in place.
@@ -478,10 +478,9 @@ def fhir_bundle_for_patient(patient_id: str) -> Dict[str, Any]:
     entries.append({"resource": risk_obs})
     # referrals
     has_sr = False
-    for sr in service_requests.values():
-        if sr.get("subject", {}).get("reference") == f"Patient/{patient_id}":
-            entries.append({"resource": sr})
-            has_sr = True
+    for sr in store.for_patient("ServiceRequest", patient_id):
+        entries.append({"resource": sr})
+        has_sr = True
     # If no referral exists for this patient, synthesize a minimal ServiceRequest referral
     if not has_sr:
         sr_auto = {
@@ -498,10 +497,10 @@ def fhir_bundle_for_patient(patient_id: str) -> Dict[str, Any]:
         entries.append({"resource": sr_auto})
         # Include referenced Organization/Practitioner where available
         org_ref = "org-002" if str(patient_id) == "1" else "org-001"
-        org = organizations.get(org_ref)
+        org = store.get("Organization", org_ref)
         if org:
             entries.append({"resource": org})
-        prov = providers.get("prov-001")
+        prov = store.get("Practitioner", "prov-001")
         if prov:
             entries.append({"resource": prov})
 
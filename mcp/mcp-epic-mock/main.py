@@ -1,24 +1,22 @@
 #!/usr/bin/env python3
-import json
+import os
 import sys
 import time
-from typing import Any, Dict
-from fixtures import (
-    patients,
-    encounters,
-    care_teams,
-    care_plans,
-    medication_requests,
-    observations,
-    service_requests,
-    consents,
-    document_references,
-    providers,
-    organizations,
-    locations,
+from typing import Any, Dict, List, Tuple
+
+# Allow `python3 mcp/mcp-epic-mock/main.py` to import the shared libs package.
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from libs.common.ids import new_id  # noqa: E402
+from libs.common.mcp_server import publish, serve, subscribe  # noqa: E402
+from fixtures import (  # noqa: E402
     audit_events,
     fhir_bundle_for_patient,
+    store,
 )
+from csv_source import CSVSource  # noqa: E402
+from search import paginate  # noqa: E402
+from wal import WriteAheadLog  # noqa: E402
 
 # Minimal JSON-RPC 2.0 over stdio for demo purposes.
 # Methods exposed:
@@ -44,16 +42,36 @@ TOOLS = [
         "input": {"resource_type": "string", "id": "string"},
         "output": {"resource": "object"},
     },
+    {
+        "name": "epic.resource.get_many",
+        "input": {"references": "array"},
+        "output": {"resources": "object", "missing": "array"},
+    },
     {
         "name": "epic.search",
-        "input": {"resource_type": "string", "patient_id": "string"},
-        "output": {"total": "number", "entry": "array"},
+        "input": {
+            "resource_type": "string",
+            "patient_id": "string",
+            "date": "string|array",
+            "_lastUpdated": "string|array",
+            "_sort": "string",
+            "_count": "number",
+            "_page_token": "string",
+            "_include": "string|array",
+            "_revinclude": "string|array",
+        },
+        "output": {"total": "number", "entry": "array", "next": "string"},
     },
     {
         "name": "epic.fhir_write_back.create",
         "input": {"resource_type": "string", "resource_json": "object"},
         "output": {"id": "string", "status": "string"},
     },
+    {
+        "name": "epic.fhir_write_back.bundle",
+        "input": {"bundle": "fhir_bundle(transaction|batch)"},
+        "output": {"type": "fhir_bundle(transaction-response|batch-response)"},
+    },
     {
         "name": "epic.inbasket.alert",
         "input": {"patient_id": "string", "subject": "string", "body": "string", "priority": "string"},
@@ -66,25 +84,57 @@ TOOLS = [
     },
     {
         "name": "epic.audit.search",
-        "input": {"actor_ref": "string", "entity_ref": "string", "action": "string"},
-        "output": {"count": "number", "entries": "array"},
+        "input": {
+            "actor_ref": "string",
+            "entity_ref": "string",
+            "action": "string",
+            "since": "string",
+            "until": "string",
+            "limit": "number",
+            "after": "number",
+        },
+        "output": {"count": "number", "entries": "array", "cursor": "number"},
+    },
+    {
+        "name": "epic.changes.since",
+        "input": {"cursor": "number", "limit": "number", "epoch": "string"},
+        "output": {
+            "epoch": "string",
+            "changes": "array",
+            "cursor": "number",
+            "latest": "number",
+            "lost": "boolean",
+            "more": "boolean",
+        },
+    },
+    {
+        "name": "epic.changes.subscribe",
+        "input": {},
+        "output": {"subscribed": "boolean", "epoch": "string", "cursor": "number"},
     },
 ]
 
 FIXTURE_PATIENT_ID = "123"
 
+# Patients from data/csv-style files, materialised on first access.
+csv_source = CSVSource.from_env(store)
 
-def _write(obj: Dict[str, Any]):
-    sys.stdout.write(json.dumps(obj) + "\n")
-    sys.stdout.flush()
-
+# Write-backs survive restarts when EPIC_WAL_DIR is set.
+wal = WriteAheadLog.from_env()
+if wal is not None:
+    store.put_many(wal.replay())
 
-def _ok(id_, result):
-    _write({"jsonrpc": "2.0", "id": id_, "result": result})
+# Change cursors are only meaningful within one process lifetime; clients
+# seeing a new epoch must resync.
+EPOCH = new_id("epoch-")
+MAX_CHANGES_PAGE = 1000
 
+store.add_listener(
+    lambda changes: publish(
+        "changes", "epic.changes", {"epoch": EPOCH, "changes": changes, "cursor": changes[-1]["seq"]}
+    )
+)
 
-def _err(id_, code, message, data=None):
-    _write({"jsonrpc": "2.0", "id": id_, "error": {"code": code, "message": message, "data": data}})
 
 
 def list_tools():
@@ -97,7 +147,7 @@ def epic_discharge_event_get(params: Dict[str, Any]):
         "specversion": "1.0",
         "type": "epic.discharge.summary",
         "source": "mcp:epic.discharge_event",
-        "id": "evt-" + str(int(time.time() * 1000)),
+        "id": new_id("evt-"),
         "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
         "datacontenttype": "application/fhir+json",
         "subject": f"Patient/{patient_id}",
@@ -125,59 +175,59 @@ def epic_patient_bundle_get(params: Dict[str, Any]):
             }
     except Exception:
         pass
+    _ensure_patient(patient_id)
     return fhir_bundle_for_patient(patient_id)
 
 
+def _ensure_patient(patient_id: Any) -> None:
+    if csv_source is not None and patient_id:
+        csv_source.ensure(patient_id)
+
+
 def epic_resource_get(params: Dict[str, Any]):
     rtype = params.get("resource_type")
     rid = params.get("id")
-    store = {
-        "Patient": patients,
-        "Encounter": encounters,
-        "CareTeam": care_teams,
-        "CarePlan": care_plans,
-        "MedicationRequest": medication_requests,
-        "Observation": observations,
-        "ServiceRequest": service_requests,
-        "Consent": consents,
-        "DocumentReference": document_references,
-        "Practitioner": providers,
-        "Organization": organizations,
-        "Location": locations,
-        "Task": {},
-    }.get(rtype)
-    if store is None:
+    if rtype not in store.types():
         raise ValueError(f"Unsupported resource_type: {rtype}")
-    res = store.get(rid)
+    if rtype == "Patient":
+        _ensure_patient(rid)
+    res = store.get(rtype, rid)
     if not res:
         raise ValueError(f"Resource not found: {rtype}/{rid}")
     return {"resource": res}
 
 
+def epic_resource_get_many(params: Dict[str, Any]):
+    refs = params.get("references") or []
+    if not isinstance(refs, list):
+        raise ValueError("references must be a list of Type/id strings")
+    found: Dict[str, Any] = {}
+    missing = []
+    for ref in refs:
+        ref = str(ref)
+        if ref in found:
+            continue
+        rtype, _, rid = ref.partition("/")
+        if rtype == "Patient":
+            _ensure_patient(rid)
+        res = store.get(rtype, rid) if rid else None
+        if res is None:
+            if ref not in missing:
+                missing.append(ref)
+        else:
+            found[ref] = res
+    return {"resources": found, "missing": missing}
+
+
 def epic_search(params: Dict[str, Any]):
     rtype = params.get("resource_type")
     pid = params.get("patient_id") or FIXTURE_PATIENT_ID
-    entries = []
-    if rtype == "MedicationRequest":
-        src = medication_requests.values()
-    elif rtype == "Observation":
-        src = observations.values()
-    elif rtype == "ServiceRequest":
-        src = service_requests.values()
-    elif rtype == "CareTeam":
-        src = care_teams.values()
-    elif rtype == "CarePlan":
-        src = care_plans.values()
-    elif rtype == "Encounter":
-        src = encounters.values()
-    else:
+    if rtype not in store.types():
         raise ValueError(f"Unsupported search resource_type: {rtype}")
-    for res in src:
-        subj = res.get("subject", {}).get("reference") or res.get("for", {}).get("reference")
-        if subj == f"Patient/{pid}":
-            entries.append({"resource": res})
+    _ensure_patient(pid)
+    matches = store.for_patient(rtype, pid)
     # If searching ServiceRequest and none found, synthesize a minimal referral
-    if rtype == "ServiceRequest" and len(entries) == 0:
+    if rtype == "ServiceRequest" and len(matches) == 0:
         try:
             n = int(pid)
             # Only synthesize for odd-numbered (share-allowed) demo patients
@@ -193,14 +243,30 @@ def epic_search(params: Dict[str, Any]):
                     "requester": {"reference": "Practitioner/prov-001"},
                     "performer": [{"reference": "Organization/org-001"}],
                 }
-                entries.append({"resource": sr_auto})
+                matches.append(sr_auto)
         except Exception:
             pass
-    return {"total": len(entries), "entry": entries}
+    return paginate(store, matches, params)
 
 
 def epic_fhir_write_back_create(params: Dict[str, Any]):
-    rid = "res-" + str(int(time.time() * 1000))
+    rid = new_id("res-")
+    rtype = params.get("resource_type")
+    if rtype:
+        # Store the created resource so resource.get / search / bundles see it.
+        resource = dict(params.get("resource_json") or {})
+        resource["resourceType"] = rtype
+        resource["id"] = rid
+        # Durable before visible: a failed WAL commit leaves no trace in
+        # the store or the change feed.
+        store.stamp([resource])
+        if wal is not None:
+            try:
+                wal.append(resource)
+            except Exception:
+                store.release([resource])
+                raise
+        store.commit_many([resource])
     # append audit entry with specified schema
     audit_events.append({
         "audit_id": f"aud-{rid}",
@@ -214,8 +280,136 @@ def epic_fhir_write_back_create(params: Dict[str, Any]):
     return {"id": rid, "status": "created", "echo": params}
 
 
+def _resolve_internal_refs(value: Any, refs: Dict[str, str]) -> Any:
+    if isinstance(value, dict):
+        out = {k: _resolve_internal_refs(v, refs) for k, v in value.items()}
+        ref = out.get("reference")
+        if isinstance(ref, str) and ref in refs:
+            out["reference"] = refs[ref]
+        return out
+    if isinstance(value, list):
+        return [_resolve_internal_refs(v, refs) for v in value]
+    return value
+
+
+def _bundle_entry(entry: Any) -> Tuple[str, Dict[str, Any]]:
+    """(action, resource with id) for a POST/PUT entry; raises ValueError."""
+    if not isinstance(entry, dict) or not isinstance(entry.get("resource"), dict):
+        raise ValueError("entry needs a resource")
+    resource = dict(entry["resource"])
+    request = entry.get("request") or {"method": "POST"}
+    method = str(request.get("method", "POST")).upper()
+    url = str(request.get("url") or resource.get("resourceType") or "")
+    rtype, _, rid = url.partition("/")
+    if not rtype or resource.get("resourceType", rtype) != rtype:
+        raise ValueError(f"request.url {url!r} does not match resourceType")
+    resource["resourceType"] = rtype
+    if method == "POST":
+        resource["id"] = new_id("res-")
+        return "create", resource
+    if method == "PUT" and rid:
+        resource["id"] = rid
+        return "update", resource
+    raise ValueError(f"Unsupported bundle request: {method} {url}")
+
+
+def epic_fhir_write_back_bundle(params: Dict[str, Any]):
+    bundle = params.get("bundle") or {}
+    kind = bundle.get("type")
+    if bundle.get("resourceType", "Bundle") != "Bundle" or kind not in ("transaction", "batch"):
+        raise ValueError("bundle must be a Bundle of type transaction or batch")
+    entries = bundle.get("entry") or []
+
+    # Assign every id first so urn:uuid references can point at any entry.
+    prepared: List[Any] = []
+    refs: Dict[str, str] = {}
+    for entry in entries:
+        try:
+            action, resource = _bundle_entry(entry)
+        except ValueError as e:
+            if kind == "transaction":
+                raise ValueError(f"transaction rejected, entry {len(prepared)}: {e}")
+            prepared.append(e)
+            continue
+        full_url = entry.get("fullUrl")
+        if isinstance(full_url, str) and full_url.startswith("urn:uuid:"):
+            refs[full_url] = f"{resource['resourceType']}/{resource['id']}"
+        prepared.append((action, resource))
+
+    written = []
+    for item in prepared:
+        if isinstance(item, tuple):
+            action, resource = item
+            written.append((action, _resolve_internal_refs(resource, refs)))
+    # One WAL group commit and one store update for the whole bundle, in
+    # that order so nothing is readable until it is durable. A PUT racing
+    # another uncommitted write to the same id is a conflict: it fails a
+    # transaction outright and gets a 409 entry in a batch, never logged.
+    resources = [res for _, res in written]
+    conflicts = store.stamp(resources, atomic=kind == "transaction")
+    if conflicts and kind == "transaction":
+        ref = f"{conflicts[0]['resourceType']}/{conflicts[0]['id']}"
+        raise ValueError(f"transaction rejected: {ref} has a concurrent write in flight")
+    clash = {id(res) for res in conflicts}
+    resources = [res for res in resources if id(res) not in clash]
+    if wal is not None:
+        try:
+            wal.append_many(resources)
+        except Exception:
+            store.release(resources)
+            raise
+    store.commit_many(resources)
+
+    results = iter(written)
+    response_entries = []
+    for item in prepared:
+        if isinstance(item, ValueError):
+            response_entries.append({
+                "response": {
+                    "status": "400 Bad Request",
+                    "outcome": {
+                        "resourceType": "OperationOutcome",
+                        "issue": [{"severity": "error", "code": "invalid", "diagnostics": str(item)}],
+                    },
+                }
+            })
+            continue
+        action, res = next(results)
+        ref = f"{res['resourceType']}/{res['id']}"
+        if id(res) in clash:
+            response_entries.append({
+                "response": {
+                    "status": "409 Conflict",
+                    "outcome": {
+                        "resourceType": "OperationOutcome",
+                        "issue": [{"severity": "error", "code": "conflict", "diagnostics": f"{ref} has a concurrent write in flight"}],
+                    },
+                }
+            })
+            continue
+        meta = res.get("meta") or {}
+        audit_events.append({
+            "audit_id": f"aud-{res['id']}-{meta.get('versionId', '1')}",
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "actor_ref": "Agent/demo-client",
+            "action": action,
+            "entity_ref": ref,
+            "outcome": "success",
+            "source": "mcp-epic-mock",
+        })
+        response_entries.append({
+            "response": {
+                "status": "201 Created" if action == "create" else "200 OK",
+                "location": f"{ref}/_history/{meta.get('versionId', '1')}",
+                "etag": f'W/"{meta.get("versionId", "1")}"',
+                "lastModified": meta.get("lastUpdated"),
+            }
+        })
+    return {"resourceType": "Bundle", "type": f"{kind}-response", "entry": response_entries}
+
+
 def epic_inbasket_alert(params: Dict[str, Any]):
-    aid = "alert-" + str(int(time.time() * 1000))
+    aid = new_id("alert-")
     audit_events.append({
         "audit_id": f"aud-{aid}",
         "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
@@ -234,19 +428,43 @@ def auth_smart_token(params: Dict[str, Any]):
 
 
 def epic_audit_search(params: Dict[str, Any]):
-    actor_ref = params.get("actor_ref")
-    entity_ref = params.get("entity_ref")
-    action = params.get("action")
-    out = []
-    for a in audit_events:
-        if actor_ref and a.get("actor_ref") != actor_ref:
-            continue
-        if entity_ref and a.get("entity_ref") != entity_ref:
-            continue
-        if action and a.get("action") != action:
-            continue
-        out.append(a)
-    return {"count": len(out), "entries": out}
+    limit = params.get("limit")
+    after = params.get("after")
+    out = audit_events.search(
+        actor_ref=params.get("actor_ref"),
+        entity_ref=params.get("entity_ref"),
+        action=params.get("action"),
+        since=params.get("since"),
+        until=params.get("until"),
+        limit=int(limit) if limit is not None else None,
+        after=int(after) if after is not None else None,
+    )
+    cursor = out[-1]["seq"] if out else (int(after) if after is not None else -1)
+    return {"count": len(out), "entries": out, "cursor": cursor}
+
+
+def epic_changes_since(params: Dict[str, Any]):
+    cursor = int(params.get("cursor") or 0)
+    limit = max(1, min(int(params.get("limit") or 100), MAX_CHANGES_PAGE))
+    latest = store.change_seq
+    changes, lost = store.changes_since(cursor, limit)
+    if lost or params.get("epoch") not in (None, "", EPOCH):
+        # The caller's cursor is unusable: it must resync from ``latest``.
+        return {"epoch": EPOCH, "changes": [], "cursor": latest, "latest": latest, "lost": True, "more": False}
+    next_cursor = changes[-1]["seq"] if changes else max(cursor, 0)
+    return {
+        "epoch": EPOCH,
+        "changes": changes,
+        "cursor": next_cursor,
+        "latest": latest,
+        "lost": False,
+        "more": next_cursor < latest,
+    }
+
+
+def epic_changes_subscribe(params: Dict[str, Any]):
+    # Only connections that stay open (sockets, stdio) can receive pushes.
+    return {"subscribed": subscribe("changes"), "epoch": EPOCH, "cursor": store.change_seq}
 
 
 METHODS = {
@@ -254,35 +472,20 @@ METHODS = {
     "epic.discharge_event.get": epic_discharge_event_get,
     "epic.patient_bundle.get": epic_patient_bundle_get,
     "epic.resource.get": epic_resource_get,
+    "epic.resource.get_many": epic_resource_get_many,
     "epic.search": epic_search,
     "epic.fhir_write_back.create": epic_fhir_write_back_create,
+    "epic.fhir_write_back.bundle": epic_fhir_write_back_bundle,
     "epic.inbasket.alert": epic_inbasket_alert,
     "auth.smart.token": auth_smart_token,
     "epic.audit.search": epic_audit_search,
+    "epic.changes.since": epic_changes_since,
+    "epic.changes.subscribe": epic_changes_subscribe,
 }
 
 
 def main():
-    for line in sys.stdin:
-        line = line.strip()
-        if not line:
-            continue
-        try:
-            req = json.loads(line)
-        except Exception as e:
-            _write({"jsonrpc": "2.0", "id": None, "error": {"code": -32700, "message": "Parse error", "data": str(e)}})
-            continue
-        id_ = req.get("id")
-        method = req.get("method")
-        params = req.get("params", {})
-        if method not in METHODS:
-            _err(id_, -32601, f"Method not found: {method}")
-            continue
-        try:
-            result = METHODS[method](params)
-            _ok(id_, result)
-        except Exception as e:
-            _err(id_, -32000, "Server error", {"message": str(e)})
+    serve(METHODS)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,211 @@
+"""Filtering, sorting and paging for epic.search.
+
+Supported parameters on top of ``resource_type``/``patient_id``:
+
+- ``date`` / ``_lastUpdated``: a FHIR prefixed value (``ge2025-11-01``,
+  ``lt2025-12``; ``eq`` when there is no prefix) or a list of them, all of
+  which must hold. Values compare at the precision given, so
+  ``le2025-11-01`` includes the whole day.
+- ``_sort``: ``date``, ``_lastUpdated`` or ``_id``, ``-`` for descending.
+  Default is the order resources were stored.
+- ``_count``: page size. Without it every match is returned in one page.
+- ``_page_token``: the ``next`` value of the previous page.
+- ``_include`` / ``_revinclude``: ``Type:element[:TargetType]`` (or a list),
+  e.g. ``ServiceRequest:performer`` adds the performers of the matches on
+  the page and ``Observation:subject`` adds Observations whose subject is a
+  match. ``element`` is the top-level element holding the reference, ``*``
+  for any. Included resources follow the matches with
+  ``"search": {"mode": "include"}``, each at most once, and do not count
+  towards ``total``.
+
+Tokens are keyset cursors (the last sort key returned), so paging stays
+stable while new resources are written.
+"""
+
+import base64
+import hashlib
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from store import FHIRStore, Resource, references
+
+# Clinically relevant date per resource type, first present field wins.
+DATE_FIELDS = (
+    "effectiveDateTime",
+    "effectivePeriod.start",
+    "issued",
+    "authoredOn",
+    "period.start",
+    "executionPeriod.start",
+    "onsetDateTime",
+    "recordedDate",
+    "dateTime",
+    "date",
+    "created",
+)
+
+_PREFIXES: Dict[str, Callable[[str, str], bool]] = {
+    "eq": lambda a, b: a == b,
+    "ne": lambda a, b: a != b,
+    "lt": lambda a, b: a < b,
+    "le": lambda a, b: a <= b,
+    "gt": lambda a, b: a > b,
+    "ge": lambda a, b: a >= b,
+}
+
+SORT_KEYS = ("date", "_lastUpdated", "_id")
+
+
+def resource_date(res: Resource) -> str:
+    for path in DATE_FIELDS:
+        value: Any = res
+        for part in path.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        if isinstance(value, str) and value:
+            return value
+    return ""
+
+
+def _parse_filters(value: Any) -> List[Tuple[Callable[[str, str], bool], str]]:
+    if value is None:
+        return []
+    out = []
+    for item in value if isinstance(value, list) else [value]:
+        item = str(item)
+        op, rest = item[:2], item[2:]
+        if op not in _PREFIXES:
+            op, rest = "eq", item
+        if not rest:
+            raise ValueError(f"Invalid date filter: {item!r}")
+        out.append((_PREFIXES[op], rest))
+    return out
+
+
+def _matches(actual: str, filters: List[Tuple[Callable[[str, str], bool], str]]) -> bool:
+    if not filters:
+        return True
+    if not actual:
+        return False
+    return all(op(actual[: len(v)], v) for op, v in filters)
+
+
+def _query_hash(params: Dict[str, Any]) -> str:
+    query = {k: v for k, v in params.items() if k not in ("_page_token", "_count")}
+    return hashlib.sha1(json.dumps(query, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:12]
+
+
+def encode_token(key: List[Any], query_hash: str) -> str:
+    raw = json.dumps({"k": key, "q": query_hash}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_token(token: str, query_hash: str) -> List[Any]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        data = json.loads(raw)
+        key = data["k"]
+    except Exception:
+        raise ValueError("Invalid _page_token")
+    if data.get("q") != query_hash:
+        raise ValueError("_page_token does not belong to this query")
+    return key
+
+
+def _parse_includes(value: Any, name: str) -> List[Tuple[str, str, Optional[str]]]:
+    if not value:
+        return []
+    out = []
+    for item in value if isinstance(value, list) else [value]:
+        parts = str(item).split(":")
+        if len(parts) not in (2, 3) or not parts[0] or not parts[1]:
+            raise ValueError(f"Invalid {name}: {item!r}")
+        out.append((parts[0], parts[1], parts[2] if len(parts) == 3 else None))
+    return out
+
+
+def included(store: FHIRStore, matches: List[Resource], params: Dict[str, Any]) -> List[Resource]:
+    """Resources named by ``_include``/``_revinclude`` for ``matches``, de-duplicated."""
+    includes = _parse_includes(params.get("_include"), "_include")
+    revincludes = _parse_includes(params.get("_revinclude"), "_revinclude")
+    if not includes and not revincludes:
+        return []
+    seen = {(res.get("resourceType"), res.get("id")) for res in matches}
+    out: List[Resource] = []
+
+    def add(res: Optional[Resource]) -> None:
+        if res is None:
+            return
+        key = (res.get("resourceType"), res.get("id"))
+        if key not in seen:
+            seen.add(key)
+            out.append(res)
+
+    for res in matches:
+        rtype, rid = res.get("resourceType", ""), res.get("id", "")
+        for source, element, target in includes:
+            if source != rtype:
+                continue
+            for _, ttype, tid in references(res, element):
+                if target is None or ttype == target:
+                    add(store.get(ttype, tid))
+        for source, element, target in revincludes:
+            if target is not None and target != rtype:
+                continue
+            for ref in store.referrers(rtype, rid, source, element):
+                add(ref)
+    return out
+
+
+def paginate(store: FHIRStore, candidates: List[Resource], params: Dict[str, Any]) -> Dict[str, Any]:
+    """Filter, sort and page ``candidates`` according to ``params``."""
+    date_filters = _parse_filters(params.get("date"))
+    updated_filters = _parse_filters(params.get("_lastUpdated"))
+
+    def last_updated(res: Resource) -> str:
+        return store.last_updated(res.get("resourceType", ""), res.get("id", "")) or ""
+
+    matches = [
+        res
+        for res in candidates
+        if _matches(resource_date(res), date_filters) and _matches(last_updated(res), updated_filters)
+    ]
+
+    sort = params.get("_sort") or ""
+    descending = sort.startswith("-")
+    field = sort.lstrip("-")
+    if field and field not in SORT_KEYS:
+        raise ValueError(f"Unsupported _sort: {sort}")
+
+    def sort_key(res: Resource) -> List[Any]:
+        rid = res.get("id", "")
+        if field == "date":
+            return [resource_date(res), rid]
+        if field == "_lastUpdated":
+            return [last_updated(res), rid]
+        if field == "_id":
+            return [rid, rid]
+        # Synthesised (unstored) resources sort after stored ones.
+        seq = store.seq(res.get("resourceType", ""), rid)
+        return [seq if seq >= 0 else len(store), rid]
+
+    keyed = sorted(((sort_key(res), res) for res in matches), key=lambda kr: kr[0], reverse=descending)
+
+    query_hash = _query_hash(params)
+    token = params.get("_page_token")
+    if token:
+        after = decode_token(token, query_hash)
+        keyed = [kr for kr in keyed if (kr[0] < after if descending else kr[0] > after)]
+
+    count: Optional[int] = None
+    if params.get("_count") is not None:
+        count = int(params["_count"])
+        if count < 1:
+            raise ValueError("_count must be at least 1")
+    page = keyed if count is None else keyed[:count]
+
+    page_matches = [res for _, res in page]
+    out: Dict[str, Any] = {"total": len(matches), "entry": [{"resource": res} for res in page_matches]}
+    out["entry"].extend({"resource": res, "search": {"mode": "include"}} for res in included(store, page_matches, params))
+    if count is not None and len(keyed) > count:
+        out["next"] = encode_token(page[-1][0], query_hash)
+    return out
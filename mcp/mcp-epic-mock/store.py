@@ -0,0 +1,337 @@
+"""Indexed in-memory FHIR resource store for the Epic mock.
+
+Resources are indexed by type and id, by type and patient, and by
+``meta.lastUpdated``, so searches are lookups instead of scans over every
+fixture. The patient of a resource comes from the first of ``subject``,
+``for``, ``patient`` or ``beneficiary`` that references a Patient (a Patient
+is its own patient).
+
+Every ``{"reference": "Type/id"}`` inside a resource is also indexed in
+reverse under the top-level element it sits in (``subject``, ``performer``,
+``location`` for ``Encounter.location[].location``...), which is what
+``_include``/``_revinclude`` name after the colon.
+
+Server-side writes (``put(..., stamp=True)``, or :meth:`stamp` then
+:meth:`commit_many` when the write must be logged before it is visible) are
+also appended to a bounded change log with a monotonic sequence number, read
+with :meth:`changes_since` and pushed to any :meth:`add_listener` callbacks.
+Fixture, CSV and WAL loads are not changes.
+"""
+
+import bisect
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+Resource = Dict[str, Any]
+Change = Dict[str, Any]
+
+PATIENT_REFERENCE_FIELDS = ("subject", "for", "patient", "beneficiary")
+
+
+def now_iso() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def patient_of(resource: Resource) -> Optional[str]:
+    if resource.get("resourceType") == "Patient":
+        return resource.get("id")
+    for field in PATIENT_REFERENCE_FIELDS:
+        ref = resource.get(field)
+        if isinstance(ref, dict):
+            value = ref.get("reference") or ""
+            if value.startswith("Patient/"):
+                return value[len("Patient/"):]
+    return None
+
+
+def _walk_references(value: Any) -> Iterator[Tuple[str, str]]:
+    if isinstance(value, dict):
+        ref = value.get("reference")
+        if isinstance(ref, str):
+            rtype, _, rid = ref.partition("/")
+            if rid and "/" not in rid:
+                yield rtype, rid
+        for v in value.values():
+            if isinstance(v, (dict, list)):
+                yield from _walk_references(v)
+    elif isinstance(value, list):
+        for v in value:
+            yield from _walk_references(v)
+
+
+def references(resource: Resource, element: Optional[str] = None) -> List[Tuple[str, str, str]]:
+    """(element, type, id) for each relative reference in ``resource``.
+
+    ``element`` limits the walk to one top-level element; ``"*"`` or None
+    walks them all.
+    """
+    out = []
+    for name, value in resource.items():
+        if name in ("resourceType", "id", "meta") or (element not in (None, "*") and name != element):
+            continue
+        for rtype, rid in _walk_references(value):
+            out.append((name, rtype, rid))
+    return out
+
+
+def _version(resource: Optional[Resource]) -> int:
+    try:
+        return int(((resource or {}).get("meta") or {}).get("versionId", "0"))
+    except ValueError:
+        return 0
+
+
+class FHIRStore:
+    """Thread-safe store with secondary indexes kept in step on every put."""
+
+    def __init__(self, max_changes: int = 100_000) -> None:
+        self._lock = threading.RLock()
+        self._by_id: Dict[str, Dict[str, Resource]] = {}
+        # type -> patient id -> resource id -> resource; dicts keep insertion
+        # order so results come back in the order resources were added.
+        self._by_patient: Dict[str, Dict[str, Dict[str, Resource]]] = {}
+        # (lastUpdated, type, id), kept sorted for range queries.
+        self._updated: List[Tuple[str, str, str]] = []
+        self._updated_at: Dict[Tuple[str, str], str] = {}
+        self._patient: Dict[Tuple[str, str], Optional[str]] = {}
+        # Insertion sequence per resource; the stable default sort order.
+        self._seq: Dict[Tuple[str, str], int] = {}
+        # Never reused, so a resource re-added after remove() sorts last.
+        self._next_seq = 0
+        # target (type, id) -> {(source type, source id, element)}
+        self._referrers: Dict[Tuple[str, str], Set[Tuple[str, str, str]]] = {}
+        self._refs_from: Dict[Tuple[str, str], List[Tuple[str, str, str]]] = {}
+        self._changes: Deque[Change] = deque(maxlen=max_changes)
+        self._change_seq = 0
+        self._listeners: List[Callable[[List[Change]], None]] = []
+        # Highest version stamped per written resource, committed or not.
+        self._issued: Dict[Tuple[str, str], int] = {}
+        # Ids stamped but not yet committed or released: one write each.
+        self._inflight: Set[Tuple[str, str]] = set()
+
+    def __len__(self) -> int:
+        return len(self._updated_at)
+
+    def types(self) -> List[str]:
+        with self._lock:
+            return list(self._by_id)
+
+    def put(self, resource: Resource, stamp: bool = False) -> Resource:
+        """Insert or replace ``resource`` (which must have resourceType and id).
+
+        With ``stamp=True`` the resource's ``meta.versionId``/``lastUpdated``
+        are set as a server would on create/update and the write is recorded
+        as a change; fixtures are indexed as-is.
+        """
+        self.put_many([resource], stamp=stamp)
+        return resource
+
+    def stamp(self, resources: Iterable[Resource], atomic: bool = True) -> List[Resource]:
+        """Set ``meta.versionId``/``lastUpdated`` without storing the resources.
+
+        Used to log a write before :meth:`commit_many` makes it visible. Each
+        stamped id stays claimed until it is committed or :meth:`release`-d,
+        and a resource whose id already has a write in flight is a conflict:
+        it is left unstamped and returned, so it can be rejected before it is
+        logged rather than skipped as stale after. With ``atomic`` any
+        conflict leaves every resource unstamped.
+        """
+        resources = list(resources)
+        with self._lock:
+            keys = []
+            for resource in resources:
+                rtype, rid = resource.get("resourceType"), resource.get("id")
+                if not rtype or not rid:
+                    raise ValueError("resource needs resourceType and id")
+                keys.append((rtype, rid))
+            conflicts = [res for res, key in zip(resources, keys) if key in self._inflight]
+            if conflicts and atomic:
+                return conflicts
+            for resource, key in zip(resources, keys):
+                if key in self._inflight:
+                    continue
+                version = max(self._issued.get(key, 0), _version(self._by_id.get(key[0], {}).get(key[1]))) + 1
+                self._issued[key] = version
+                self._inflight.add(key)
+                resource["meta"] = {**(resource.get("meta") or {}), "versionId": str(version), "lastUpdated": now_iso()}
+            return conflicts
+
+    def release(self, resources: Iterable[Resource]) -> None:
+        """Drop the claim :meth:`stamp` took for writes that won't be committed."""
+        with self._lock:
+            for resource in resources:
+                self._inflight.discard((resource["resourceType"], resource["id"]))
+
+    def commit_many(self, resources: Iterable[Resource]) -> None:
+        """Store :meth:`stamp`-ed resources and record them as changes.
+
+        A resource older than the version already stored is skipped; with
+        every writer going through :meth:`stamp` that can't happen.
+        """
+        resources = list(resources)
+        with self._lock:
+            fresh = []
+            for resource in resources:
+                self._inflight.discard((resource["resourceType"], resource["id"]))
+                current = self._by_id.get(resource["resourceType"], {}).get(resource["id"])
+                if current is not None and _version(current) > _version(resource):
+                    continue
+                self._put(resource)
+                fresh.append(resource)
+            changes = self._record(fresh)
+        self._notify(changes)
+
+    def _put(self, resource: Resource) -> None:
+        rtype = resource.get("resourceType")
+        rid = resource.get("id")
+        if not rtype or not rid:
+            raise ValueError("resource needs resourceType and id")
+        key = (rtype, rid)
+        with self._lock:
+            if rid in self._by_id.get(rtype, {}):
+                self._unindex(key)
+            updated = (resource.get("meta") or {}).get("lastUpdated") or now_iso()
+            pid = patient_of(resource)
+            self._by_id.setdefault(rtype, {})[rid] = resource
+            if pid is not None:
+                self._by_patient.setdefault(rtype, {}).setdefault(pid, {})[rid] = resource
+            self._patient[key] = pid
+            if key not in self._seq:
+                self._seq[key] = self._next_seq
+                self._next_seq += 1
+            refs = references(resource)
+            self._refs_from[key] = refs
+            for element, ttype, tid in refs:
+                self._referrers.setdefault((ttype, tid), set()).add((rtype, rid, element))
+            self._updated_at[key] = updated
+            bisect.insort(self._updated, (updated, rtype, rid))
+
+    def put_many(self, resources: Iterable[Resource], stamp: bool = False) -> None:
+        resources = list(resources)
+        if stamp:
+            conflicts = self.stamp(resources)
+            if conflicts:
+                ref = f"{conflicts[0]['resourceType']}/{conflicts[0]['id']}"
+                raise ValueError(f"{ref} has another write in flight")
+            self.commit_many(resources)
+            return
+        with self._lock:
+            for resource in resources:
+                self._put(resource)
+
+    def _record(self, resources: Iterable[Resource]) -> List[Change]:
+        changes = []
+        for resource in resources:
+            self._change_seq += 1
+            meta = resource.get("meta") or {}
+            change = {
+                "seq": self._change_seq,
+                "resource_type": resource["resourceType"],
+                "id": resource["id"],
+                "patient_id": patient_of(resource),
+                "version": meta.get("versionId"),
+                "last_updated": meta.get("lastUpdated"),
+            }
+            self._changes.append(change)
+            changes.append(change)
+        return changes
+
+    def _notify(self, changes: List[Change]) -> None:
+        if not changes:
+            return
+        for listener in list(self._listeners):
+            try:
+                listener(changes)
+            except Exception:
+                pass
+
+    def add_listener(self, listener: Callable[[List[Change]], None]) -> None:
+        """Call ``listener(changes)`` after every recorded write (outside the lock)."""
+        self._listeners.append(listener)
+
+    @property
+    def change_seq(self) -> int:
+        return self._change_seq
+
+    def changes_since(self, cursor: int, limit: int = 100) -> Tuple[List[Change], bool]:
+        """Changes with ``seq > cursor``, oldest first, and whether any were lost.
+
+        ``lost`` is True when ``cursor`` is older than the oldest retained change
+        (or ahead of the log, e.g. after a restart): the caller must resync.
+        """
+        with self._lock:
+            oldest = self._changes[0]["seq"] if self._changes else self._change_seq + 1
+            lost = cursor > self._change_seq or (cursor + 1 < oldest and cursor < self._change_seq)
+            start = max(0, cursor + 1 - oldest)
+            out = [self._changes[i] for i in range(start, min(len(self._changes), start + limit))]
+        return out, lost
+
+    def _unindex(self, key: Tuple[str, str]) -> None:
+        rtype, rid = key
+        pid = self._patient.pop(key, None)
+        if pid is not None:
+            self._by_patient.get(rtype, {}).get(pid, {}).pop(rid, None)
+        for element, ttype, tid in self._refs_from.pop(key, []):
+            self._referrers.get((ttype, tid), set()).discard((rtype, rid, element))
+        updated = self._updated_at.pop(key, None)
+        if updated is not None:
+            i = bisect.bisect_left(self._updated, (updated, rtype, rid))
+            if i < len(self._updated) and self._updated[i] == (updated, rtype, rid):
+                del self._updated[i]
+
+    def remove(self, rtype: str, rid: str) -> Optional[Resource]:
+        """Drop a resource and its index entries; returns it if it was stored."""
+        key = (rtype, rid)
+        with self._lock:
+            resource = self._by_id.get(rtype, {}).pop(rid, None)
+            if resource is not None:
+                self._unindex(key)
+                self._seq.pop(key, None)
+            return resource
+
+    def get(self, rtype: str, rid: str) -> Optional[Resource]:
+        return self._by_id.get(rtype, {}).get(rid)
+
+    def resolve(self, ref: Any) -> Optional[Resource]:
+        """Look up a ``{"reference": "Type/id"}`` (or ``"Type/id"``)."""
+        value = ref.get("reference") if isinstance(ref, dict) else ref
+        rtype, _, rid = (value or "").partition("/")
+        return self.get(rtype, rid) if rid else None
+
+    def referrers(self, rtype: str, rid: str, source_type: str, element: str) -> List[Resource]:
+        """Resources of ``source_type`` referencing ``rtype/rid`` from ``element``."""
+        with self._lock:
+            keys = [
+                (st, sid)
+                for st, sid, el in self._referrers.get((rtype, rid), ())
+                if st == source_type and (element == "*" or el == element)
+            ]
+            found = [self._by_id[st][sid] for st, sid in keys]
+        return sorted(found, key=lambda r: self._seq.get((r["resourceType"], r["id"]), -1))
+
+    def for_patient(self, rtype: str, patient_id: str) -> List[Resource]:
+        with self._lock:
+            return list(self._by_patient.get(rtype, {}).get(patient_id, {}).values())
+
+    def first_for_patient(self, rtype: str, patient_id: str) -> Optional[Resource]:
+        with self._lock:
+            return next(iter(self._by_patient.get(rtype, {}).get(patient_id, {}).values()), None)
+
+    def updated_between(
+        self, since: Optional[str] = None, until: Optional[str] = None, rtype: Optional[str] = None
+    ) -> List[Resource]:
+        """Resources with ``since <= lastUpdated < until``, oldest first."""
+        with self._lock:
+            lo = bisect.bisect_left(self._updated, (since,)) if since else 0
+            hi = bisect.bisect_left(self._updated, (until,)) if until else len(self._updated)
+            keys = self._updated[lo:hi]
+            return [self._by_id[t][i] for _, t, i in keys if rtype is None or t == rtype]
+
+    def last_updated(self, rtype: str, rid: str) -> Optional[str]:
+        return self._updated_at.get((rtype, rid))
+
+    def seq(self, rtype: str, rid: str) -> int:
+        """Insertion order of a stored resource; -1 for unknown ones."""
+        return self._seq.get((rtype, rid), -1)
@@ -0,0 +1,356 @@
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+sys.path.insert(0, ROOT)
+
+from libs.common.mcp_client import load_inproc_methods  # noqa: E402
+
+METHODS = load_inproc_methods("inproc:mcp-epic-mock")
+
+
+def call(method, **params):
+    return METHODS[method](params)
+
+
+def test_write_back_is_indexed_for_get_and_search():
+    task = {"status": "requested", "intent": "order", "for": {"reference": "Patient/idx-1"}}
+    created = call("epic.fhir_write_back.create", resource_type="Task", resource_json=task)
+
+    stored = call("epic.resource.get", resource_type="Task", id=created["id"])["resource"]
+    assert stored["for"] == {"reference": "Patient/idx-1"}
+    assert stored["meta"]["versionId"] == "1"
+
+    found = call("epic.search", resource_type="Task", patient_id="idx-1")
+    assert [e["resource"]["id"] for e in found["entry"]] == [created["id"]]
+    assert call("epic.search", resource_type="Task", patient_id="idx-2")["total"] == 0
+
+
+def test_search_pages_with_sort_and_date_range():
+    from fixtures import store
+
+    for day in range(1, 8):
+        store.put({
+            "resourceType": "Observation",
+            "id": f"page-obs-{day}",
+            "subject": {"reference": "Patient/page-1"},
+            "effectiveDateTime": f"2025-11-0{day}T09:00:00Z",
+        })
+    query = {"resource_type": "Observation", "patient_id": "page-1", "date": ["ge2025-11-02", "le2025-11-06"], "_sort": "-date"}
+
+    first = call("epic.search", _count=3, **query)
+    assert first["total"] == 5
+    assert [e["resource"]["id"] for e in first["entry"]] == ["page-obs-6", "page-obs-5", "page-obs-4"]
+    second = call("epic.search", _count=3, _page_token=first["next"], **query)
+    assert [e["resource"]["id"] for e in second["entry"]] == ["page-obs-3", "page-obs-2"]
+    assert "next" not in second
+
+    try:
+        call("epic.search", resource_type="Observation", patient_id="page-2", _page_token=first["next"])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("token from another query was accepted")
+
+
+def test_search_include_and_revinclude_are_deduplicated():
+    out = call(
+        "epic.search",
+        resource_type="ServiceRequest",
+        patient_id="123",
+        _include=["ServiceRequest:performer", "ServiceRequest:requester", "ServiceRequest:*:Organization"],
+    )
+    matches = [e for e in out["entry"] if "search" not in e]
+    extra = [(e["resource"]["resourceType"], e["resource"]["id"]) for e in out["entry"] if "search" in e]
+    assert out["total"] == len(matches) == 1
+    assert extra == [("Organization", "org-001"), ("Practitioner", "prov-001")]
+
+    rev = call("epic.search", resource_type="Patient", patient_id="123", _revinclude="CareTeam:subject")
+    assert [e["resource"]["resourceType"] for e in rev["entry"]] == ["Patient", "CareTeam"]
+
+
+def test_audit_log_is_bounded_indexed_and_replayed(tmp_path):
+    from audit import AuditLog
+
+    log = AuditLog(max_entries=3, directory=str(tmp_path), segment_bytes=200)
+    for i in range(5):
+        log.append({"timestamp": f"2025-11-0{i + 1}T00:00:00Z", "actor_ref": "Agent/a", "action": "create" if i % 2 else "alert", "entity_ref": f"Task/{i}"})
+    log.close()
+
+    assert len(log) == 3
+    assert [e["entity_ref"] for e in log.search(actor_ref="Agent/a")] == ["Task/2", "Task/3", "Task/4"]
+    assert [e["entity_ref"] for e in log.search(action="alert", limit=1)] == ["Task/4"]
+    assert [e["entity_ref"] for e in log.search(since="2025-11-04", until="2025-11-05")] == ["Task/3"]
+    assert log.search(entity_ref="Task/0") == []
+    assert len(os.listdir(tmp_path)) > 1
+
+    reopened = AuditLog(max_entries=3, directory=str(tmp_path))
+    assert [e["entity_ref"] for e in reopened.search()] == ["Task/2", "Task/3", "Task/4"]
+    # Sequence numbers survive the restart, so cursors stay valid.
+    assert [e["seq"] for e in reopened.search(after=2, limit=1)] == [3]
+    reopened.close()
+
+
+def test_audit_cursor_pages_past_out_of_order_timestamps(tmp_path):
+    from audit import AuditLog
+
+    log = AuditLog(directory=str(tmp_path), segment_bytes=1, max_segments=2)
+    for i, day in enumerate(("03", "01", "04", "02")):
+        log.append({"timestamp": f"2025-11-{day}T00:00:00Z", "action": "create", "entity_ref": f"Task/{i}"})
+    # An older timestamp in the middle doesn't hide earlier matches.
+    assert [e["entity_ref"] for e in log.search(since="2025-11-03")] == ["Task/0", "Task/2"]
+
+    first = log.search(action="create", after=-1, limit=3)
+    assert [e["entity_ref"] for e in first] == ["Task/0", "Task/1", "Task/2"]
+    assert [e["entity_ref"] for e in log.search(action="create", after=first[-1]["seq"], limit=3)] == ["Task/3"]
+    log.close()
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_wal_group_commits_and_replays_snapshot_plus_tail(tmp_path):
+    import threading
+
+    from wal import WriteAheadLog
+
+    wal = WriteAheadLog(str(tmp_path), group_commit_ms=20, snapshot_every=0)
+    threads = [
+        threading.Thread(target=wal.append, args=({"resourceType": "Task", "id": f"t{i}", "status": "requested"},))
+        for i in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert wal.records == 8 and wal.commits < 8
+
+    wal.checkpoint()
+    wal.append({"resourceType": "Task", "id": "t0", "status": "completed"})
+    wal.close()
+    with open(tmp_path / "wal.jsonl", "a") as fh:
+        fh.write('{"lsn": 99, "resou')
+
+    replayed = WriteAheadLog(str(tmp_path)).replay()
+    assert len(replayed) == 8
+    assert replayed[-1] == {"resourceType": "Task", "id": "t0", "status": "completed"}
+
+
+def test_failed_wal_commit_leaves_write_invisible(tmp_path, monkeypatch):
+    from fixtures import store
+    from wal import WriteAheadLog
+
+    wal = WriteAheadLog(str(tmp_path), group_commit_ms=0, snapshot_every=0)
+
+    def broken_write(batch):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(wal, "_write", broken_write)
+    create = METHODS["epic.fhir_write_back.create"]
+    monkeypatch.setitem(create.__globals__, "wal", wal)
+    seq = store.change_seq
+    task = {"status": "requested", "for": {"reference": "Patient/wal-fail-1"}}
+    try:
+        call("epic.fhir_write_back.create", resource_type="Task", resource_json=task)
+    except RuntimeError:
+        pass
+    else:  # pragma: no cover
+        raise AssertionError("WAL failure was not surfaced")
+    assert call("epic.search", resource_type="Task", patient_id="wal-fail-1")["total"] == 0
+    assert store.change_seq == seq
+    assert wal.stats()["resources"] == 0
+
+
+def test_csv_source_materialises_patients_lazily_with_lru_bound(tmp_path):
+    from csv_source import INDEX_FILE, CSVSource
+    from store import FHIRStore
+
+    (tmp_path / "patient.csv").write_text("patient_id,mrn,ihi,given_name,family_name\n7,MRN-7,,Ada,Lee\n8,MRN-8,,Bo,Ng\n")
+    (tmp_path / "observation.csv").write_text(
+        "observation_id,patient_id,encounter_id,code,code_system,value_string,value_numeric,unit,effective_ts,performer_id\n"
+        "1,8,,PHQ9-TOTAL,SNOMED-AU,,4,score,2025-10-01 09:00:00.1,\n"
+        "2,7,,PHQ9-TOTAL,SNOMED-AU,,12,score,2025-10-02 09:00:00.1,\n"
+    )
+    store = FHIRStore()
+    source = CSVSource(str(tmp_path), store, max_patients=1)
+    assert len(store) == 0 and (tmp_path / INDEX_FILE).exists()
+
+    assert source.ensure("7")
+    obs = store.for_patient("Observation", "7")
+    assert [o["valueQuantity"]["value"] for o in obs] == [12.0]
+    assert obs[0]["effectiveDateTime"] == "2025-10-02T09:00:00Z"
+
+    assert source.ensure("8") and store.get("Patient", "7") is None
+    assert not source.ensure("9")
+
+    # A written-back Patient survives eviction and still gets its rows back.
+    source.ensure("7")
+    store.put({**store.get("Patient", "7"), "active": False})
+    source.ensure("8")
+    assert store.get("Patient", "7")["active"] is False
+    assert store.for_patient("Observation", "7") == []
+    assert source.ensure("7") and store.get("Patient", "7")["active"] is False
+    assert [o["id"] for o in store.for_patient("Observation", "7")] == ["2"]
+
+    # Fixture patients present before the source was built are left alone.
+    fixtures = FHIRStore()
+    fixtures.put({"resourceType": "Patient", "id": "8"})
+    assert not CSVSource(str(tmp_path), fixtures).ensure("8")
+    assert fixtures.for_patient("Observation", "8") == []
+
+    # A second boot reuses the cached index without rescanning.
+    scan = CSVSource._scan
+    CSVSource._scan = None
+    try:
+        reused = CSVSource(str(tmp_path), FHIRStore())
+    finally:
+        CSVSource._scan = scan
+    assert reused.stats()["patients"] == 2 and reused.ensure("7")
+
+    # A tampered index fails validation and is rebuilt from the CSVs.
+    index = tmp_path / INDEX_FILE
+    raw = index.read_bytes()
+    index.write_bytes(raw[:-8] + (10 ** 9).to_bytes(8, "little"))
+    rebuilt = CSVSource(str(tmp_path), FHIRStore())
+    assert rebuilt.ensure("8") and index.read_bytes() == raw
+
+
+def test_store_never_reuses_insertion_order_after_remove():
+    from store import FHIRStore
+
+    store = FHIRStore()
+    for rid in ("a", "b"):
+        store.put({"resourceType": "Basic", "id": rid})
+    store.remove("Basic", "a")
+    for rid in ("c", "a"):
+        store.put({"resourceType": "Basic", "id": rid})
+    assert [store.seq("Basic", rid) for rid in ("b", "c", "a")] == [1, 2, 3]
+
+
+def test_get_many_returns_found_resources_and_misses():
+    out = call("epic.resource.get_many", references=["Practitioner/prov-001", "Organization/org-001", "Location/nope", "bogus", "Practitioner/prov-001"])
+    assert sorted(out["resources"]) == ["Organization/org-001", "Practitioner/prov-001"]
+    assert out["resources"]["Practitioner/prov-001"]["id"] == "prov-001"
+    assert out["missing"] == ["Location/nope", "bogus"]
+
+
+def test_transaction_bundle_resolves_urn_refs_and_batch_isolates_failures():
+    bundle = {
+        "resourceType": "Bundle",
+        "type": "transaction",
+        "entry": [
+            {"fullUrl": "urn:uuid:a", "resource": {"resourceType": "CarePlan", "subject": {"reference": "Patient/tx-1"}}, "request": {"method": "POST", "url": "CarePlan"}},
+            {"resource": {"resourceType": "Task", "for": {"reference": "Patient/tx-1"}, "focus": {"reference": "urn:uuid:a"}}, "request": {"method": "POST", "url": "Task"}},
+        ],
+    }
+    out = call("epic.fhir_write_back.bundle", bundle=bundle)
+    assert out["type"] == "transaction-response"
+    plan_ref, task_ref = (e["response"]["location"].rsplit("/_history", 1)[0] for e in out["entry"])
+    task = call("epic.resource.get", resource_type="Task", id=task_ref.split("/")[1])["resource"]
+    assert task["focus"] == {"reference": plan_ref}
+
+    bad = {"resource": {"resourceType": "Task"}, "request": {"method": "DELETE", "url": "Task/x"}}
+    try:
+        call("epic.fhir_write_back.bundle", bundle={**bundle, "entry": bundle["entry"] + [bad]})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("invalid transaction was applied")
+    assert call("epic.search", resource_type="Task", patient_id="tx-1")["total"] == 1
+
+    batch = call("epic.fhir_write_back.bundle", bundle={**bundle, "type": "batch", "entry": [bad] + bundle["entry"][1:]})
+    assert [e["response"]["status"] for e in batch["entry"]] == ["400 Bad Request", "201 Created"]
+
+
+def test_put_racing_an_uncommitted_write_is_a_conflict():
+    from fixtures import store
+
+    task = call("epic.fhir_write_back.create", resource_type="Task", resource_json={"for": {"reference": "Patient/race-1"}})
+    rid = task["id"]
+    in_flight = {"resourceType": "Task", "id": rid, "status": "cancelled", "for": {"reference": "Patient/race-1"}}
+    assert store.stamp([in_flight]) == []
+
+    put = {"resource": {"resourceType": "Task", "status": "completed", "for": {"reference": "Patient/race-1"}}, "request": {"method": "PUT", "url": f"Task/{rid}"}}
+    post = {"resource": {"resourceType": "Task", "for": {"reference": "Patient/race-1"}}, "request": {"method": "POST", "url": "Task"}}
+    batch = call("epic.fhir_write_back.bundle", bundle={"resourceType": "Bundle", "type": "batch", "entry": [put, post]})
+    assert [e["response"]["status"] for e in batch["entry"]] == ["409 Conflict", "201 Created"]
+    try:
+        call("epic.fhir_write_back.bundle", bundle={"resourceType": "Bundle", "type": "transaction", "entry": [post, put]})
+    except ValueError:
+        pass
+    else:  # pragma: no cover
+        raise AssertionError("conflicting transaction was applied")
+    assert call("epic.search", resource_type="Task", patient_id="race-1")["total"] == 2
+
+    store.commit_many([in_flight])
+    again = call("epic.fhir_write_back.bundle", bundle={"resourceType": "Bundle", "type": "batch", "entry": [put]})
+    assert again["entry"][0]["response"]["status"] == "200 OK"
+    assert call("epic.resource.get", resource_type="Task", id=rid)["resource"]["meta"]["versionId"] == "3"
+
+
+def test_context_cache_patches_bundle_from_change_feed():
+    import asyncio
+
+    from libs.agentis.context_cache import PatientContextCache
+
+    class Epic:
+        batches = []
+
+        async def call_batch(self, calls, timeout=None):
+            self.batches.append([m for m, _ in calls])
+            return [call(m, **p) for m, p in calls]
+
+    epic, cache = Epic(), PatientContextCache()
+    calls = [
+        ("epic.patient_bundle.get", {"patient_id": "123"}),
+        ("epic.search", {"resource_type": "Task", "patient_id": "123"}),
+    ]
+    asyncio.run(cache.fetch(epic, "123", calls))
+    bundle, tasks = asyncio.run(cache.fetch(epic, "123", calls))
+    assert epic.batches[-1] == ["epic.changes.since"]
+
+    task = {"status": "requested", "intent": "order", "for": {"reference": "Patient/123"}}
+    created = call("epic.fhir_write_back.create", resource_type="Task", resource_json=task)
+    bundle2, tasks2 = asyncio.run(cache.fetch(epic, "123", calls))
+    # The poll finds the write; the stale search is refetched and the
+    # bundle patched with the one changed resource.
+    assert epic.batches[-1] == ["epic.search", "epic.resource.get_many", "epic.changes.since"]
+    assert tasks2["total"] == tasks["total"] + 1
+    ids = [e["resource"]["id"] for e in bundle2["entry"] if e["resource"]["resourceType"] == "Task"]
+    assert created["id"] in ids and len(bundle2["entry"]) == len(bundle["entry"]) + 1
+    assert created["id"] not in [e["resource"]["id"] for e in bundle["entry"]]
+
+    lost = call("epic.changes.since", cursor=0, epoch="epoch-other")
+    assert lost["lost"] is True and lost["cursor"] == lost["latest"]
+
+
+def test_context_cache_keeps_results_when_a_shared_write_lands_mid_fetch():
+    import asyncio
+
+    from libs.agentis.context_cache import PatientContextCache
+    from libs.common.mcp_client import MCPError
+
+    class Epic:
+        batches = 0
+
+        async def call_batch(self, calls, timeout=None):
+            self.batches += 1
+            if self.batches == 3:
+                # A shared resource changes between the two passes of a fetch.
+                org = {"resourceType": "Organization", "id": "org-mid-fetch", "name": "Mid"}
+                call("epic.fhir_write_back.bundle", bundle={
+                    "resourceType": "Bundle", "type": "batch",
+                    "entry": [{"resource": org, "request": {"method": "PUT", "url": "Organization/org-mid-fetch"}}],
+                })
+            return [call(m, **p) for m, p in calls]
+
+    epic, cache = Epic(), PatientContextCache()
+    calls = [
+        ("epic.patient_bundle.get", {"patient_id": "123"}),
+        ("epic.search", {"resource_type": "Task", "patient_id": "123"}),
+    ]
+    asyncio.run(cache.fetch(epic, "123", calls))
+    task = {"status": "requested", "intent": "order", "for": {"reference": "Patient/123"}}
+    call("epic.fhir_write_back.create", resource_type="Task", resource_json=task)
+    bundle, tasks = asyncio.run(cache.fetch(epic, "123", calls))
+    assert epic.batches == 3 and cache.resets >= 1
+    assert not isinstance(bundle, MCPError) and not isinstance(tasks, MCPError)
+    assert bundle["entry"] and tasks["total"] >= 1
@@ -0,0 +1,260 @@
+"""Write-ahead log with group commit for Epic mock write-backs.
+
+Each write is one JSON line ``{"lsn": n, "resource": {...}}`` in
+``<directory>/wal.jsonl``. A writer returns only once its line is fsynced,
+but concurrent writers share fsyncs: the first writer to find no flush in
+progress becomes the leader, waits ``group_commit_ms`` for others to queue,
+then writes and fsyncs the whole batch and wakes everyone it covered.
+
+Callers log a write before making it visible (see ``FHIRStore.stamp`` /
+``commit_many``), so an acknowledged write is a durable one. If a batch
+fails to write, its partial bytes are truncated away and every writer in it
+gets the error.
+
+Every ``snapshot_every`` records the current state (the latest version of
+each logged resource) is written to ``snapshot.json`` (tmp file, fsync,
+rename) and the log is truncated. :meth:`replay` returns the snapshot plus
+the log tail past it; a torn last line from a crash is ignored.
+
+The state behind snapshots is every resource ever written back, never
+pruned. It holds the same dicts the FHIRStore indexes, so it costs little
+extra memory, but each checkpoint rewrites all of it: with many write-backs
+raise ``snapshot_every`` so checkpoints stay rare relative to their size.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+Resource = Dict[str, Any]
+
+WAL_FILE = "wal.jsonl"
+SNAPSHOT_FILE = "snapshot.json"
+
+
+def _version(resource: Optional[Resource]) -> int:
+    try:
+        return int(((resource or {}).get("meta") or {}).get("versionId", "0"))
+    except ValueError:
+        return 0
+
+
+class WriteAheadLog:
+    def __init__(
+        self, directory: str, fsync: bool = True, group_commit_ms: float = 2.0, snapshot_every: int = 1000
+    ):
+        self.directory = directory
+        self.fsync = fsync
+        self.group_commit_s = max(0.0, group_commit_ms) / 1000.0
+        self.snapshot_every = snapshot_every
+        os.makedirs(directory, exist_ok=True)
+        self._cond = threading.Condition()
+        self._pending: List[Tuple[int, str, Resource]] = []
+        # LSN -> error for records whose batch failed, until their writer sees it.
+        self._failed: Dict[int, BaseException] = {}
+        self._flushing = False
+        self._next_lsn = 1
+        self._durable_lsn = 0
+        self._since_snapshot = 0
+        self._state: Dict[Tuple[str, str], Resource] = {}
+        self._file = None
+        self.commits = 0
+        self.records = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["WriteAheadLog"]:
+        directory = os.getenv("EPIC_WAL_DIR")
+        if not directory:
+            return None
+        return cls(
+            directory,
+            fsync=os.getenv("EPIC_WAL_FSYNC", "true").lower() in ("1", "true", "yes"),
+            group_commit_ms=float(os.getenv("EPIC_WAL_GROUP_COMMIT_MS", "2")),
+            snapshot_every=int(os.getenv("EPIC_WAL_SNAPSHOT_EVERY", "1000")),
+        )
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def replay(self) -> List[Resource]:
+        """Load the snapshot and log tail; returns resources in write order."""
+        snapshot_lsn = 0
+        order: Dict[Tuple[str, str], Resource] = {}
+        try:
+            with open(self._path(SNAPSHOT_FILE), "r", encoding="utf-8") as fh:
+                snap = json.load(fh)
+            snapshot_lsn = int(snap.get("lsn", 0))
+            for res in snap.get("resources", []):
+                order[(res["resourceType"], res["id"])] = res
+        except FileNotFoundError:
+            pass
+        last_lsn = snapshot_lsn
+        torn = False
+        try:
+            with open(self._path(WAL_FILE), "r", encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        torn = True
+                        break
+                    if record["lsn"] <= snapshot_lsn:
+                        continue
+                    res = record["resource"]
+                    key = (res["resourceType"], res["id"])
+                    # Concurrent writes to one id may be logged out of
+                    # version order; the newest version wins.
+                    if _version(res) >= _version(order.get(key)):
+                        order.pop(key, None)
+                        order[key] = res
+                    last_lsn = record["lsn"]
+                    self._since_snapshot += 1
+        except FileNotFoundError:
+            pass
+        with self._cond:
+            self._state = dict(order)
+            self._next_lsn = last_lsn + 1
+            self._durable_lsn = last_lsn
+            # Fold the tail into a fresh snapshot so new appends never
+            # follow a torn line.
+            if self._since_snapshot or torn:
+                self._checkpoint_locked()
+        return list(order.values())
+
+    def append(self, resource: Resource) -> int:
+        return self.append_many([resource])
+
+    def append_many(self, resources: List[Resource]) -> int:
+        """Log ``resources`` and return once they are durable (last LSN).
+
+        Raises if the batch carrying them could not be written; nothing from
+        a failed batch is retried or kept in the log.
+        """
+        if not resources:
+            return self._durable_lsn
+        with self._cond:
+            first = self._next_lsn
+            for res in resources:
+                lsn = self._next_lsn
+                self._next_lsn += 1
+                line = json.dumps({"lsn": lsn, "resource": res}, separators=(",", ":"), default=str)
+                self._pending.append((lsn, line, res))
+            while True:
+                error = self._failed.get(lsn)
+                if error is not None:
+                    for n in range(first, lsn + 1):
+                        self._failed.pop(n, None)
+                    raise RuntimeError(f"WAL commit failed: {error}") from error
+                if self._durable_lsn >= lsn:
+                    return lsn
+                if not self._flushing:
+                    self._lead()
+                else:
+                    self._cond.wait()
+
+    def _lead(self) -> None:
+        # Called with the condition held; releases it around the I/O.
+        self._flushing = True
+        try:
+            if self.group_commit_s:
+                self._cond.release()
+                try:
+                    time.sleep(self.group_commit_s)
+                finally:
+                    self._cond.acquire()
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+            self._cond.release()
+            try:
+                self._write(batch)
+            except Exception as exc:  # noqa: BLE001 - handed to every writer in the batch
+                self._cond.acquire()
+                for lsn, _, _ in batch:
+                    self._failed[lsn] = exc
+                return
+            self._cond.acquire()
+            self._durable_lsn = batch[-1][0]
+            for _, _, res in batch:
+                key = (res["resourceType"], res["id"])
+                if _version(res) >= _version(self._state.get(key)):
+                    self._state.pop(key, None)
+                    self._state[key] = res
+            self.commits += 1
+            self.records += len(batch)
+            self._since_snapshot += len(batch)
+            if self.snapshot_every and self._since_snapshot >= self.snapshot_every and not self._pending:
+                self._checkpoint_locked()
+        finally:
+            self._flushing = False
+            self._cond.notify_all()
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self._path(WAL_FILE), "a", encoding="utf-8")
+        return self._file
+
+    def _write(self, batch: List[Tuple[int, str, Resource]]) -> None:
+        fh = self._open()
+        start = fh.tell()
+        try:
+            fh.write("".join(line + "\n" for _, line, _ in batch))
+            fh.flush()
+            if self.fsync:
+                os.fsync(fh.fileno())
+        except BaseException:
+            # Cut off whatever part of the batch reached the file so the
+            # next batch doesn't follow a torn line.
+            self._file = None
+            try:
+                fh.close()
+            except OSError:
+                pass
+            try:
+                os.truncate(self._path(WAL_FILE), start)
+            except OSError:
+                pass
+            raise
+
+    def checkpoint(self) -> None:
+        """Snapshot the current state and truncate the log."""
+        with self._cond:
+            while self._flushing or self._pending:
+                if not self._flushing:
+                    self._lead()
+                else:
+                    self._cond.wait()
+            self._checkpoint_locked()
+
+    def _checkpoint_locked(self) -> None:
+        snap = {"lsn": self._durable_lsn, "resources": list(self._state.values())}
+        tmp = self._path(SNAPSHOT_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(snap, fh, separators=(",", ":"), default=str)
+            fh.flush()
+            if self.fsync:
+                os.fsync(fh.fileno())
+        os.replace(tmp, self._path(SNAPSHOT_FILE))
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        # Everything up to durable_lsn is in the snapshot.
+        open(self._path(WAL_FILE), "w").close()
+        self._since_snapshot = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "durable_lsn": self._durable_lsn,
+                "records": self.records,
+                "commits": self.commits,
+                "resources": len(self._state),
+            }
+
+    def close(self) -> None:
+        with self._cond:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,348 @@
+"""In-memory provider directory for the HCA mock.
+
+Providers (FHIR Practitioner / HealthcareService dicts) are indexed two ways:
+
+- an index from each distinct lowercased qualification text to provider
+  ordinals. A role matches a provider when it is a case-insensitive
+  substring of one of its qualifications (as the original fixture filter
+  did), so a role query scans the few distinct texts, not every provider,
+  and the result is memoised;
+- a uniform lat/lon grid (``cell_deg`` degrees per cell) whose cells group
+  providers by exact point, searched ring by ring outward from the query
+  point and stopped once ``limit`` matches are found and no unvisited ring
+  can hold a closer one. Providers sharing a point (a clinic, a postcode
+  centroid) cost one distance computation between them.
+
+Coordinates come from postcode centroids (``POSTCODE_CENTROIDS``, or
+``lat``/``lon`` columns when a CSV has them). Providers whose postcode has
+no centroid are still found by an exact-postcode query.
+
+:meth:`ProviderDirectory.load_csv_dir` reads the generated ``provider.csv``
+(linked to ``location.csv`` by ``location_id``) and any
+``COMMUNITY_SERVICES_DIRECTORY.csv`` rows that carry a postcode.
+
+Names, qualifications and location/organisation names also go into a
+:class:`text_index.TextIndex` for typo-tolerant :meth:`search_text`.
+"""
+
+import csv
+import heapq
+import math
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from text_index import TextIndex
+
+Provider = Dict[str, Any]
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG = 111.32
+
+# Approximate centroids (lat, lon) for the postcodes the demo data uses.
+POSTCODE_CENTROIDS: Dict[str, Tuple[float, float]] = {
+    "2000": (-33.8688, 151.2093),  # Sydney
+    "2007": (-33.8832, 151.1990),  # Ultimo
+    "2010": (-33.8840, 151.2130),  # Surry Hills
+    "2026": (-33.8915, 151.2767),  # Bondi
+    "2067": (-33.7969, 151.1803),  # Chatswood
+    "2095": (-33.7969, 151.2840),  # Manly
+    "2150": (-33.8150, 151.0011),  # Parramatta
+    "2170": (-33.9200, 150.9239),  # Liverpool
+    "2250": (-33.4267, 151.3417),  # Gosford
+    "2300": (-32.9283, 151.7817),  # Newcastle
+    "2500": (-34.4278, 150.8931),  # Wollongong
+    "2750": (-33.7510, 150.6942),  # Penrith
+}
+
+# Role matches up to this many are measured directly; larger sets are
+# searched through the grid.
+_DIRECT_SCAN_MAX = 2048
+
+# Memoised role -> matching providers, cleared when it grows past this or
+# a provider is added.
+_ROLE_CACHE_MAX = 1024
+
+
+def role_key(role: str) -> str:
+    """The normalised form a role query matches on (case-insensitive substring)."""
+    return (role or "").strip().lower()
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _qualification_texts(provider: Provider) -> List[str]:
+    texts = [q.get("code", {}).get("text", "") for q in provider.get("qualification", [])]
+    texts += [t.get("text", "") for t in provider.get("type", [])]
+    return [t for t in texts if t]
+
+
+def _searchable_texts(provider: Provider) -> List[str]:
+    names = provider.get("name")
+    texts = [n.get("text", "") for n in names] if isinstance(names, list) else [names or ""]
+    location = provider.get("location") or {}
+    texts += [location.get("name") or "", location.get("organization") or ""]
+    return [t for t in texts + _qualification_texts(provider) if t]
+
+
+class ProviderDirectory:
+    def __init__(self, cell_deg: float = 0.02):
+        self.cell_deg = cell_deg
+        self._lock = threading.Lock()
+        self._providers: List[Provider] = []
+        self._coords: List[Optional[Tuple[float, float]]] = []
+        # Distinct lowercased qualification text -> providers holding it.
+        self._by_role_text: Dict[str, Set[int]] = {}
+        self._role_cache: Dict[str, Set[int]] = {}
+        self._by_postcode: Dict[str, List[int]] = {}
+        # cell -> point -> ordinals at that point
+        self._grid: Dict[Tuple[int, int], Dict[Tuple[float, float], List[int]]] = {}
+        self._text = TextIndex()
+
+    def __len__(self) -> int:
+        return len(self._providers)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    def add(self, provider: Provider) -> None:
+        location = provider.get("location") or {}
+        postcode = str(location.get("postcode") or "")
+        coords: Optional[Tuple[float, float]] = None
+        if location.get("lat") is not None and location.get("lon") is not None:
+            coords = (float(location["lat"]), float(location["lon"]))
+        elif postcode in POSTCODE_CENTROIDS:
+            coords = POSTCODE_CENTROIDS[postcode]
+        with self._lock:
+            idx = len(self._providers)
+            self._providers.append(provider)
+            self._coords.append(coords)
+            for text in _qualification_texts(provider):
+                self._by_role_text.setdefault(text.lower(), set()).add(idx)
+            self._role_cache.clear()
+            if postcode:
+                self._by_postcode.setdefault(postcode, []).append(idx)
+            if coords is not None:
+                self._grid.setdefault(self._cell(*coords), {}).setdefault(coords, []).append(idx)
+        self._text.add(idx, _searchable_texts(provider))
+
+    def add_many(self, providers: Iterable[Provider]) -> None:
+        for provider in providers:
+            self.add(provider)
+
+    def _role_matches(self, role: str) -> Set[int]:
+        """Providers with a qualification containing ``role`` (case-insensitive).
+
+        Substring matching (``Pharm`` finds "Pharmacist") runs over the
+        distinct qualification texts, which are far fewer than providers.
+        """
+        key = role_key(role)
+        hits = self._role_cache.get(key)
+        if hits is None:
+            hits = set()
+            for text, ordinals in self._by_role_text.items():
+                if key in text:
+                    hits |= ordinals
+            if len(self._role_cache) >= _ROLE_CACHE_MAX:
+                self._role_cache.clear()
+            self._role_cache[key] = hits
+        return hits
+
+    def _role_filters(self, roles: List[str]) -> Optional[List[Set[int]]]:
+        """Per role, the providers it matches; a provider must match any one."""
+        if not roles:
+            return None
+        return [self._role_matches(role) for role in roles]
+
+    def search(
+        self,
+        postcode: str,
+        roles: Optional[List[str]] = None,
+        radius_km: float = 10.0,
+        limit: int = 50,
+        include_inactive: bool = False,
+    ) -> List[Tuple[Provider, Optional[float]]]:
+        """``(provider, distance_km)`` pairs nearest first.
+
+        Without a centroid for ``postcode`` only providers registered at that
+        exact postcode match, and their distance is None.
+        """
+        with self._lock:
+            filters = self._role_filters(roles or [])
+
+            def ok(idx: int) -> bool:
+                if filters is not None and not any(idx in hits for hits in filters):
+                    return False
+                return include_inactive or self._providers[idx].get("active", True) is not False
+
+            origin = POSTCODE_CENTROIDS.get(str(postcode))
+            if origin is None:
+                hits = [i for i in self._by_postcode.get(str(postcode), []) if ok(i)]
+                return [(self._providers[i], None) for i in hits[:limit]]
+            if filters is not None and sum(len(hits) for hits in filters) <= _DIRECT_SCAN_MAX:
+                candidates = set().union(*filters)
+                found = self._measure(origin, (i for i in candidates if ok(i)), radius_km)
+                return [(self._providers[i], d) for d, i in heapq.nsmallest(limit, found)]
+            return [(self._providers[i], d) for d, i in self._grid_search(origin, ok, radius_km, limit)]
+
+    def search_text(
+        self, query: str, limit: int = 20, min_score: float = 0.5, include_inactive: bool = False
+    ) -> List[Tuple[Provider, float]]:
+        """Fuzzy matches for ``query`` over names, roles and organisations, best first."""
+
+        def accept(idx: int) -> bool:
+            return include_inactive or self._providers[idx].get("active", True) is not False
+
+        hits = self._text.search(query, limit=limit, min_score=min_score, accept=accept)
+        return [(self._providers[idx], score) for score, idx in hits]
+
+    def _measure(self, origin: Tuple[float, float], ordinals: Iterable[int], radius_km: float) -> List[Tuple[float, int]]:
+        out = []
+        for idx in ordinals:
+            coords = self._coords[idx]
+            if coords is None:
+                continue
+            d = haversine_km(origin[0], origin[1], coords[0], coords[1])
+            if d <= radius_km:
+                out.append((d, idx))
+        return out
+
+    def _grid_search(
+        self, origin: Tuple[float, float], ok: Callable[[int], bool], radius_km: float, limit: int
+    ) -> List[Tuple[float, int]]:
+        lat, lon = origin
+        cy, cx = self._cell(lat, lon)
+        # Cells are narrowest east-west; use that width (at the far edge of
+        # the radius) as a lower bound on how far each ring is.
+        cos_lat = math.cos(math.radians(min(89.0, abs(lat) + radius_km / KM_PER_DEG)))
+        cell_km = self.cell_deg * KM_PER_DEG * cos_lat
+        max_ring = int(math.ceil(radius_km / cell_km)) + 1
+        best: List[Tuple[float, int]] = []  # max-heap of (-distance, ordinal)
+        for ring in range(max_ring + 1):
+            if len(best) >= limit and (ring - 1) * cell_km > -best[0][0]:
+                break
+            points = []
+            for dy in range(-ring, ring + 1):
+                step = 1 if abs(dy) == ring else 2 * ring
+                for dx in range(-ring, ring + 1, max(1, step)):
+                    for point, ordinals in self._grid.get((cy + dy, cx + dx), {}).items():
+                        d = haversine_km(lat, lon, point[0], point[1])
+                        if d <= radius_km:
+                            points.append((d, ordinals))
+            points.sort(key=lambda p: p[0])
+            for d, ordinals in points:
+                if len(best) >= limit and d >= -best[0][0]:
+                    break
+                for idx in ordinals:
+                    if not ok(idx):
+                        continue
+                    if len(best) < limit:
+                        heapq.heappush(best, (-d, idx))
+                    elif d < -best[0][0]:
+                        heapq.heapreplace(best, (-d, idx))
+                    else:
+                        break
+        return sorted((-nd, idx) for nd, idx in best)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "providers": len(self._providers),
+                "located": sum(1 for c in self._coords if c is not None),
+                "role_texts": len(self._by_role_text),
+                "grid_cells": len(self._grid),
+                "text": self._text.stats(),
+            }
+
+    # -- loading -----------------------------------------------------------
+
+    def load_csv_dir(self, directory: str) -> int:
+        """Load ``provider.csv`` (+ ``location.csv``) and community services; returns rows added."""
+        before = len(self)
+        organizations = _read_organizations(os.path.join(directory, "organization.csv"))
+        locations = _read_locations(os.path.join(directory, "location.csv"), organizations)
+        location_ids = sorted(locations, key=lambda k: int(k) if k.isdigit() else 0)
+        path = os.path.join(directory, "provider.csv")
+        if os.path.exists(path):
+            with open(path, newline="", encoding="utf-8") as fh:
+                for row in csv.DictReader(fh):
+                    location = locations.get(row.get("location_id") or "")
+                    if location is None and location_ids and (row.get("provider_id") or "").isdigit():
+                        # Older provider.csv files carry no location_id:
+                        # spread providers over the locations by id.
+                        location = locations[location_ids[(int(row["provider_id"]) - 1) % len(location_ids)]]
+                    self.add(_practitioner(row, location))
+        path = os.path.join(directory, "COMMUNITY_SERVICES_DIRECTORY.csv")
+        if os.path.exists(path):
+            with open(path, newline="", encoding="utf-8") as fh:
+                for row in csv.DictReader(fh):
+                    if row.get("POSTCODE") or (row.get("LAT") and row.get("LON")):
+                        self.add(_healthcare_service(row))
+        return len(self) - before
+
+
+def _read_organizations(path: str) -> Dict[str, str]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline="", encoding="utf-8") as fh:
+        return {row.get("org_id") or "": row.get("name") or "" for row in csv.DictReader(fh)}
+
+
+def _read_locations(path: str, organizations: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+    out: Dict[str, Dict[str, Any]] = {}
+    if not os.path.exists(path):
+        return out
+    with open(path, newline="", encoding="utf-8") as fh:
+        for row in csv.DictReader(fh):
+            location: Dict[str, Any] = {
+                "location_id": row.get("location_id"),
+                "name": row.get("name"),
+                "organization": organizations.get(row.get("org_id") or ""),
+                "suburb": row.get("suburb"),
+                "state": row.get("state"),
+                "postcode": row.get("postcode"),
+            }
+            if row.get("lat") and row.get("lon"):
+                location["lat"], location["lon"] = float(row["lat"]), float(row["lon"])
+            out[row.get("location_id") or ""] = location
+    return out
+
+
+def _practitioner(row: Dict[str, str], location: Optional[Dict[str, Any]]) -> Provider:
+    given, family = row.get("name_given") or "", row.get("name_family") or ""
+    provider: Provider = {
+        "resourceType": "Practitioner",
+        "id": f"prac-csv-{row.get('provider_id')}",
+        "active": (row.get("status") or "active") == "active",
+        "name": [{"text": f"{given} {family}".strip(), "given": [given], "family": family}],
+        "qualification": [{"code": {"text": row.get("role") or ""}}],
+        "location": dict(location) if location else {},
+    }
+    if row.get("hpii"):
+        provider["identifier"] = [{"system": "http://ns.electronichealth.net.au/id/hi/hpii/1.0", "value": row["hpii"]}]
+    if row.get("lat") and row.get("lon"):
+        provider["location"].update(lat=float(row["lat"]), lon=float(row["lon"]))
+    return provider
+
+
+def _healthcare_service(row: Dict[str, str]) -> Provider:
+    location: Dict[str, Any] = {"postcode": row.get("POSTCODE"), "region": row.get("REGION")}
+    if row.get("LAT") and row.get("LON"):
+        location.update(lat=float(row["LAT"]), lon=float(row["LON"]))
+    telecom = [{"system": "phone", "value": row["PHONE"]}] if row.get("PHONE") else []
+    if row.get("EMAIL"):
+        telecom.append({"system": "email", "value": row["EMAIL"]})
+    return {
+        "resourceType": "HealthcareService",
+        "id": f"hs-{row.get('SERVICE_ID')}",
+        "name": row.get("SERVICE_NAME"),
+        "type": [{"text": row.get("SERVICE_NAME") or ""}, {"text": row.get("SERVICE_TYPE") or ""}],
+        "telecom": telecom,
+        "comment": row.get("NOTES"),
+        "location": location,
+    }
@@ -1,12 +1,20 @@
 #!/usr/bin/env python3
-import json
+import os
 import sys
 import time
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
+
+# Allow `python3 mcp/mcp-hca-mock/main.py` to import the shared libs package.
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from libs.common.mcp_server import serve  # noqa: E402
+from directory import ProviderDirectory, role_key  # noqa: E402
 
 # Minimal JSON-RPC 2.0 over stdio for demo purposes.
 # Methods exposed:
 # - hca.directory.search_providers
+# - hca.directory.search_text
+# - hca.directory.search_providers_batch
 # - mcp.list_tools
 
 TOOLS = [
@@ -16,10 +24,22 @@ TOOLS = [
             "patient_id": "string",
             "location": "string",
             "roles": ["string"],
+            "radius_km": "number",
+            "limit": "number",
             "consent_context": "object"
         },
         "output": {"type": "providers_list"},
-    }
+    },
+    {
+        "name": "hca.directory.search_providers_batch",
+        "input": {"queries": [{"id": "string", "patient_id": "string", "location": "string", "roles": ["string"]}]},
+        "output": {"count": "number", "unique_queries": "number", "results": "object"},
+    },
+    {
+        "name": "hca.directory.search_text",
+        "input": {"query": "string", "limit": "number", "min_score": "number"},
+        "output": {"type": "providers_list"},
+    },
 ]
 
 PROVIDERS_FIXTURE: List[Dict[str, Any]] = [
@@ -49,68 +69,101 @@ PROVIDERS_FIXTURE: List[Dict[str, Any]] = [
     },
 ]
 
+DEFAULT_RADIUS_KM = 10.0
+DEFAULT_LIMIT = 50
 
-def _write(obj: Dict[str, Any]):
-    sys.stdout.write(json.dumps(obj) + "\n")
-    sys.stdout.flush()
+# Fixtures plus, with HCA_DIRECTORY_DIR set (e.g. data/csv), the generated
+# provider/location/community-service CSVs there.
+directory = ProviderDirectory()
+directory.add_many(PROVIDERS_FIXTURE)
+if os.getenv("HCA_DIRECTORY_DIR"):
+    directory.load_csv_dir(os.environ["HCA_DIRECTORY_DIR"])
 
 
-def _ok(id_, result):
-    _write({"jsonrpc": "2.0", "id": id_, "result": result})
+def list_tools():
+    return {"tools": TOOLS}
 
 
-def _err(id_, code, message, data=None):
-    _write({"jsonrpc": "2.0", "id": id_, "error": {"code": code, "message": message, "data": data}})
+def _query_key(query: Dict[str, Any]) -> Tuple[str, Tuple[str, ...], float, int]:
+    roles = query.get("roles") or []
+    if isinstance(roles, str):
+        roles = [roles]
+    return (
+        str(query.get("location") or "2000"),
+        tuple(sorted({role_key(r) for r in roles} - {""})),
+        float(query.get("radius_km") or DEFAULT_RADIUS_KM),
+        int(query.get("limit") or DEFAULT_LIMIT),
+    )
 
 
-def list_tools():
-    return {"tools": TOOLS}
+def _search(key: Tuple[str, Tuple[str, ...], float, int]) -> List[Dict[str, Any]]:
+    location, roles, radius_km, limit = key
+    # Role tokens via the inverted index, nearest first within radius_km of
+    # the postcode's centroid (exact postcode match if it has none).
+    out = []
+    for p, distance in directory.search(location, list(roles), radius_km=radius_km, limit=limit):
+        out.append(dict(p, distance_km=round(distance, 2)) if distance is not None else p)
+    return out
 
 
 def hca_directory_search_providers(params: Dict[str, Any]):
-    roles = params.get("roles") or []
-    location = params.get("location") or "2000"
-    # Simple filter: match by role keyword in qualification text and postcode.
-    out = []
-    for p in PROVIDERS_FIXTURE:
-        ok_loc = p.get("location", {}).get("postcode") == location
-        if not roles:
-            role_ok = True
-        else:
-            qual_texts = [q.get("code", {}).get("text", "").lower() for q in p.get("qualification", [])]
-            role_ok = any(r.lower() in qt for r in roles for qt in qual_texts)
-        if ok_loc and role_ok:
-            out.append(p)
+    out = _search(_query_key(params))
+    return {"count": len(out), "providers": out, "ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+
+
+def hca_directory_search_providers_batch(params: Dict[str, Any]):
+    queries = params.get("queries")
+    if not isinstance(queries, list):
+        raise ValueError("queries must be a list of {id?, patient_id, location, roles} objects")
+    # Queries differing only in patient_id (or role spelling/order) share
+    # one index lookup.
+    unique: Dict[Tuple[str, Tuple[str, ...], float, int], List[Dict[str, Any]]] = {}
+    results: Dict[str, Any] = {}
+    for i, query in enumerate(queries):
+        if not isinstance(query, dict):
+            raise ValueError(f"queries[{i}] must be an object")
+        qid = str(query.get("id") if query.get("id") is not None else i)
+        if qid in results:
+            raise ValueError(f"Duplicate query id: {qid}")
+        key = _query_key(query)
+        if key not in unique:
+            unique[key] = _search(key)
+        providers = unique[key]
+        results[qid] = {
+            "patient_id": query.get("patient_id"),
+            "location": key[0],
+            "count": len(providers),
+            "providers": providers,
+        }
+    return {
+        "count": len(results),
+        "unique_queries": len(unique),
+        "results": results,
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def hca_directory_search_text(params: Dict[str, Any]):
+    query = str(params.get("query") or "").strip()
+    if not query:
+        raise ValueError("query is required")
+    limit = int(params.get("limit") or 20)
+    min_score = float(params.get("min_score") if params.get("min_score") is not None else 0.5)
+    # Misspellings, abbreviations ("mgr") and acronyms ("MH") all score.
+    out = [dict(p, score=round(score, 3)) for p, score in directory.search_text(query, limit, min_score)]
     return {"count": len(out), "providers": out, "ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
 
 
 METHODS = {
     "mcp.list_tools": lambda p: list_tools(),
     "hca.directory.search_providers": hca_directory_search_providers,
+    "hca.directory.search_text": hca_directory_search_text,
+    "hca.directory.search_providers_batch": hca_directory_search_providers_batch,
 }
 
 
 def main():
-    for line in sys.stdin:
-        line = line.strip()
-        if not line:
-            continue
-        try:
-            req = json.loads(line)
-        except Exception as e:
-            _write({"jsonrpc": "2.0", "id": None, "error": {"code": -32700, "message": "Parse error", "data": str(e)}})
-            continue
-        id_ = req.get("id")
-        method = req.get("method")
-        params = req.get("params", {})
-        if method not in METHODS:
-            _err(id_, -32601, f"Method not found: {method}")
-            continue
-        try:
-            result = METHODS[method](params)
-            _ok(id_, result)
-        except Exception as e:
-            _err(id_, -32000, "Server error", {"message": str(e)})
+    serve(METHODS)
 
 
 if __name__ == "__main__":
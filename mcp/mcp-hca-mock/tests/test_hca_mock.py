@@ -0,0 +1,110 @@
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+sys.path.insert(0, ROOT)
+
+from libs.common.mcp_client import load_inproc_methods  # noqa: E402
+
+METHODS = load_inproc_methods("inproc:mcp-hca-mock")
+
+
+def call(method, **params):
+    return METHODS[method](params)
+
+
+def test_fixture_search_matches_roles_as_qualification_substrings():
+    found = call("hca.directory.search_providers", location="2000", roles=["GP", "Case Manager", "Pharmacist"])
+    assert [p["id"] for p in found["providers"]] == ["prac-002", "prac-003"]
+    assert all(p["distance_km"] == 0.0 for p in found["providers"])
+    assert [p["id"] for p in call("hca.directory.search_providers", roles=["Pharm"])["providers"]] == ["prac-003"]
+    assert [p["id"] for p in call("hca.directory.search_providers", roles=["general practitioner"])["providers"]] == ["prac-001"]
+
+
+def test_directory_ranks_csv_providers_by_distance_within_radius(tmp_path):
+    from directory import ProviderDirectory
+
+    (tmp_path / "location.csv").write_text(
+        "location_id,org_id,name,type,address_line1,suburb,state,postcode\n"
+        "1,1,CBD,Clinic,1 Rd,Sydney,NSW,2000\n"
+        "2,1,Chatswood,Clinic,2 Rd,Chatswood,NSW,2067\n"
+        "3,1,Gosford,Clinic,3 Rd,Gosford,NSW,2250\n"
+    )
+    rows = ["provider_id,hpii,name_given,name_family,role,specialty,status,location_id"]
+    for i in range(1, 301):
+        role = "General Practitioner" if i % 5 else "Pharmacist"
+        rows.append(f"{i},800361{i:07d},A,B,{role},General Practice,{'inactive' if i % 10 == 0 else 'active'},{i % 3 + 1}")
+    (tmp_path / "provider.csv").write_text("\n".join(rows) + "\n")
+
+    directory = ProviderDirectory()
+    assert directory.load_csv_dir(str(tmp_path)) == 300
+    near = directory.search("2067", ["general pract"], radius_km=10, limit=500)
+    distances = [d for _, d in near]
+    assert distances == sorted(distances) and distances[-1] < 10
+    assert {p["location"]["postcode"] for p, _ in near} == {"2000", "2067"}
+    assert all(p["active"] and p["qualification"][0]["code"]["text"] == "General Practitioner" for p, _ in near)
+    # The grid path (no role filter) agrees with a full scan on the top hits.
+    top = directory.search("2000", [], radius_km=100, limit=5)
+    assert [d for _, d in top] == [0.0] * 5
+    assert len(directory.search("2000", [], radius_km=100, limit=1000)) == 270
+
+
+def test_search_text_ranks_fuzzy_matches_and_indexes_new_providers():
+    found = call("hca.directory.search_text", query="Kim cse mgr")
+    assert found["providers"][0]["id"] == "prac-002"
+    assert 0.5 < found["providers"][0]["score"] < 1.0
+    assert call("hca.directory.search_text", query="pharmacst")["providers"][0]["id"] == "prac-003"
+
+    from directory import ProviderDirectory
+
+    directory = ProviderDirectory()
+    directory.add({"resourceType": "Practitioner", "id": "p1", "name": [{"text": "Jo Smith"}],
+                   "qualification": [{"code": {"text": "Mental Health Nurse"}}]})
+    before = directory.search_text("St Vincents MH")
+    directory.add({"resourceType": "Practitioner", "id": "p2", "name": [{"text": "Sam Lee"}],
+                   "qualification": [{"code": {"text": "Mental Health Nurse"}}],
+                   "location": {"organization": "St Vincent's Hospital"}})
+    hits = directory.search_text("St Vincents MH", limit=5)
+    assert [p["id"] for p, _ in hits][0] == "p2"
+    assert hits[0][1] > 0.9 and all(score < hits[0][1] for _, score in before)
+
+
+def test_batch_groups_identical_queries_and_keys_results():
+    queries = [
+        {"patient_id": "1", "location": "2000", "roles": ["GP", "Pharmacist"]},
+        {"id": "b", "patient_id": "2", "location": "2000", "roles": ["pharmacist", "gp"]},
+        {"patient_id": "3", "location": "9999", "roles": ["GP"]},
+    ]
+    out = call("hca.directory.search_providers_batch", queries=queries)
+    assert out["count"] == 3 and out["unique_queries"] == 2
+    assert set(out["results"]) == {"0", "b", "2"}
+    single = call("hca.directory.search_providers", location="2000", roles=["GP", "Pharmacist"])
+    assert [p["id"] for p in out["results"]["b"]["providers"]] == [p["id"] for p in single["providers"]]
+    assert out["results"]["b"]["patient_id"] == "2" and out["results"]["2"]["count"] == 0
+
+
+def test_batcher_serves_repeat_lookups_from_the_client_cache():
+    import asyncio
+
+    from libs.agentis.tools.directory import ProviderLookupBatcher
+    from libs.common.mcp_client import MCPCache
+
+    class HCA:
+        cache = MCPCache(ttl=60)
+        methods = []
+
+        async def call(self, method, params, timeout=None):
+            self.methods.append(method)
+            return call(method, **params)
+
+    async def run():
+        hca = HCA()
+        batcher = ProviderLookupBatcher(hca, window_ms=1)
+        first = await asyncio.gather(*(batcher.search(pid, "2000", ["Pharmacist"]) for pid in ("1", "2")))
+        again = await batcher.search("1", "2000", ["Pharmacist"])
+        return hca, batcher, first, again
+
+    hca, batcher, first, again = asyncio.run(run())
+    assert hca.methods == ["hca.directory.search_providers_batch"]
+    assert again == first[0] and [p["id"] for p in again["providers"]] == ["prac-003"]
+    assert batcher.stats()["cache_hits"] == 1
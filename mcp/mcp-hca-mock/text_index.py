@@ -0,0 +1,165 @@
+"""Typo-tolerant text index for directory search.
+
+Documents are lists of short texts (names, qualifications, organisation
+names) split into word tokens. The index keeps:
+
+- word -> documents, and the set of distinct words (the vocabulary);
+- trigram -> vocabulary words (words padded with spaces, so ``kim`` gives
+  `` ki``, ``kim``, ``im ``), for misspellings;
+- first letter -> vocabulary words, for prefixes and abbreviations such as
+  ``mgr`` for ``manager``;
+- acronyms of consecutive words (``mh`` for "Mental Health") -> documents.
+
+Every query word is matched against the vocabulary, not the documents, and
+the document score is the mean of each query word's best match, so ranking
+cost follows the words matched rather than the directory size. ``add`` only
+touches the postings for the new document's words, so the index grows
+incrementally.
+"""
+
+import heapq
+import re
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+EXACT = 1.0
+PREFIX = 0.9
+ACRONYM = 0.85
+ABBREVIATION = 0.75
+# Trigram similarity (Dice) is scaled by this and kept above MIN_FUZZY.
+FUZZY = 0.8
+MIN_FUZZY = 0.45
+
+
+def words(text: str) -> List[str]:
+    return _WORD.findall((text or "").lower().replace("'", ""))
+
+
+def trigrams(word: str) -> Set[str]:
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _is_abbreviation(short: str, word: str) -> bool:
+    """``short`` keeps ``word``'s first letter and the rest in order (mgr/manager)."""
+    if len(short) < 2 or len(short) >= len(word) or short[0] != word[0]:
+        return False
+    it = iter(word[1:])
+    return all(ch in it for ch in short[1:])
+
+
+class TextIndex:
+    def __init__(self, max_acronym: int = 4):
+        self.max_acronym = max_acronym
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Set[int]] = {}
+        self._acronyms: Dict[str, Set[int]] = {}
+        self._by_trigram: Dict[str, Set[str]] = {}
+        self._by_initial: Dict[str, Set[str]] = {}
+        self._docs = 0
+
+    def __len__(self) -> int:
+        return self._docs
+
+    def add(self, doc: int, texts: Iterable[str]) -> None:
+        with self._lock:
+            self._docs += 1
+            for text in texts:
+                tokens = words(text)
+                for word in tokens:
+                    docs = self._postings.get(word)
+                    if docs is None:
+                        docs = self._postings[word] = set()
+                        for gram in trigrams(word):
+                            self._by_trigram.setdefault(gram, set()).add(word)
+                        self._by_initial.setdefault(word[0], set()).add(word)
+                    docs.add(doc)
+                for n in range(2, self.max_acronym + 1):
+                    for i in range(len(tokens) - n + 1):
+                        acronym = "".join(w[0] for w in tokens[i:i + n])
+                        self._acronyms.setdefault(acronym, set()).add(doc)
+
+    def _word_matches(self, query: str) -> Dict[str, float]:
+        """Vocabulary words similar to ``query`` and how similar."""
+        out: Dict[str, float] = {}
+        if query in self._postings:
+            out[query] = EXACT
+        for word in self._by_initial.get(query[0], ()):
+            if word == query:
+                continue
+            if word.startswith(query) and len(query) >= 2:
+                out[word] = max(out.get(word, 0.0), PREFIX)
+            elif _is_abbreviation(query, word):
+                out[word] = max(out.get(word, 0.0), ABBREVIATION)
+        grams = trigrams(query)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for word in self._by_trigram.get(gram, ()):
+                shared[word] = shared.get(word, 0) + 1
+        for word, count in shared.items():
+            dice = 2.0 * count / (len(grams) + len(word))
+            if dice >= MIN_FUZZY:
+                out[word] = max(out.get(word, 0.0), FUZZY * dice)
+        return out
+
+    def search(
+        self, query: str, limit: int = 20, min_score: float = 0.5, accept: Optional[Callable[[int], bool]] = None
+    ) -> List[Tuple[float, int]]:
+        """``(score, doc)`` best first; scores are in (0, 1]. ``accept`` filters docs.
+
+        Terms are applied rarest first; once the terms left could not lift an
+        unseen document to ``min_score`` or past the current ``limit``-th
+        best, only documents already seen are scored, so a common word
+        ("org") costs one lookup per candidate rather than a pass over its
+        whole posting.
+        """
+        terms = list(dict.fromkeys(words(query)))
+        if not terms:
+            return []
+        n = float(len(terms))
+        with self._lock:
+            matched = []
+            for term in terms:
+                postings = [(self._postings[w], score) for w, score in self._word_matches(term).items()]
+                if len(term) >= 2 and term in self._acronyms:
+                    postings.append((self._acronyms[term], ACRONYM))
+                postings.sort(key=lambda p: -p[1])
+                matched.append((sum(len(docs) for docs, _ in postings), postings))
+            matched.sort(key=lambda m: m[0])
+            totals: Dict[int, float] = {}
+            for k, (size, postings) in enumerate(matched):
+                # A document first seen now scores at most (n - k) / n; the
+                # limit-th best total so far is a floor on the final cut-off.
+                admit = size > 0 and n - k >= min_score * n
+                if admit and len(totals) >= limit:
+                    admit = n - k > heapq.nlargest(limit, totals.values())[-1]
+                if admit:
+                    scored: Dict[int, float] = {}
+                    for docs, score in postings:
+                        for doc in docs:
+                            if score > scored.get(doc, 0.0) and (accept is None or accept(doc)):
+                                scored[doc] = score
+                    for doc, score in scored.items():
+                        totals[doc] = totals.get(doc, 0.0) + score
+                else:
+                    for doc in totals:
+                        # Postings are best score first.
+                        for docs, score in postings:
+                            if doc in docs:
+                                totals[doc] += score
+                                break
+        ranked = ((total / n, doc) for doc, total in totals.items())
+        # Ties break towards the earlier-added document (among those scored).
+        top = heapq.nsmallest(limit, ((-s, doc) for s, doc in ranked if s >= min_score))
+        return [(-neg, doc) for neg, doc in top]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "documents": self._docs,
+                "words": len(self._postings),
+                "trigrams": len(self._by_trigram),
+                "acronyms": len(self._acronyms),
+            }
@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
-import json
 import os
 import sys
 import urllib.parse
 from typing import Any, Dict
 
+# Allow `python3 mcp/mcp-maps/main.py` to import the shared libs package.
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from libs.common.mcp_server import serve  # noqa: E402
+from routing import RoadGraph  # noqa: E402
+
 # Minimal JSON-RPC 2.0 over stdio for demo purposes.
 # Tools exposed:
 # - maps.route_with_static_map
@@ -15,6 +20,11 @@ from typing import Any, Dict
 # destination strings. In a real deployment you would replace the URL
 # builders with calls to the official Google Maps APIs using an API key
 # stored in a secure configuration location (never hard-coded here).
+#
+# With MAPS_GRAPH_DIR set, routes are also computed offline over a local
+# road graph (see routing.py) and carry real distance_m / duration_s /
+# polyline values, and maps.distance_matrix answers many origin/destination
+# pairs in one call.
 
 
 TOOLS = [
@@ -29,23 +39,26 @@ TOOLS = [
                 "static_map_url",
                 "map_url",
                 "summary",
+                "distance_m",
+                "duration_s",
+                "polyline",
             ],
         },
-    }
+    },
+    {
+        "name": "maps.distance_matrix",
+        "input": {"origins": "string[]", "destinations": "string[]"},
+        "output": {
+            "type": "distance_matrix",
+            "fields": ["origins", "destinations", "duration_s", "distance_m", "engine"],
+        },
+    },
 ]
 
+# Upper bound on origins x destinations per maps.distance_matrix call.
+MAX_MATRIX_CELLS = 10000
 
-def _write(obj: Dict[str, Any]):
-    sys.stdout.write(json.dumps(obj) + "\n")
-    sys.stdout.flush()
-
-
-def _ok(id_, result):
-    _write({"jsonrpc": "2.0", "id": id_, "result": result})
-
-
-def _err(id_, code, message, data=None):
-    _write({"jsonrpc": "2.0", "id": id_, "error": {"code": code, "message": message, "data": data}})
+graph = RoadGraph.from_env()
 
 
 def list_tools() -> Dict[str, Any]:
@@ -93,42 +106,45 @@ def maps_route_with_static_map(params: Dict[str, Any]) -> Dict[str, Any]:
         "map_url": map_url,
         "summary": summary,
     }
+    route = graph.route(origin, destination) if graph is not None else None
+    if route is not None:
+        out.update(route)
+        out["engine"] = "offline"
+        out["summary"] = (
+            f"{route['distance_m'] / 1000:.1f} km, about {max(1, round(route['duration_s'] / 60))} min "
+            f"by car from {origin} to {destination}."
+        )
     if static_map_url:
         out["static_map_url"] = static_map_url
     return out
 
 
+def maps_distance_matrix(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Rows follow ``origins`` and columns ``destinations``; unplaceable or
+    unreachable pairs are null."""
+    origins = [str(o).strip() for o in params.get("origins") or []]
+    destinations = [str(d).strip() for d in params.get("destinations") or []]
+    if not origins or not destinations:
+        raise ValueError("origins and destinations are required")
+    if len(origins) * len(destinations) > MAX_MATRIX_CELLS:
+        raise ValueError(f"at most {MAX_MATRIX_CELLS} origin/destination pairs per call")
+    if graph is None:
+        raise RuntimeError("maps.distance_matrix needs an offline road graph (MAPS_GRAPH_DIR)")
+    out: Dict[str, Any] = {"origins": origins, "destinations": destinations}
+    out.update(graph.matrix(origins, destinations))
+    out["engine"] = "offline"
+    return out
+
+
 METHODS = {
     "mcp.list_tools": lambda p: list_tools(),
     "maps.route_with_static_map": maps_route_with_static_map,
+    "maps.distance_matrix": maps_distance_matrix,
 }
 
 
 def main():
-    for line in sys.stdin:
-        line = line.strip()
-        if not line:
-            continue
-        try:
-            req = json.loads(line)
-        except Exception as e:  # noqa: BLE001
-            _write({
-                "jsonrpc": "2.0",
-                "id": None,
-                "error": {"code": -32700, "message": "Parse error", "data": str(e)},
-            })
-            continue
-        id_ = req.get("id")
-        method = req.get("method")
-        params = req.get("params", {})
-        if method not in METHODS:
-            _err(id_, -32601, f"Method not found: {method}")
-            continue
-        try:
-            result = METHODS[method](params)
-            _ok(id_, result)
-        except Exception as e:  # noqa: BLE001
-            _err(id_, -32000, "Server error", {"message": str(e)})
+    serve(METHODS)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,456 @@
+"""Offline road routing for the Maps mock.
+
+A graph directory holds:
+
+- ``nodes.csv``: ``node_id,lat,lon``
+- ``edges.csv``: ``from,to,length_m,speed_kmh,oneway`` (``oneway`` 1/0)
+- ``places.csv`` (optional): ``name,lat,lon`` gazetteer for geocoding
+  hospital/hotel names and postcodes.
+
+``python mcp/mcp-maps/routing.py build-osm extract.osm <dir>`` writes the
+first two from an OpenStreetMap XML extract (drivable ``highway`` ways, speed
+from ``maxspeed`` or the road class).
+
+The graph is held as CSR arrays (per-node offsets into flat target / length
+/ travel-time arrays). :meth:`RoadGraph.route` snaps both ends to the nearest
+node through a lat/lon grid and runs A* on travel time, with straight-line
+distance at the graph's top speed as the heuristic. Snapped nodes (per
+place string) and finished routes (per node pair) are kept in LRU caches, so
+a repeated origin/destination pair costs two dict lookups.
+:meth:`RoadGraph.matrix` runs one resumable Dijkstra per origin instead and
+keeps those search trees in their own LRU cache.
+"""
+
+import csv
+import math
+import os
+import re
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from heapq import heappop, heappush
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+EARTH_RADIUS_M = 6371008.8
+
+# km/h by OSM highway class; *_link roads use their parent's speed.
+HIGHWAY_SPEEDS_KMH: Dict[str, float] = {
+    "motorway": 100,
+    "trunk": 80,
+    "primary": 60,
+    "secondary": 50,
+    "tertiary": 50,
+    "unclassified": 40,
+    "residential": 40,
+    "service": 20,
+    "living_street": 10,
+}
+
+_LAT_LON = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$")
+_POSTCODE = re.compile(r"\b(\d{4})\b")
+_WORD = re.compile(r"[a-z0-9]+")
+
+Point = Tuple[float, float]
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def encode_polyline(points: Iterable[Point], precision: int = 5) -> str:
+    """Google encoded polyline for ``(lat, lon)`` points."""
+    factor = 10 ** precision
+    out: List[str] = []
+    prev_lat = prev_lon = 0
+    for lat, lon in points:
+        ilat, ilon = int(round(lat * factor)), int(round(lon * factor))
+        for delta in (ilat - prev_lat, ilon - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        prev_lat, prev_lon = ilat, ilon
+    return "".join(out)
+
+
+def _normalise(text: str) -> str:
+    return " ".join(_WORD.findall((text or "").lower().replace("'", "")))
+
+
+class _LRU:
+    def __init__(self, size: int):
+        self.size = size
+        self._data: "OrderedDict[Any, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Any, value: Any) -> None:
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class RoadGraph:
+    def __init__(self, cache_size: int = 1024, cell_deg: float = 0.01, tree_cache_size: int = 64):
+        self.cell_deg = cell_deg
+        self.lat = array("d")
+        self.lon = array("d")
+        self.offsets = array("l", [0])
+        self.targets = array("l")
+        self.lengths = array("d")
+        self.seconds = array("d")
+        self.max_speed_mps = 1.0
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        self._places: Dict[str, Point] = {}
+        self._x = array("d")
+        self._y = array("d")
+        self.routes = _LRU(cache_size)
+        self.geocodes = _LRU(cache_size)
+        self.trees = _LRU(tree_cache_size)
+
+    @classmethod
+    def from_env(cls) -> Optional["RoadGraph"]:
+        directory = os.getenv("MAPS_GRAPH_DIR")
+        if not directory:
+            return None
+        graph = cls(
+            cache_size=int(os.getenv("MAPS_ROUTE_CACHE_SIZE", "1024")),
+            tree_cache_size=int(os.getenv("MAPS_TREE_CACHE_SIZE", "64")),
+        )
+        graph.load(directory)
+        return graph
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    # -- loading -----------------------------------------------------------
+
+    def load(self, directory: str) -> None:
+        ids: Dict[str, int] = {}
+        with open(os.path.join(directory, "nodes.csv"), newline="", encoding="utf-8") as fh:
+            for row in csv.DictReader(fh):
+                ids[row["node_id"]] = len(self.lat)
+                self.lat.append(float(row["lat"]))
+                self.lon.append(float(row["lon"]))
+        # Counting sort of directed edges by source into CSR arrays.
+        edges: List[Tuple[int, int, float, float]] = []
+        with open(os.path.join(directory, "edges.csv"), newline="", encoding="utf-8") as fh:
+            for row in csv.DictReader(fh):
+                a, b = ids.get(row["from"]), ids.get(row["to"])
+                if a is None or b is None:
+                    continue
+                length = float(row.get("length_m") or 0) or haversine_m(self.lat[a], self.lon[a], self.lat[b], self.lon[b])
+                speed = float(row.get("speed_kmh") or 40)
+                edges.append((a, b, length, speed))
+                if str(row.get("oneway") or "0") not in ("1", "true", "yes"):
+                    edges.append((b, a, length, speed))
+        counts = [0] * (len(self.lat) + 1)
+        for a, _, _, _ in edges:
+            counts[a + 1] += 1
+        for i in range(len(self.lat)):
+            counts[i + 1] += counts[i]
+        self.offsets = array("l", counts)
+        fill = list(counts[:-1])
+        self.targets = array("l", [0]) * len(edges)
+        self.lengths = array("d", [0.0]) * len(edges)
+        self.seconds = array("d", [0.0]) * len(edges)
+        for a, b, length, speed in edges:
+            slot = fill[a]
+            fill[a] += 1
+            self.targets[slot] = b
+            self.lengths[slot] = length
+            self.seconds[slot] = length / (speed / 3.6)
+            self.max_speed_mps = max(self.max_speed_mps, speed / 3.6)
+        for node in range(len(self.lat)):
+            if self.offsets[node + 1] > self.offsets[node]:
+                self._grid.setdefault(self._cell(self.lat[node], self.lon[node]), []).append(node)
+        self._project()
+        places = os.path.join(directory, "places.csv")
+        if os.path.exists(places):
+            with open(places, newline="", encoding="utf-8") as fh:
+                for row in csv.DictReader(fh):
+                    self._places[_normalise(row["name"])] = (float(row["lat"]), float(row["lon"]))
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    # -- geocoding ---------------------------------------------------------
+
+    def geocode(self, text: str) -> Optional[Point]:
+        """``"lat,lon"``, a gazetteer name (exact, then best word overlap) or a postcode in it."""
+        key = _normalise(text)
+        point: Optional[Point] = None
+        match = _LAT_LON.match(text or "")
+        if match:
+            point = (float(match.group(1)), float(match.group(2)))
+        elif key in self._places:
+            point = self._places[key]
+        else:
+            words = set(key.split())
+            best, best_score = None, 0.0
+            for name, coords in self._places.items():
+                name_words = set(name.split())
+                # Every word of the place name must appear in the query.
+                if name_words and name_words <= words and len(name_words) > best_score:
+                    best, best_score = coords, float(len(name_words))
+            point = best
+            if point is None:
+                postcode = _POSTCODE.search(text or "")
+                if postcode:
+                    point = self._places.get(postcode.group(1))
+        return point
+
+    def nearest_node(self, lat: float, lon: float, max_rings: int = 20) -> Optional[int]:
+        cy, cx = self._cell(lat, lon)
+        best, best_d = None, float("inf")
+        for ring in range(max_rings + 1):
+            # Ring r is at least (r - 1) cells away.
+            if best is not None and (ring - 1) * self.cell_deg * 111320 * math.cos(math.radians(lat)) > best_d:
+                break
+            for dy in range(-ring, ring + 1):
+                step = 1 if abs(dy) == ring else 2 * ring
+                for dx in range(-ring, ring + 1, max(1, step)):
+                    for node in self._grid.get((cy + dy, cx + dx), ()):
+                        d = haversine_m(lat, lon, self.lat[node], self.lon[node])
+                        if d < best_d:
+                            best, best_d = node, d
+        return best
+
+    # -- routing -----------------------------------------------------------
+
+    def _project(self) -> None:
+        # Equirectangular metres around the graph's mean latitude, for a
+        # cheap A* heuristic (scaled down a little so it never overestimates).
+        mean = sum(self.lat) / len(self.lat) if len(self.lat) else 0.0
+        kx = math.radians(1) * EARTH_RADIUS_M * math.cos(math.radians(mean))
+        ky = math.radians(1) * EARTH_RADIUS_M
+        self._x = array("d", (lon * kx for lon in self.lon))
+        self._y = array("d", (lat * ky for lat in self.lat))
+
+    def shortest_path(self, source: int, target: int) -> Optional[Tuple[List[int], float, float]]:
+        """A* on travel time: ``(nodes, metres, seconds)`` or None if unreachable."""
+        offsets, targets, seconds = self.offsets, self.targets, self.seconds
+        xs, ys = self._x, self._y
+        tx, ty = xs[target], ys[target]
+        scale = 0.99 / self.max_speed_mps
+        hypot = math.hypot
+        best = {source: 0.0}
+        parent: Dict[int, int] = {source: -1}
+        via: Dict[int, int] = {}
+        heap = [(hypot(xs[source] - tx, ys[source] - ty) * scale, 0.0, source)]
+        while heap:
+            _, g, node = heappop(heap)
+            if node == target:
+                break
+            if g > best[node]:
+                continue  # stale entry
+            for slot in range(offsets[node], offsets[node + 1]):
+                nxt = targets[slot]
+                cost = g + seconds[slot]
+                if cost < best.get(nxt, math.inf):
+                    best[nxt] = cost
+                    parent[nxt] = node
+                    via[nxt] = slot
+                    heappush(heap, (cost + hypot(xs[nxt] - tx, ys[nxt] - ty) * scale, cost, nxt))
+        if target not in parent:
+            return None
+        path, metres = [target], 0.0
+        node = target
+        while parent[node] != -1:
+            metres += self.lengths[via[node]]
+            node = parent[node]
+            path.append(node)
+        path.reverse()
+        return path, metres, best[target]
+
+    def tree(self, source: int) -> "SearchTree":
+        """The cached one-to-many search tree rooted at ``source``."""
+        tree = self.trees.get(source)
+        if tree is None:
+            tree = SearchTree(self, source)
+            self.trees.put(source, tree)
+        return tree
+
+    def matrix(self, origins: List[str], destinations: List[str]) -> Dict[str, Any]:
+        """Travel time and distance from every origin to every destination.
+
+        Each origin runs one Dijkstra that stops once all destinations are
+        settled; its tree is cached and resumed by later calls, so a repeat
+        cohort (or a new destination the tree already reached) costs only
+        lookups. Cells are None where a place can't be located or reached.
+        """
+        sources = [self.locate(o) for o in origins]
+        targets = [self.locate(d) for d in destinations]
+        wanted = {t for t in targets if t is not None}
+        durations: List[List[Optional[int]]] = []
+        distances: List[List[Optional[int]]] = []
+        for source in sources:
+            if source is None:
+                durations.append([None] * len(targets))
+                distances.append([None] * len(targets))
+                continue
+            reached = self.tree(source).settle(wanted)
+            row = [reached.get(t) if t is not None else None for t in targets]
+            durations.append([round(c[0]) if c else None for c in row])
+            distances.append([round(c[1]) if c else None for c in row])
+        return {"duration_s": durations, "distance_m": distances}
+
+    def locate(self, text: str) -> Optional[int]:
+        """The graph node nearest to where ``text`` geocodes, cached per text.
+
+        ``"lat,lon"`` input is keyed on the parsed, rounded coordinates (so
+        signs count); only gazetteer names are keyed on their normalised form.
+        """
+        match = _LAT_LON.match(text or "")
+        if match:
+            key: Any = (round(float(match.group(1)), 6), round(float(match.group(2)), 6))
+        else:
+            key = _normalise(text) or (text or "").strip()
+        cached = self.geocodes.get(key)
+        if cached is not None:
+            return cached
+        point = self.geocode(text)
+        node = self.nearest_node(*point) if point is not None else None
+        if node is not None:
+            self.geocodes.put(key, node)
+        return node
+
+    def route(self, origin: str, destination: str) -> Optional[Dict[str, Any]]:
+        """Distance, duration and polyline between two place strings, or None if either can't be placed."""
+        source, target = self.locate(origin), self.locate(destination)
+        if source is None or target is None:
+            return None
+        cached = self.routes.get((source, target))
+        if cached is not None:
+            return dict(cached)
+        found = self.shortest_path(source, target)
+        if found is None:
+            return None
+        path, metres, seconds = found
+        result = {
+            "distance_m": round(metres),
+            "duration_s": round(seconds),
+            "polyline": encode_polyline((self.lat[n], self.lon[n]) for n in path),
+            "nodes": len(path),
+        }
+        self.routes.put((source, target), result)
+        return dict(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "nodes": len(self.lat),
+            "edges": len(self.targets),
+            "places": len(self._places),
+            "route_cache": {"entries": len(self.routes), "hits": self.routes.hits, "misses": self.routes.misses},
+            "geocode_cache": {"entries": len(self.geocodes), "hits": self.geocodes.hits, "misses": self.geocodes.misses},
+            "tree_cache": {"entries": len(self.trees), "hits": self.trees.hits, "misses": self.trees.misses},
+        }
+
+
+class SearchTree:
+    """A resumable one-to-many Dijkstra (travel time) from one source node.
+
+    ``settled`` maps each node whose shortest path is final to ``(seconds,
+    metres)``; the heap keeps the frontier, so :meth:`settle` picks up where
+    the last call stopped instead of starting over.
+    """
+
+    def __init__(self, graph: RoadGraph, source: int):
+        self.graph = graph
+        self.settled: Dict[int, Tuple[float, float]] = {}
+        self._best = {source: 0.0}
+        self._heap: List[Tuple[float, float, int]] = [(0.0, 0.0, source)]
+        self._lock = threading.Lock()
+
+    def settle(self, targets: Iterable[int]) -> Dict[int, Tuple[float, float]]:
+        """Grow the tree until every target is settled (or unreachable)."""
+        with self._lock:
+            missing = {t for t in targets if t not in self.settled}
+            offsets, nodes, seconds, lengths = self.graph.offsets, self.graph.targets, self.graph.seconds, self.graph.lengths
+            settled, best, heap = self.settled, self._best, self._heap
+            while missing and heap:
+                cost, metres, node = heappop(heap)
+                if node in settled:
+                    continue
+                settled[node] = (cost, metres)
+                missing.discard(node)
+                for slot in range(offsets[node], offsets[node + 1]):
+                    nxt = nodes[slot]
+                    nxt_cost = cost + seconds[slot]
+                    if nxt not in settled and nxt_cost < best.get(nxt, math.inf):
+                        best[nxt] = nxt_cost
+                        heappush(heap, (nxt_cost, metres + lengths[slot], nxt))
+            return settled
+
+
+def build_from_osm(osm_path: str, out_dir: str) -> Tuple[int, int]:
+    """Convert an OSM XML extract into nodes.csv/edges.csv; returns (nodes, edges)."""
+    import xml.etree.ElementTree as ET
+
+    coords: Dict[str, Point] = {}
+    ways: List[Tuple[List[str], float, bool]] = []
+    for _, elem in ET.iterparse(osm_path, events=("end",)):
+        if elem.tag == "node":
+            coords[elem.get("id", "")] = (float(elem.get("lat", 0)), float(elem.get("lon", 0)))
+            elem.clear()
+        elif elem.tag == "way":
+            tags = {t.get("k"): t.get("v") for t in elem.findall("tag")}
+            highway = (tags.get("highway") or "").replace("_link", "")
+            if highway in HIGHWAY_SPEEDS_KMH:
+                speed = HIGHWAY_SPEEDS_KMH[highway]
+                maxspeed = re.match(r"\d+", tags.get("maxspeed") or "")
+                if maxspeed:
+                    speed = float(maxspeed.group(0))
+                oneway = tags.get("oneway") in ("yes", "1", "true") or highway == "motorway"
+                ways.append(([nd.get("ref", "") for nd in elem.findall("nd")], speed, oneway))
+            elem.clear()
+    os.makedirs(out_dir, exist_ok=True)
+    used = set()
+    edges = 0
+    with open(os.path.join(out_dir, "edges.csv"), "w", newline="", encoding="utf-8") as fh:
+        w = csv.writer(fh)
+        w.writerow(["from", "to", "length_m", "speed_kmh", "oneway"])
+        for refs, speed, oneway in ways:
+            for a, b in zip(refs, refs[1:]):
+                if a not in coords or b not in coords:
+                    continue
+                length = haversine_m(*coords[a], *coords[b])
+                w.writerow([a, b, round(length, 1), speed, 1 if oneway else 0])
+                used.update((a, b))
+                edges += 1
+    with open(os.path.join(out_dir, "nodes.csv"), "w", newline="", encoding="utf-8") as fh:
+        w = csv.writer(fh)
+        w.writerow(["node_id", "lat", "lon"])
+        for node in used:
+            w.writerow([node, *coords[node]])
+    return len(used), edges
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "build-osm":
+        sys.exit("usage: routing.py build-osm <extract.osm> <out_dir>")
+    n, e = build_from_osm(sys.argv[2], sys.argv[3])
+    print(f"{n} nodes, {e} edges written to {sys.argv[3]}")
@@ -0,0 +1,78 @@
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "mcp", "mcp-maps"))
+
+from routing import RoadGraph  # noqa: E402
+
+
+def _write_graph(path):
+    # A-B-C along a slow street, plus a fast A-D-C bypass.
+    (path / "nodes.csv").write_text(
+        "node_id,lat,lon\n"
+        "a,-33.880,151.200\n"
+        "b,-33.880,151.210\n"
+        "c,-33.880,151.220\n"
+        "d,-33.870,151.210\n"
+    )
+    (path / "edges.csv").write_text(
+        "from,to,length_m,speed_kmh,oneway\n"
+        "a,b,1000,20,0\n"
+        "b,c,1000,20,0\n"
+        "a,d,1500,80,0\n"
+        "d,c,1500,80,1\n"
+    )
+    (path / "places.csv").write_text("name,lat,lon\nRoyal Prince Alfred Hospital,-33.8801,151.2001\n")
+
+
+def test_route_prefers_faster_path_and_caches_pairs(tmp_path):
+    _write_graph(tmp_path)
+    graph = RoadGraph(cache_size=8)
+    graph.load(str(tmp_path))
+
+    route = graph.route("Royal Prince Alfred Hospital, Camperdown", "-33.880,151.220")
+    assert route["distance_m"] == 3000
+    assert route["duration_s"] == 135
+    assert route["nodes"] == 3
+    assert route["polyline"]
+
+    # The bypass is one-way, so the way back takes the slow street.
+    back = graph.route("-33.880,151.220", "Royal Prince Alfred Hospital")
+    assert back["distance_m"] == 2000
+    assert back["duration_s"] == 360
+
+    assert graph.route("Royal Prince Alfred Hospital, Camperdown", "-33.880,151.220") == route
+    assert graph.stats()["route_cache"]["hits"] == 1
+    assert graph.route("Nowhere In Particular", "-33.880,151.220") is None
+
+
+def test_distance_matrix_matches_routes_and_reuses_trees(tmp_path):
+    _write_graph(tmp_path)
+    graph = RoadGraph()
+    graph.load(str(tmp_path))
+    origins = ["Royal Prince Alfred Hospital", "-33.880,151.220"]
+    destinations = ["-33.880,151.220", "-33.870,151.210", "Atlantis"]
+
+    matrix = graph.matrix(origins, destinations)
+    assert matrix["distance_m"] == [[3000, 1500, None], [0, 3500, None]]
+    assert matrix["duration_s"][0][:2] == [graph.route(origins[0], destinations[0])["duration_s"], 68]
+    assert matrix["duration_s"][1][:2] == [0, graph.route(origins[1], destinations[1])["duration_s"]]
+
+    assert graph.matrix(origins, destinations) == matrix
+    assert graph.stats()["tree_cache"]["hits"] == 2
+
+
+def test_locate_keys_coordinates_on_their_signed_values(tmp_path):
+    _write_graph(tmp_path)
+    graph = RoadGraph()
+    graph.load(str(tmp_path))
+
+    node = graph.locate("-33.880,151.220")
+    assert node is not None
+    assert graph.locate(" -33.88 , 151.22 ") == node
+    # Same digits with the signs moved must not come back from the cache.
+    assert graph.locate("33.880,151.220") is None
+    assert graph.locate("-33.880,-151.220") is None
+    assert graph.locate("-33.880,151.200") != node
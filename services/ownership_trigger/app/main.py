@@ -1,11 +1,15 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+import asyncio
 import os
 import csv
 import time
 import json
 import random
+import threading
+from contextlib import contextmanager
 from typing import Optional, List
 
 try:
@@ -24,9 +28,28 @@ try:
 except ImportError:  # pragma: no cover - fallback for uvicorn --app-dir usage
     from agentis_demo import run_demo as agentis_run_demo
     from agentis_demo import run_referral_demo as agentis_run_referral
+from libs.agentis import context_cache
 from libs.agentis.tools.policy import check_consent
 from libs.agentis.llm_client import LLMClient
-from libs.common.mcp_client import make_epic_client, make_hca_client, make_coo_client, make_maps_client
+from libs.agentis.tools.directory import provider_batcher
+from libs.agentis.tools.epic import bundle_ids, make_bundle
+from libs.common import metrics, tracing
+from libs.common.ids import new_id
+from libs.common.mcp_client import (
+    make_epic_client,
+    make_async_epic_client,
+    make_async_hca_client,
+    make_async_coo_client,
+    make_async_maps_client,
+    async_client_stats,
+    cache_stats,
+    MCPError,
+    pool_stats,
+    shutdown_async_clients,
+    shutdown_pools,
+)
+
+tracing.configure(service_name=os.getenv("OTEL_SERVICE_NAME", "ownership-trigger"))
 
 app = FastAPI(title="Ownership Trigger Agent")
 app.add_middleware(
@@ -37,6 +60,45 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route", "status")
+)
+HD_STEP_SECONDS = metrics.histogram(
+    "hd_step_phase_seconds", "Hospital-discharge step time by phase (context, csv, llm)", ("step", "phase")
+)
+
+
+@app.middleware("http")
+async def _record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    # One server span per request; an incoming traceparent header joins the
+    # caller's trace, and MCP/LLM calls made while handling it become children.
+    with tracing.start_span(
+        f"{request.method} {request.url.path}",
+        {"http.method": request.method, "http.target": request.url.path},
+        tracing.KIND_SERVER,
+        request.headers.get("traceparent"),
+    ) as span:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            # Label by route template (e.g. /demo/hd-step3), not raw path, to keep
+            # the series count bounded.
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            span.set_attribute("http.route", route)
+            span.set_attribute("http.status_code", status)
+            HTTP_REQUEST_SECONDS.labels(request.method, route, str(status)).observe(time.perf_counter() - started)
+
+
+@contextmanager
+def _hd_phase(step: str, phase: str):
+    """Time one phase of an HD step as both a metric and a trace span."""
+    with tracing.start_span(f"hd.{phase}", {"hd.step": step}), HD_STEP_SECONDS.labels(step, phase).time():
+        yield
+
 
 class DischargeDemoResponse(BaseModel):
     discharge_event: dict
@@ -44,11 +106,34 @@ class DischargeDemoResponse(BaseModel):
     providers: dict
 
 
+@app.on_event("shutdown")
+async def _shutdown_mcp_clients():
+    # Pooled and async MCP mock servers are long-lived children; stop them
+    # with the app.
+    await shutdown_async_clients()
+    shutdown_pools()
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/mcp/pools")
+def mcp_pools():
+    return {
+        "pools": pool_stats(),
+        "async_clients": async_client_stats(),
+        "caches": cache_stats(),
+        "hd_context": _hd_context_cache.stats() if _hd_context_cache is not None else None,
+    }
+
+
 @app.get("/llm-info")
 def llm_info():
     client = LLMClient()
@@ -62,6 +147,30 @@ def llm_info():
 # Resolve project root (one level above 'services') so CSV/context paths are correct
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
 
+# Deadline (seconds) for the MCP context fetch in each hospital-discharge step.
+# Context is best-effort, so a slow or wedged mock should cost the step at most
+# this long before it carries on with whatever arrived.
+HD_CONTEXT_TIMEOUT_S = float(os.getenv("HD_CONTEXT_TIMEOUT_S", "5"))
+
+# Per-patient Epic context reused across HD steps and kept current from the
+# Epic change feed (see libs/agentis/context_cache.py); built on first use.
+_hd_context_cache: Optional[context_cache.PatientContextCache] = None
+_hd_context_cache_ready = False
+_hd_context_cache_lock = threading.Lock()
+
+
+def _get_hd_context_cache() -> Optional[context_cache.PatientContextCache]:
+    global _hd_context_cache, _hd_context_cache_ready
+    if _hd_context_cache_ready:
+        return _hd_context_cache
+    # Threadpool requests may race here; only one may build the cache and
+    # subscribe its push client.
+    with _hd_context_cache_lock:
+        if not _hd_context_cache_ready:
+            _hd_context_cache = context_cache.from_env()
+            _hd_context_cache_ready = True
+    return _hd_context_cache
+
 
 @app.get("/patients")
 def list_patients():
@@ -91,24 +200,24 @@ class DischargeRequest(BaseModel):
 
 
 @app.post("/demo/discharge", response_model=DischargeDemoResponse)
-def demo_discharge(req: DischargeRequest):
-    epic = make_epic_client()
-    hca = make_hca_client()
+async def demo_discharge(req: DischargeRequest):
+    epic = make_async_epic_client()
+    hca = make_async_hca_client()
     selected_patient = req.patient_id or "123"
 
     # Get mock discharge event and patient bundle
-    evt = epic.call("epic.discharge_event.get", {})
+    evt = await epic.call("epic.discharge_event.get", {})
     # Overwrite event subject/data to reflect selected patient (mock supports a single default)
     if isinstance(evt, dict):
         evt.setdefault("data", {})
         evt["subject"] = f"Patient/{selected_patient}"
         evt["data"]["patientId"] = selected_patient
-    bundle = epic.call("epic.patient_bundle.get", {"patient_id": selected_patient})
+    bundle = await epic.call("epic.patient_bundle.get", {"patient_id": selected_patient})
 
     # Lookup providers (GP, Case Manager, Pharmacist) in postcode 2000
-    providers = hca.call(
-        "hca.directory.search_providers",
-        {"patient_id": selected_patient, "location": "2000", "roles": ["GP", "Case Manager", "Pharmacist"], "consent_context": {}},
+    # (concurrent requests share one batched directory call)
+    providers = await provider_batcher(hca).search(
+        selected_patient, "2000", ["GP", "Case Manager", "Pharmacist"], consent_context={}
     )
 
     return {
@@ -244,6 +353,7 @@ def followup_book(req: BookingRequest):
     epic = make_epic_client()
 
     created: list[dict] = []
+    tasks: list[dict] = []
 
     with open(appt_csv_path, "a", newline="") as fcsv:
         w = csv.writer(fcsv)
@@ -257,7 +367,7 @@ def followup_book(req: BookingRequest):
             already = key in existing
 
             if not already:
-                appt_id = f"FU-{pid}-{int(time.time())}-{len(created)}"
+                appt_id = new_id(f"FU-{pid}-")
                 w.writerow([
                     appt_id,
                     pid,
@@ -271,27 +381,14 @@ def followup_book(req: BookingRequest):
             else:
                 appt_id = None
 
-            # Optionally create a Task in Epic to mirror the booking
-            task_id = None
-            try:
-                desc = item.reason or f"Follow-up: {t}"
-                task_res = epic.call(
-                    "epic.fhir_write_back.create",
-                    {
-                        "resource_type": "Task",
-                        "resource_json": {
-                            "resourceType": "Task",
-                            "status": "requested",
-                            "intent": "order",
-                            "for": {"reference": f"Patient/{pid}"},
-                            "description": desc,
-                        },
-                    },
-                )
-                if isinstance(task_res, dict) and task_res.get("id"):
-                    task_id = task_res["id"]
-            except Exception:
-                pass
+            # Mirror the booking as a Task in Epic (all sent as one batch below)
+            tasks.append({
+                "resourceType": "Task",
+                "status": "requested",
+                "intent": "order",
+                "for": {"reference": f"Patient/{pid}"},
+                "description": item.reason or f"Follow-up: {t}",
+            })
 
             created.append(
                 {
@@ -300,11 +397,21 @@ def followup_book(req: BookingRequest):
                     "provider_id": prov_id,
                     "status": "CREATED" if not already else "ALREADY_SCHEDULED",
                     "appointment_id": appt_id,
-                    "task_id": task_id,
+                    "task_id": None,
                     "reason": item.reason,
                 }
             )
 
+    # A batch keeps each Task independent: one failing entry leaves the
+    # others (and the bookings) in place.
+    if tasks:
+        try:
+            resp = epic.call("epic.fhir_write_back.bundle", {"bundle": make_bundle(tasks, "batch")})
+            for appt, task_id in zip(created, bundle_ids(resp)):
+                appt["task_id"] = task_id
+        except Exception:
+            pass
+
     # Simple narrative summary for UI consumption
     created_count = sum(1 for a in created if a["status"] == "CREATED")
     already_count = sum(1 for a in created if a["status"] == "ALREADY_SCHEDULED")
@@ -356,7 +463,7 @@ class HdStepRequest(BaseModel):
     hotel_address: Optional[str] = None
 
 
-def _run_hd_step(req: HdStepRequest, step: str) -> dict:
+async def _run_hd_step(req: HdStepRequest, step: str) -> dict:
     """Execute a Hospital Discharge step via the configured LLM provider.
 
     The frontend passes patient + risk context and the active Prompt Studio
@@ -371,29 +478,81 @@ def _run_hd_step(req: HdStepRequest, step: str) -> dict:
 
     # Pull additional clinical context from MCP mocks so each step sees
     # realistic EMR-style data in addition to the UI payload.
-    epic = make_epic_client()
-    hca = make_hca_client()
+    epic = make_async_epic_client()
+    hca = make_async_hca_client()
     pid = req.patient_id or "123"
 
     mcp_context: dict = {"patient_id": pid, "step_id": step}
 
-    try:
-        # Shared baseline: discharge event + patient bundle
-        mcp_context["discharge_event"] = epic.call("epic.discharge_event.get", {"patient_id": pid})
-        mcp_context["patient_bundle"] = epic.call("epic.patient_bundle.get", {"patient_id": pid})
-    except Exception:
-        # Keep context best-effort; UI should still work if MCP mock is offline
-        pass
+    # Epic context for this step -- the shared baseline (discharge event +
+    # patient bundle) plus the step-specific query -- goes out as a single
+    # JSON-RPC batch, i.e. one round-trip, while the HCA directory lookup runs
+    # alongside it. Keep context best-effort; UI should still work if MCP
+    # mock is offline.
+    epic_calls: list[tuple[str, str, dict]] = [
+        ("discharge_event", "epic.discharge_event.get", {"patient_id": pid}),
+        ("patient_bundle", "epic.patient_bundle.get", {"patient_id": pid}),
+    ]
+    if step == "step2":  # medication reconciliation
+        epic_calls.append(("home_meds", "epic.search", {"resource_type": "MedicationRequest", "patient_id": pid}))
+    elif step == "step3":  # follow-up orchestration
+        epic_calls.append(("followup_observations", "epic.search", {"resource_type": "Observation", "patient_id": pid, "_sort": "-date", "_count": 50}))
+    elif step == "step4":  # GP & community handoff
+        epic_calls.append(("service_requests", "epic.search", {"resource_type": "ServiceRequest", "patient_id": pid}))
+    elif step == "step5":  # post-discharge monitoring
+        epic_calls.append(("care_plans", "epic.search", {"resource_type": "CarePlan", "patient_id": pid}))
+    elif step == "step6":  # outcomes / governance
+        # For demo purposes, reuse audit search as a governance signal
+        epic_calls.append(
+            ("audit", "epic.audit.search", {"actor_ref": "Agent/demo-client", "entity_ref": None, "action": None, "limit": 50})
+        )
+
+    async def _fetch_providers() -> dict | None:
+        # For some steps (handoff/referral), also show directory context from HCA MCP
+        if step not in {"step3", "step4"}:
+            return None
+        # Batched with any other step's lookup in flight (cohort runs).
+        return await provider_batcher(hca).search(
+            pid, "2000", ["GP", "Case Manager", "Pharmacist"], timeout=HD_CONTEXT_TIMEOUT_S, consent_context={}
+        )
+
+    calls = [(method, params) for _, method, params in epic_calls]
+    ctx_cache = await run_in_threadpool(_get_hd_context_cache)
+    with _hd_phase(step, "context"):
+        epic_results, providers = await asyncio.gather(
+            ctx_cache.fetch(epic, pid, calls, timeout=HD_CONTEXT_TIMEOUT_S)
+            if ctx_cache is not None
+            else epic.call_batch(calls, timeout=HD_CONTEXT_TIMEOUT_S),
+            _fetch_providers(),
+            return_exceptions=True,
+        )
+    epic_ctx: dict = {}
+    if not isinstance(epic_results, BaseException):
+        epic_ctx = {
+            key: res
+            for (key, _, _), res in zip(epic_calls, epic_results)
+            if not isinstance(res, MCPError)
+        }
+    for key in ("discharge_event", "patient_bundle"):
+        if key in epic_ctx:
+            mcp_context[key] = epic_ctx.pop(key)
 
     # Also surface core EMR CSV slices so every step can see the same
     # underlying mock EMR snapshot for the selected patient. In addition to a
     # fixed set of core files, we attach any other CSVs that contain a
     # PATIENT_ID column so the LLM can see as much EMR context as possible.
-    try:
+    # The scan is blocking file I/O, so it runs in the threadpool.
+    def _load_csv_context() -> dict:
         csv_ctx: dict = {}
         csv_dir = os.path.join(BASE_DIR, "data", "csv")
 
         def _load_csv(name: str, patient_key: str = "PATIENT_ID") -> list[dict]:
+            with tracing.start_span("csv.load", {"csv.file": name}) as span:
+                rows = _read_csv(name, patient_key)
+                span.set_attribute("csv.rows", len(rows))
+                return rows
+
+        def _read_csv(name: str, patient_key: str) -> list[dict]:
             rows: list[dict] = []
             path = os.path.join(csv_dir, name)
             if not os.path.exists(path):
@@ -446,53 +605,35 @@ def _run_hd_step(req: HdStepRequest, step: str) -> dict:
             # Best-effort only for additional CSVs
             pass
 
-        mcp_context["csv"] = csv_ctx
-    except Exception:
-        # Best-effort only; if any CSVs are missing the step still runs on MCP mocks
-        pass
+        return csv_ctx
 
     try:
-        # Step-specific mock MCP data
-        if step == "step2":  # medication reconciliation
-            mcp_context["home_meds"] = epic.call("epic.search", {"resource_type": "MedicationRequest", "patient_id": pid})
-            # Also surface CSV-backed meds so the LLM always sees medications
-            # for demo patients like P0001/2/5 even if the Epic fixtures differ.
-            try:
-                meds_path = os.path.join(BASE_DIR, "data", "csv", "EMR_Medications.csv")
-                rows: list[dict] = []
-                with open(meds_path, newline="") as f:
-                    rdr = csv.DictReader(f)
-                    for r in rdr:
-                        if r.get("PATIENT_ID") == pid:
-                            rows.append(r)
-                mcp_context["home_meds_csv"] = rows
-            except Exception:
-                # Best-effort: if CSV missing or unreadable, continue with mock data only
-                pass
-        elif step == "step3":  # follow-up orchestration
-            mcp_context["followup_observations"] = epic.call("epic.search", {"resource_type": "Observation", "patient_id": pid})
-        elif step == "step4":  # GP & community handoff
-            mcp_context["service_requests"] = epic.call("epic.search", {"resource_type": "ServiceRequest", "patient_id": pid})
-        elif step == "step5":  # post-discharge monitoring
-            mcp_context["care_plans"] = epic.call("epic.search", {"resource_type": "CarePlan", "patient_id": pid})
-        elif step == "step6":  # outcomes / governance
-            # For demo purposes, reuse audit search as a governance signal
-            mcp_context["audit"] = epic.call(
-                "epic.audit.search",
-                {"actor_ref": "Agent/demo-client", "entity_ref": None, "action": None},
-            )
+        with _hd_phase(step, "csv"):
+            mcp_context["csv"] = await run_in_threadpool(_load_csv_context)
     except Exception:
+        # Best-effort only; if any CSVs are missing the step still runs on MCP mocks
         pass
 
-    try:
-        # For some steps (handoff/referral), also show directory context from HCA MCP
-        if step in {"step3", "step4"}:
-            mcp_context["providers"] = hca.call(
-                "hca.directory.search_providers",
-                {"patient_id": pid, "location": "2000", "roles": ["GP", "Case Manager", "Pharmacist"], "consent_context": {}},
-            )
-    except Exception:
-        pass
+    # Step-specific mock MCP data
+    mcp_context.update(epic_ctx)
+    if step == "step2":
+        # Also surface CSV-backed meds so the LLM always sees medications
+        # for demo patients like P0001/2/5 even if the Epic fixtures differ.
+        try:
+            meds_path = os.path.join(BASE_DIR, "data", "csv", "EMR_Medications.csv")
+            rows: list[dict] = []
+            with open(meds_path, newline="") as f:
+                rdr = csv.DictReader(f)
+                for r in rdr:
+                    if r.get("PATIENT_ID") == pid:
+                        rows.append(r)
+            mcp_context["home_meds_csv"] = rows
+        except Exception:
+            # Best-effort: if CSV missing or unreadable, continue with mock data only
+            pass
+
+    if providers is not None and not isinstance(providers, BaseException):
+        mcp_context["providers"] = providers
 
     # Build a compact context block for the user message
     ctx = {
@@ -521,6 +662,11 @@ def _run_hd_step(req: HdStepRequest, step: str) -> dict:
         json.dumps(ctx, indent=2)
     )
 
+    async def _complete(schema: dict | None) -> dict:
+        # LLMClient is blocking; keep it off the event loop.
+        with _hd_phase(step, "llm"):
+            return await run_in_threadpool(client.complete, system=system, user=user, tools=None, schema=schema)
+
     # Step 1 (discharge readiness & risk) uses a structured JSON schema so we
     # get a predictable risk band, discharge bundle, and reasoning.
     if step == "step1":
@@ -548,7 +694,7 @@ def _run_hd_step(req: HdStepRequest, step: str) -> dict:
             "additionalProperties": True,
         }
 
-        out = client.complete(system=system, user=user, tools=None, schema=readiness_schema)
+        out = await _complete(readiness_schema)
         body = out.get("json") or {}
         if not body:
             body = {"raw_text": out.get("text", ""), "model": out.get("model")}
@@ -624,7 +770,7 @@ def _run_hd_step(req: HdStepRequest, step: str) -> dict:
             "additionalProperties": True,
         }
 
-        out = client.complete(system=system, user=user, tools=None, schema=med_schema)
+        out = await _complete(med_schema)
         body = out.get("json") or {}
         if not body:
             body = {"raw_text": out.get("text", ""), "model": out.get("model")}
@@ -812,7 +958,7 @@ def _run_hd_step(req: HdStepRequest, step: str) -> dict:
             "additionalProperties": True,
         }
 
-        out = client.complete(system=system, user=user, tools=None, schema=followup_schema)
+        out = await _complete(followup_schema)
         plan = out.get("json") or {}
         if not plan:
             # Fallback if schema-based parsing failed
@@ -914,24 +1060,30 @@ def _run_hd_step(req: HdStepRequest, step: str) -> dict:
         # For any follow-ups that remain MISSING after normalisation (i.e. they
         # are required by the LLM but not present in FOLLOW_UP_APPOINTMENTS),
         # create a Task via Epic MCP so every required booking is acted on.
-        for fup in required_followups:
-            if str(fup.get("status", "")).upper() != "MISSING":
-                continue
-            desc = fup.get("reason") or f"Follow-up: {fup.get('type','appointment')}"
-            task_res = epic.call(
-                "epic.fhir_write_back.create",
-                {
-                    "resource_type": "Task",
-                    "resource_json": {
-                        "resourceType": "Task",
-                        "status": "requested",
-                        "intent": "order",
-                        "for": {"reference": f"Patient/{pid}"},
-                        "description": desc,
-                    },
-                },
-            )
+        # All Tasks go in one transaction Bundle: one round-trip per step.
+        missing = [f for f in required_followups if str(f.get("status", "")).upper() == "MISSING"]
+        tasks = [
+            {
+                "resourceType": "Task",
+                "status": "requested",
+                "intent": "order",
+                "for": {"reference": f"Patient/{pid}"},
+                "description": fup.get("reason") or f"Follow-up: {fup.get('type','appointment')}",
+            }
+            for fup in missing
+        ]
+        task_ids: list = []
+        if tasks:
+            tx = await epic.call("epic.fhir_write_back.bundle", {"bundle": make_bundle(tasks)})
+            task_ids = bundle_ids(tx)
+        for i, fup in enumerate(missing):
+            # A short or failed response leaves the follow-up MISSING with a
+            # failed Task result rather than silently dropping it.
+            task_id = task_ids[i] if i < len(task_ids) else None
+            task_res = {"id": task_id, "status": "created"} if task_id else {"status": "failed"}
             executed["tasks"].append({"input": fup, "result": task_res})
+            if not task_id:
+                continue
 
             # Reflect execution back into the follow-up object so the JSON and
             # UI can treat it as created/requested via Task for this run. CSV-
@@ -943,8 +1095,7 @@ def _run_hd_step(req: HdStepRequest, step: str) -> dict:
             # (/demo/followups/book).
             try:
                 fup["status"] = "CREATED"
-                if isinstance(task_res, dict) and task_res.get("id"):
-                    fup["task_id"] = task_res["id"]
+                fup["task_id"] = task_id
             except Exception:
                 pass
 
@@ -1004,7 +1155,7 @@ def _run_hd_step(req: HdStepRequest, step: str) -> dict:
             "additionalProperties": True,
         }
 
-        out = client.complete(system=system, user=user, tools=None, schema=handoff_schema)
+        out = await _complete(handoff_schema)
         body = out.get("json") or {}
         if not body:
             body = {"raw_text": out.get("text", ""), "model": out.get("model")}
@@ -1062,7 +1213,7 @@ def _run_hd_step(req: HdStepRequest, step: str) -> dict:
             "additionalProperties": True,
         }
 
-        out = client.complete(system=system, user=user, tools=None, schema=monitoring_schema)
+        out = await _complete(monitoring_schema)
         body = out.get("json") or {}
         if not body:
             body = {"raw_text": out.get("text", ""), "model": out.get("model")}
@@ -1141,7 +1292,7 @@ def _run_hd_step(req: HdStepRequest, step: str) -> dict:
             "additionalProperties": True,
         }
 
-        out = client.complete(system=system, user=user, tools=None, schema=outcomes_schema)
+        out = await _complete(outcomes_schema)
         body = out.get("json") or {}
         if not body:
             body = {"raw_text": out.get("text", ""), "model": out.get("model")}
@@ -1166,7 +1317,7 @@ def _run_hd_step(req: HdStepRequest, step: str) -> dict:
         return data
 
     # Default behaviour for other steps: free-form JSON response
-    out = client.complete(system=system, user=user, tools=None, schema=None)
+    out = await _complete(None)
     data = out.get("json") or {}
     if not data:
         data = {"raw_text": out.get("text", ""), "model": out.get("model")}
@@ -1181,43 +1332,43 @@ def _run_hd_step(req: HdStepRequest, step: str) -> dict:
 
 
 @app.post("/demo/hd-step1")
-def demo_hd_step1(req: HdStepRequest):
-    return _run_hd_step(req, "step1")
+async def demo_hd_step1(req: HdStepRequest):
+    return await _run_hd_step(req, "step1")
 
 
 @app.post("/demo/hd-step2")
-def demo_hd_step2(req: HdStepRequest):
-    return _run_hd_step(req, "step2")
+async def demo_hd_step2(req: HdStepRequest):
+    return await _run_hd_step(req, "step2")
 
 
 @app.post("/demo/hd-step3")
-def demo_hd_step3(req: HdStepRequest):
-    return _run_hd_step(req, "step3")
+async def demo_hd_step3(req: HdStepRequest):
+    return await _run_hd_step(req, "step3")
 
 
 @app.post("/demo/hd-step4")
-def demo_hd_step4(req: HdStepRequest):
-    return _run_hd_step(req, "step4")
+async def demo_hd_step4(req: HdStepRequest):
+    return await _run_hd_step(req, "step4")
 
 
 @app.post("/demo/hd-step5")
-def demo_hd_step5(req: HdStepRequest):
-    return _run_hd_step(req, "step5")
+async def demo_hd_step5(req: HdStepRequest):
+    return await _run_hd_step(req, "step5")
 
 
 @app.post("/demo/hd-step6")
-def demo_hd_step6(req: HdStepRequest):
-    return _run_hd_step(req, "step6")
+async def demo_hd_step6(req: HdStepRequest):
+    return await _run_hd_step(req, "step6")
 
 
 @app.post("/demo/hd-step7")
-def demo_hd_step7(req: HdStepRequest):
+async def demo_hd_step7(req: HdStepRequest):
     """Hospital-to-hotel transport & map routing step.
 
     Reuses the generic _run_hd_step helper so the LLM prompt + schema
     come from the same discharge pipeline as steps 1–6.
     """
-    base = _run_hd_step(req, "step7")
+    base = await _run_hd_step(req, "step7")
 
     # Best-effort integration with a Google Maps MCP server. This expects
     # an MCP server command configured via MCP_MAPS_CMD and a tool
@@ -1228,8 +1379,8 @@ def demo_hd_step7(req: HdStepRequest):
     maps_route: dict | None = None
     if origin and destination:
         try:
-            maps = make_maps_client()
-            maps_route = maps.call(
+            maps = make_async_maps_client()
+            maps_route = await maps.call(
                 "maps.route_with_static_map",
                 {
                     "origin": origin,
@@ -1299,11 +1450,18 @@ def demo_hd_step7(req: HdStepRequest):
                         summary += " • " + str(src["notes"])
                     else:
                         summary = str(src["notes"])
-            return {
+            out = {
                 "label": label,
                 "map_url": murl,
                 "summary": summary,
             }
+            # An offline-routing Maps mock also returns the computed
+            # distance / duration / polyline; carry them through as-is.
+            if maps_route and isinstance(maps_route, dict):
+                for key in ("distance_m", "duration_s", "polyline"):
+                    if maps_route.get(key) is not None:
+                        out[key] = maps_route[key]
+            return out
 
         r_primary = _route_from(primary, "Primary route")
         if r_primary:
@@ -1433,11 +1591,19 @@ class ReferralRequest(BaseModel):
 
 
 @app.post("/demo/referral", response_model=ReferralDemoResponse)
-def demo_referral(req: ReferralRequest):
-    epic = make_epic_client()
+async def demo_referral(req: ReferralRequest):
+    epic = make_async_epic_client()
     pid = req.patient_id or "123"
-    # Search for ServiceRequest referrals for selected patient
-    referrals = epic.call("epic.search", {"resource_type": "ServiceRequest", "patient_id": pid})
+    # Search for ServiceRequest referrals for selected patient, with their
+    # performer and requester in the same response
+    referrals = await epic.call(
+        "epic.search",
+        {
+            "resource_type": "ServiceRequest",
+            "patient_id": pid,
+            "_include": ["ServiceRequest:performer", "ServiceRequest:requester"],
+        },
+    )
     created_task = {}
     if referrals.get("total", 0) > 0:
         first = referrals["entry"][0]["resource"]
@@ -1451,7 +1617,7 @@ def demo_referral(req: ReferralRequest):
             "owner": {"reference": "Practitioner/prov-002"},
             "description": "Follow up referral",
         }
-        created_task = epic.call("epic.fhir_write_back.create", {"resource_type": "Task", "resource_json": task_res})
+        created_task = await epic.call("epic.fhir_write_back.create", {"resource_type": "Task", "resource_json": task_res})
     return {"referrals": referrals, "created_task": created_task}
 
 
@@ -1531,9 +1697,9 @@ class CoOFlowResponse(BaseModel):
     output: dict
 
 
-def _coo_call(method: str, params: dict | None = None) -> CoOFlowResponse:
-    client = make_coo_client()
-    res = client.call(method, params or {})
+async def _coo_call(method: str, params: dict | None = None) -> CoOFlowResponse:
+    client = make_async_coo_client()
+    res = await client.call(method, params or {})
     # Normalise into a simple pydantic model
     return CoOFlowResponse(
         tool=res.get("tool", method),
@@ -1543,33 +1709,33 @@ def _coo_call(method: str, params: dict | None = None) -> CoOFlowResponse:
 
 
 @app.post("/coo/address-standardize", response_model=CoOFlowResponse)
-def coo_address_standardize_http():
-    return _coo_call("coo.address-standardize")
+async def coo_address_standardize_http():
+    return await _coo_call("coo.address-standardize")
 
 
 @app.post("/coo/ownership", response_model=CoOFlowResponse)
-def coo_ownership_http():
-    return _coo_call("coo.ownership")
+async def coo_ownership_http():
+    return await _coo_call("coo.ownership")
 
 
 @app.post("/coo/ownership-deterministic", response_model=CoOFlowResponse)
-def coo_ownership_deterministic_http():
-    return _coo_call("coo.ownership-deterministic")
+async def coo_ownership_deterministic_http():
+    return await _coo_call("coo.ownership-deterministic")
 
 
 @app.post("/coo/special-read", response_model=CoOFlowResponse)
-def coo_special_read_http():
-    return _coo_call("coo.special-read")
+async def coo_special_read_http():
+    return await _coo_call("coo.special-read")
 
 
 @app.post("/coo/bill-transfer", response_model=CoOFlowResponse)
-def coo_bill_transfer_http():
-    return _coo_call("coo.bill-transfer")
+async def coo_bill_transfer_http():
+    return await _coo_call("coo.bill-transfer")
 
 
 @app.post("/coo/reset", response_model=CoOFlowResponse)
-def coo_reset_http():
-    return _coo_call("coo.reset")
+async def coo_reset_http():
+    return await _coo_call("coo.reset")
 
 
 @app.post("/context/add")
@@ -1587,16 +1753,30 @@ def context_add(req: ContextAddRequest):
 class UberRequest(BaseModel):
     patient_id: Optional[str] = None
     purpose: Optional[str] = None
+    # Cohort transport planning: hospitals to pick up from and homes /
+    # hotels to drop off at, answered with one maps.distance_matrix call.
+    pickups: Optional[List[str]] = None
+    dropoffs: Optional[List[str]] = None
 
 
 @app.post("/demo/uber")
-def demo_uber(req: UberRequest):
+async def demo_uber(req: UberRequest):
     pid = req.patient_id or "123"
     purpose = req.purpose or "discharge_transport"
+    travel = None
+    if req.pickups and req.dropoffs:
+        try:
+            maps = make_async_maps_client()
+            travel = await maps.call(
+                "maps.distance_matrix",
+                {"origins": req.pickups, "destinations": req.dropoffs},
+            )
+        except Exception:
+            # No Maps MCP or no offline graph: the mock booking still works.
+            travel = None
     # Mock booking details
-    ts = int(time.time())
     booking = {
-        "id": f"UB{ts % 100000}",
+        "id": new_id("UB"),
         "service": "uber",
         "status": "confirmed",
         "eta_min": 7,
@@ -1605,7 +1785,10 @@ def demo_uber(req: UberRequest):
         "driver": {"name": "Sam K", "rating": 4.9},
         "vehicle": {"make": "Toyota", "model": "Camry", "plate": "UBR-123"},
     }
-    return {"patient_id": pid, "purpose": purpose, "booking": booking}
+    out = {"patient_id": pid, "purpose": purpose, "booking": booking}
+    if travel is not None:
+        out["travel_matrix"] = travel
+    return out
 
 
 # ======================